@@ -0,0 +1,48 @@
+import asyncio
+import logging
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+
+class UserTaskRunner:
+    """Фоновые задачи пользователей: новое действие отменяет незавершенное предыдущее"""
+
+    def __init__(self):
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def schedule(self, user_id: int, coro) -> asyncio.Task:
+        previous = self._tasks.get(user_id)
+        if previous and not previous.done():
+            previous.cancel()
+
+        task = asyncio.create_task(self._run(user_id, coro))
+        self._tasks[user_id] = task
+        task.add_done_callback(lambda t: self._forget(user_id, t))
+        return task
+
+    async def _run(self, user_id, coro):
+        try:
+            await coro
+        except asyncio.CancelledError:
+            logger.info(f"Фоновая задача пользователя {user_id} отменена более новым действием")
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка в фоновой задаче пользователя {user_id}: {e}")
+
+    def _forget(self, user_id, task):
+        if self._tasks.get(user_id) is task:
+            del self._tasks[user_id]
+
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    async def shutdown(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+
+user_tasks = UserTaskRunner()
@@ -0,0 +1,57 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BatchLoader:
+    """Собирает точечные запросы одного тика цикла событий в один пакетный.
+
+    batch_fn получает список уникальных ключей и возвращает словарь
+    ключ -> значение; отсутствующие ключи разрешаются в None.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=500):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self._pending = {}
+        # Цикл событий держит на задачи только слабые ссылки: без этого набора
+        # пакет мог бы собраться сборщиком мусора, не успев разрешить future
+        self._tasks = set()
+
+    def load(self, key):
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            if not self._pending:
+                loop.call_soon(self._dispatch)
+            self._pending[key] = future
+        # shield: отмена одного ожидающего не должна отменять общий результат
+        return asyncio.shield(future)
+
+    async def load_many(self, keys):
+        return await asyncio.gather(*(self.load(key) for key in keys))
+
+    def _dispatch(self):
+        pending, self._pending = self._pending, {}
+        keys = list(pending)
+        for i in range(0, len(keys), self.max_batch_size):
+            chunk = {key: pending[key] for key in keys[i:i + self.max_batch_size]}
+            task = asyncio.create_task(self._resolve(chunk))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _resolve(self, chunk):
+        try:
+            results = await self.batch_fn(list(chunk))
+        except Exception as e:
+            logger.error(f"Ошибка пакетной загрузки: {e}")
+            for future in chunk.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for key, future in chunk.items():
+            if not future.done():
+                future.set_result(results.get(key))
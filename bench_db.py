@@ -0,0 +1,577 @@
+"""Бенчмарк хранилища на синтетических данных промышленного объема.
+
+    python bench_db.py generate bench.db --users 20000 --tasks-per-user 100 --months 24
+    python bench_db.py run bench.db --concurrency 1,16 --json results/before.json
+    python bench_db.py run memory --users 2000 --tasks-per-user 50
+    python bench_db.py compare results/before.json results/after.json
+
+generate строит набор данных, детерминированный по --seed и --anchor:
+пользователи, задачи за --months месяцев, занятые дни, серии, группы и
+сводки. Данные пишутся через методы хранилища (import_batch и другие),
+поэтому сводки, версии месяцев и поисковый индекс строят те же триггеры,
+что в работе. Рядом сохраняется описание набора (.meta.json).
+
+run копирует набор во временный файл и замеряет каждый метод хранилища:
+операций в секунду и перцентили задержки, для каждого уровня
+параллельности из --concurrency. Для SQLite печатаются планы (EXPLAIN QUERY
+PLAN) всех выполненных запросов, полные просмотры таблиц помечаются.
+Вместо файла можно указать memory - тогда набор генерируется в
+MemoryBackend. compare сравнивает два сохраненных прогона.
+"""
+import argparse
+import asyncio
+from contextvars import ContextVar
+from datetime import date, datetime, timedelta
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiosqlite
+
+from database import SQLiteBackend
+from memory_backend import MemoryBackend
+from recurrence import FREQUENCIES
+from sharding import ShardedBackend, shard_paths
+
+FIRST_USER_ID = 1_000_000
+TIMEZONES = ('Europe/Moscow', 'Europe/Kaliningrad', 'Asia/Yekaterinburg', 'Asia/Novosibirsk', 'Asia/Vladivostok')
+WORDS = (
+    'созвон', 'отчет', 'купить', 'молоко', 'врач', 'тренировка', 'встреча', 'проект', 'дедлайн',
+    'подарок', 'билеты', 'стоматолог', 'ремонт', 'meeting', 'review', 'release', 'спортзал', 'мама',
+)
+IMPORT_CONCURRENCY = 64
+
+
+def month_offset(anchor, months):
+    index = anchor.year * 12 + anchor.month - 1 + months
+    return index // 12, index % 12 + 1
+
+
+def dataset_months(meta):
+    """Месяцы набора: --months назад от anchor и один вперед"""
+    anchor = date.fromisoformat(meta['anchor'])
+    return [month_offset(anchor, offset) for offset in range(-meta['months'] + 1, 2)]
+
+
+def user_ids(meta):
+    return range(FIRST_USER_ID, FIRST_USER_ID + meta['users'])
+
+
+def random_time(rng):
+    return f"{rng.randint(7, 22):02d}:{rng.choice((0, 15, 30, 45)):02d}"
+
+
+def random_text(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+
+
+def user_rows(meta, index):
+    """Детерминированные данные одного пользователя: (профиль, задачи, занятые дни, серии, группа, сводка)"""
+    rng = random.Random(meta['seed'] * 1_000_003 + index)
+    months = dataset_months(meta)
+    tasks = []
+    for number in range(meta['tasks_per_user']):
+        year, month = rng.choice(months)
+        day = rng.randint(1, 28)
+        tasks.append((year, month, day, random_text(rng), random_time(rng), rng.choice((0, 15, 60, 1440)),
+                      f"bench-{index}-{number}"))
+    busy_days = [
+        (year, month, rng.randint(1, 28))
+        for year, month in months for _ in range(meta['busy_days_per_month'])
+    ]
+    series = []
+    if rng.random() < meta['series_share']:
+        year, month = rng.choice(months)
+        series.append((year, month, rng.randint(1, 28), random_text(rng), random_time(rng), 15,
+                       rng.choice(FREQUENCIES)))
+    group = None
+    if meta['users'] > 5 and rng.random() < meta['group_share']:
+        members = rng.sample(range(meta['users']), 4)
+        group = (f"Группа {index % 97}", [FIRST_USER_ID + member for member in members])
+    digest = rng.choice(('08:00', '09:00')) if rng.random() < meta['digest_share'] else None
+    profile = (f"user{index}", f"Пользователь {index}", rng.choice(('meeting', 'todo')), rng.choice(TIMEZONES))
+    return profile, tasks, busy_days, series, group, digest
+
+
+async def fill(db, meta, progress=True):
+    """Записывает набор в хранилище через его же методы"""
+    started = time.monotonic()
+    semaphore = asyncio.Semaphore(IMPORT_CONCURRENCY)
+
+    async def one(index):
+        async with semaphore:
+            (username, full_name, mode, user_timezone), tasks, busy_days, series, group, digest = user_rows(meta, index)
+            user_id = FIRST_USER_ID + index
+            await db.add_user(user_id, username, full_name)
+            await db.set_user_mode(user_id, mode)
+            await db.set_user_timezone(user_id, user_timezone)
+            await db.import_batch(user_id, tasks, busy_days)
+            for year, month, day, text, task_time, reminder, freq in series:
+                await db.add_task_series(user_id, year, month, day, text, task_time, reminder, freq)
+            if group:
+                await db.save_group(user_id, group[0], group[1])
+            if digest:
+                await db.set_user_digest(user_id, digest)
+
+    step = max(1, meta['users'] // 20)
+    for first in range(0, meta['users'], step):
+        await asyncio.gather(*(one(index) for index in range(first, min(first + step, meta['users']))))
+        if progress:
+            done = min(first + step, meta['users'])
+            print(f"  {done}/{meta['users']} пользователей, {time.monotonic() - started:.0f} с", flush=True)
+
+
+def open_backend(path, shards):
+    if path == 'memory':
+        return MemoryBackend('memory://bench')
+    if shards > 1:
+        return ShardedBackend(path, shards)
+    return SQLiteBackend(path)
+
+
+def backend_files(path, shards):
+    return [
+        file_path
+        for shard_path in shard_paths(path, shards)
+        for file_path in (shard_path, shard_path + '-wal', shard_path + '-shm')
+        if os.path.exists(file_path)
+    ]
+
+
+async def generate(args):
+    meta = {
+        'users': args.users, 'tasks_per_user': args.tasks_per_user, 'months': args.months,
+        'busy_days_per_month': args.busy_days_per_month, 'series_share': args.series_share,
+        'group_share': args.group_share, 'digest_share': args.digest_share,
+        'seed': args.seed, 'anchor': (args.anchor or date.today()).isoformat(), 'shards': args.shards,
+    }
+    if backend_files(args.path, args.shards):
+        sys.exit(f"{args.path} уже существует, выберите другой путь")
+    db = open_backend(args.path, args.shards)
+    await db.init_db()
+    await db.start_writer()
+    print(f"Генерация: {meta['users']} пользователей по {meta['tasks_per_user']} задач за {meta['months']} мес.")
+    try:
+        await fill(db, meta)
+    finally:
+        await db.stop_writer()
+    with open(args.path + '.meta.json', 'w', encoding='utf-8') as output:
+        json.dump(meta, output, ensure_ascii=False, indent=2)
+    print(f"Готово: {args.path}, описание в {args.path}.meta.json")
+
+
+# Какой сценарий сейчас выполняется: запросы SQLite собираются по нему для EXPLAIN
+current_case: ContextVar = ContextVar('bench_case', default=None)
+
+
+class QueryRecorder:
+    """Собирает запросы, которые выполняют методы хранилища, для EXPLAIN QUERY PLAN"""
+
+    def __init__(self):
+        self.queries = {}
+        self._originals = None
+
+    def install(self):
+        recorder = self
+        execute, executemany = aiosqlite.Connection.execute, aiosqlite.Connection.executemany
+
+        async def recording_execute(conn, sql, parameters=None):
+            recorder.record(sql, parameters)
+            return await execute(conn, sql, parameters)
+
+        async def recording_executemany(conn, sql, parameters):
+            parameters = list(parameters)
+            recorder.record(sql, parameters[0] if parameters else None)
+            return await executemany(conn, sql, parameters)
+
+        self._originals = execute, executemany
+        aiosqlite.Connection.execute = recording_execute
+        aiosqlite.Connection.executemany = recording_executemany
+
+    def uninstall(self):
+        if self._originals:
+            aiosqlite.Connection.execute, aiosqlite.Connection.executemany = self._originals
+            self._originals = None
+
+    def record(self, sql, parameters):
+        case = current_case.get()
+        if case is None or sql.lstrip().upper().startswith(('BEGIN', 'PRAGMA', 'COMMIT', 'ROLLBACK')):
+            return
+        self.queries.setdefault(case, {}).setdefault(' '.join(sql.split()), tuple(parameters or ()))
+
+
+def explain(db_path, queries):
+    """{запрос: (строки плана, есть ли полный просмотр)}"""
+    plans = {}
+    with sqlite3.connect(db_path) as conn:
+        for sql, parameters in queries.items():
+            try:
+                rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+            except sqlite3.Error as e:
+                plans[sql] = ([f"не удалось: {e}"], False)
+                continue
+            lines = [row[-1] for row in rows]
+            full_scan = any(
+                line.startswith('SCAN ') and 'VIRTUAL TABLE' not in line and 'USING' not in line
+                for line in lines
+            )
+            plans[sql] = (lines, full_scan)
+    return plans
+
+
+class Context:
+    """Что нужно сценариям: пользователи, месяцы и id задач, найденные перед замером"""
+
+    def __init__(self, meta, rng):
+        self.meta = meta
+        self.rng = rng
+        self.users = list(user_ids(meta))
+        self.months = dataset_months(meta)
+        self.anchor = date.fromisoformat(meta['anchor'])
+        self.task_ids = []
+        self.series_ids = []
+        self.group_ids = []
+        self.next_user = FIRST_USER_ID + meta['users']
+
+    def user(self):
+        return self.rng.choice(self.users)
+
+    def month(self):
+        return self.rng.choice(self.months)
+
+    def day(self):
+        year, month = self.month()
+        return year, month, self.rng.randint(1, 28)
+
+    def take(self, items):
+        return items.pop() if items else 0
+
+
+async def prepare(db, ctx, sample=300):
+    for user_id in ctx.rng.sample(ctx.users, min(sample, len(ctx.users))):
+        first, last = ctx.months[0], ctx.months[-1]
+        tasks = await db.get_tasks_between(user_id, date(*first, 1), date(*last, 28))
+        ctx.task_ids.extend(task['id'] for task in tasks)
+        ctx.group_ids.extend(group['id'] for group in await db.get_user_groups(user_id))
+    ctx.rng.shuffle(ctx.task_ids)
+
+
+def build_cases(db, ctx):
+    """(имя, операция, доля от --ops). Операция - корутина-функция без аргументов"""
+    rng = ctx.rng
+
+    async def add_user():
+        ctx.next_user += 1
+        await db.add_user(ctx.next_user, f"new{ctx.next_user}", "Новый")
+
+    async def add_task_series():
+        ctx.series_ids.append(await db.add_task_series(
+            ctx.user(), *ctx.day(), random_text(rng), random_time(rng), 15, rng.choice(FREQUENCIES)
+        ))
+
+    async def skip_occurrences():
+        if ctx.series_ids:
+            await db.skip_occurrences(rng.choice(ctx.series_ids), [date(*ctx.day())])
+
+    async def delete_series():
+        await db.delete_series(ctx.take(ctx.series_ids))
+
+    async def save_group():
+        ctx.group_ids.append(await db.save_group(ctx.user(), f"Бенч {rng.randint(1, 5)}", rng.sample(ctx.users, 5)))
+
+    async def mark_digests_sent():
+        await db.mark_digests_sent(await db.get_due_digests())
+
+    async def mark_series_reminder_sent():
+        due = await db.get_series_for_reminders()
+        for item in due[:10]:
+            await db.mark_series_reminder_sent(item['id'], item['reminder_at'])
+
+    async def mark_reminder_sent():
+        await db.mark_reminder_sent(rng.choice(ctx.task_ids) if ctx.task_ids else 0)
+
+    def months_window():
+        first = date(*ctx.months[0], 1)
+        return first, first + timedelta(days=365)
+
+    def usernames(count):
+        return [f"user{rng.randrange(ctx.meta['users'])}" for _ in range(count)]
+
+    return [
+        # Пользователи
+        ('get_user_profile', lambda: db.get_user_profile(ctx.user()), 1),
+        ('user_exists', lambda: db.user_exists(ctx.user()), 1),
+        ('get_user_mode', lambda: db.get_user_mode(ctx.user()), 1),
+        ('get_user_reminder', lambda: db.get_user_reminder(ctx.user()), 1),
+        ('get_user_timezone', lambda: db.get_user_timezone(ctx.user()), 1),
+        ('get_user_theme', lambda: db.get_user_theme(ctx.user()), 1),
+        ('add_user', add_user, 1),
+        ('set_user_mode', lambda: db.set_user_mode(ctx.user(), rng.choice(('meeting', 'todo'))), 1),
+        ('set_user_reminder', lambda: db.set_user_reminder(ctx.user(), rng.choice((15, 60))), 1),
+        ('set_user_timezone', lambda: db.set_user_timezone(ctx.user(), rng.choice(TIMEZONES)), 1),
+        ('set_user_theme', lambda: db.set_user_theme(ctx.user(), rng.choice(('default', 'blue'))), 1),
+        ('set_user_digest', lambda: db.set_user_digest(ctx.user(), rng.choice((None, '08:00'))), 1),
+        ('get_due_digests', db.get_due_digests, 0.1),
+        ('mark_digests_sent', mark_digests_sent, 0.05),
+        ('get_user_ids_by_usernames', lambda: db.get_user_ids_by_usernames(usernames(5)), 1),
+        ('list_users', db.list_users, 0.01),
+        # Дни календаря
+        ('mark_day_busy', lambda: db.mark_day_busy(ctx.user(), *ctx.day()), 1),
+        ('mark_day_free', lambda: db.mark_day_free(ctx.user(), *ctx.day()), 1),
+        ('reset_user_calendar', lambda: db.reset_user_calendar(ctx.user(), *ctx.month()), 0.2),
+        ('get_user_calendar', lambda: db.get_user_calendar(ctx.user(), *reversed(ctx.month())), 1),
+        ('get_month_version', lambda: db.get_month_version(ctx.user(), *ctx.month()), 1),
+        ('get_month_versions', lambda: db.get_month_versions(rng.sample(ctx.users, 20), *ctx.month()), 1),
+        ('get_user_month_versions', lambda: db.get_user_month_versions(ctx.user(), ctx.months[0], ctx.months[-1]), 1),
+        ('find_common_free_days.5', lambda: db.find_common_free_days(rng.sample(ctx.users, 5), *ctx.month()), 1),
+        ('find_common_free_days.20', lambda: db.find_common_free_days(rng.sample(ctx.users, 20), *ctx.month()), 1),
+        ('get_month_busy_days', lambda: db.get_month_busy_days(rng.sample(ctx.users, 5), *ctx.month()), 1),
+        ('get_busy_days_between', lambda: db.get_busy_days_between(ctx.user(), *months_window()), 1),
+        # Повторяющиеся задачи
+        ('add_task_series', add_task_series, 0.5),
+        ('get_series_between', lambda: db.get_series_between(ctx.user(), *months_window()), 1),
+        ('skip_occurrences', skip_occurrences, 0.5),
+        ('get_series_for_reminders', db.get_series_for_reminders, 0.1),
+        ('mark_series_reminder_sent', mark_series_reminder_sent, 0.05),
+        ('delete_series', delete_series, 0.5),
+        # Группы
+        ('save_group', save_group, 0.5),
+        ('get_user_groups', lambda: db.get_user_groups(ctx.user()), 1),
+        ('get_group', lambda: db.get_group(rng.choice(ctx.group_ids) if ctx.group_ids else 0), 1),
+        ('delete_group', lambda: db.delete_group(ctx.take(ctx.group_ids)), 0.2),
+        # Задачи
+        ('add_task', lambda: db.add_task(ctx.user(), *ctx.day(), random_text(rng), random_time(rng), 15), 1),
+        ('import_batch', lambda: db.import_batch(
+            ctx.user(), [(*ctx.day(), random_text(rng), random_time(rng), 15, None) for _ in range(10)], [ctx.day()]
+        ), 0.2),
+        ('get_tasks_for_day', lambda: db.get_tasks_for_day(ctx.user(), *ctx.day()), 1),
+        ('get_tasks_page', lambda: db.get_tasks_page(ctx.user(), *ctx.day()), 1),
+        ('get_task_by_id', lambda: db.get_task_by_id(rng.choice(ctx.task_ids) if ctx.task_ids else 0), 1),
+        ('search_tasks', lambda: db.search_tasks(ctx.user(), rng.choice(WORDS)), 1),
+        ('get_tasks_between', lambda: db.get_tasks_between(ctx.user(), *months_window()), 1),
+        ('get_tasks_for_reminders', db.get_tasks_for_reminders, 0.1),
+        ('mark_reminder_sent', mark_reminder_sent, 1),
+        ('delete_task', lambda: db.delete_task(ctx.take(ctx.task_ids)), 1),
+        # Чистка: один проход по всем таблицам
+        ('cleanup_old_data', lambda: db.cleanup_old_data(pause=0), 0),
+    ]
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+async def measure(name, operation, count, concurrency):
+    """Выполняет count операций в concurrency параллельных потоках"""
+    latencies = []
+    remaining = iter(range(count))
+
+    async def worker():
+        token = current_case.set(name)
+        try:
+            for _ in remaining:
+                started = time.perf_counter()
+                await operation()
+                latencies.append(time.perf_counter() - started)
+        finally:
+            current_case.reset(token)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    return {
+        'case': name, 'concurrency': concurrency, 'ops': len(latencies),
+        'ops_per_second': len(latencies) / wall if wall else 0.0,
+        'p50': percentile(latencies, 0.5), 'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99), 'max': max(latencies, default=0.0),
+    }
+
+
+def print_results(results):
+    print(f"{'метод':<28}{'пот.':>5}{'опер.':>7}{'опер/с':>10}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  мс")
+    for row in results:
+        print(f"{row['case']:<28}{row['concurrency']:>5}{row['ops']:>7}{row['ops_per_second']:>10.0f}" + ''.join(
+            f"{row[key] * 1000:>9.2f}" for key in ('p50', 'p95', 'p99', 'max')
+        ))
+
+
+def print_plans(plans, only_flagged=True):
+    flagged = 0
+    for case, queries in plans.items():
+        for sql, (lines, full_scan) in queries.items():
+            if full_scan:
+                flagged += 1
+            if full_scan or not only_flagged:
+                marker = '!! ПОЛНЫЙ ПРОСМОТР' if full_scan else ''
+                print(f"\n[{case}] {marker}\n  {sql}")
+                for line in lines:
+                    print(f"    {line}")
+    print(f"\nЗапросов с полным просмотром таблицы: {flagged}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix='calendar-bench-')
+    recorder = QueryRecorder()
+    try:
+        if args.path == 'memory':
+            meta = {
+                'users': args.users, 'tasks_per_user': args.tasks_per_user, 'months': args.months,
+                'busy_days_per_month': args.busy_days_per_month, 'series_share': args.series_share,
+                'group_share': args.group_share, 'digest_share': args.digest_share,
+                'seed': args.seed, 'anchor': (args.anchor or date.today()).isoformat(), 'shards': 1,
+            }
+            db = open_backend('memory', 1)
+            await db.init_db()
+            await db.start_writer()
+            print(f"Генерация в памяти: {meta['users']} пользователей по {meta['tasks_per_user']} задач")
+            await fill(db, meta, progress=False)
+            scratch = None
+        else:
+            with open(args.path + '.meta.json', encoding='utf-8') as source:
+                meta = json.load(source)
+            # Замеры пишут в базу, поэтому работаем с копией
+            scratch = os.path.join(workdir, os.path.basename(args.path))
+            for path in shard_paths(args.path, meta['shards']):
+                for suffix in ('', '-wal'):
+                    if os.path.exists(path + suffix):
+                        shutil.copy(path + suffix, os.path.join(workdir, os.path.basename(path) + suffix))
+            db = open_backend(scratch, meta['shards'])
+            await db.init_db()
+            await db.start_writer()
+            recorder.install()
+
+        ctx = Context(meta, random.Random(args.seed))
+        await prepare(db, ctx)
+        cases = build_cases(db, ctx)
+        if args.only:
+            wanted = set(args.only.split(','))
+            cases = [case for case in cases if case[0] in wanted or case[0].split('.')[0] in wanted]
+        levels = [int(level) for level in args.concurrency.split(',')]
+
+        results = []
+        for name, operation, share in cases:
+            count = max(1, int(args.ops * share))
+            for level in levels:
+                if count < level and level > 1:
+                    continue
+                results.append(await measure(name, operation, count, level))
+                if args.verbose:
+                    print_results(results[-1:])
+        await db.stop_writer()
+    finally:
+        recorder.uninstall()
+
+    print_results(results)
+    plans = {}
+    if scratch:
+        plan_path = shard_paths(scratch, meta['shards'])[0]
+        plans = {case: explain(plan_path, queries) for case, queries in recorder.queries.items()}
+        print_plans(plans, only_flagged=not args.all_plans)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, 'w', encoding='utf-8') as output:
+            json.dump({
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'revision': git_revision(),
+                'backend': 'memory' if args.path == 'memory' else ('sharded' if meta['shards'] > 1 else 'sqlite'),
+                'sqlite_version': sqlite3.sqlite_version,
+                'python': platform.python_version(),
+                'dataset': meta,
+                'ops': args.ops,
+                'results': results,
+                'plans': {
+                    case: {sql: {'plan': lines, 'full_scan': full_scan} for sql, (lines, full_scan) in queries.items()}
+                    for case, queries in plans.items()
+                },
+            }, output, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.json}")
+
+
+def compare(args):
+    with open(args.before, encoding='utf-8') as source:
+        before = json.load(source)
+    with open(args.after, encoding='utf-8') as source:
+        after = json.load(source)
+    print(f"До: {before.get('revision')} {before['created_at']}, после: {after.get('revision')} {after['created_at']}")
+    if before['dataset'] != after['dataset']:
+        print("Внимание: наборы данных различаются, сравнение условное")
+    old = {(row['case'], row['concurrency']): row for row in before['results']}
+    print(f"{'метод':<28}{'пот.':>5}{'опер/с до':>11}{'после':>9}{'изм.':>8}{'p95 до':>9}{'после':>9}{'изм.':>8}")
+    for row in after['results']:
+        previous = old.get((row['case'], row['concurrency']))
+        if previous is None:
+            continue
+        ops_change = (row['ops_per_second'] / previous['ops_per_second'] - 1) if previous['ops_per_second'] else 0.0
+        p95_change = (row['p95'] / previous['p95'] - 1) if previous['p95'] else 0.0
+        # Рост p95 больше порога - вероятная регрессия
+        marker = '  !!' if p95_change > args.threshold else ''
+        print(f"{row['case']:<28}{row['concurrency']:>5}{previous['ops_per_second']:>11.0f}"
+              f"{row['ops_per_second']:>9.0f}{ops_change:>+8.0%}{previous['p95'] * 1000:>9.2f}"
+              f"{row['p95'] * 1000:>9.2f}{p95_change:>+8.0%}{marker}")
+
+
+def add_dataset_arguments(parser):
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--tasks-per-user', type=int, default=100)
+    parser.add_argument('--months', type=int, default=12, help="сколько месяцев истории до --anchor")
+    parser.add_argument('--busy-days-per-month', type=int, default=4)
+    parser.add_argument('--series-share', type=float, default=0.2, help="доля пользователей с серией")
+    parser.add_argument('--group-share', type=float, default=0.3, help="доля пользователей с сохраненной группой")
+    parser.add_argument('--digest-share', type=float, default=0.1, help="доля пользователей со сводкой дня")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--anchor', type=date.fromisoformat, help="текущая дата набора (по умолчанию сегодня)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк хранилища бота")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = commands.add_parser('generate', help="построить набор данных")
+    generate_parser.add_argument('path', help="файл БД набора (не должен существовать)")
+    generate_parser.add_argument('--shards', type=int, default=1, help="разложить по N шардам, как DB_SHARDS")
+    add_dataset_arguments(generate_parser)
+
+    run_parser = commands.add_parser('run', help="замерить методы хранилища")
+    run_parser.add_argument('path', help="файл набора или memory")
+    run_parser.add_argument('--ops', type=int, default=500, help="операций на метод (тяжелым - меньше)")
+    run_parser.add_argument('--concurrency', default='1,16', help="уровни параллельности через запятую")
+    run_parser.add_argument('--only', help="только эти методы через запятую")
+    run_parser.add_argument('--all-plans', action='store_true', help="печатать все планы, а не только полные просмотры")
+    run_parser.add_argument('--json', help="сохранить результаты для compare")
+    run_parser.add_argument('--verbose', action='store_true', help="печатать результаты по ходу")
+    add_dataset_arguments(run_parser)
+
+    compare_parser = commands.add_parser('compare', help="сравнить два прогона")
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=0.2, help="рост p95, который считается регрессией")
+
+    args = parser.parse_args()
+    if args.command == 'compare':
+        compare(args)
+    else:
+        asyncio.run(generate(args) if args.command == 'generate' else run(args))
+
+
+if __name__ == '__main__':
+    main()
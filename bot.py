@@ -1,17 +1,31 @@
-from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
+from aiogram import Bot, Dispatcher, F, types
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import FSInputFile
-from database import Database
+from database import UserProfile, open_database
+from directory import user_directory
+from feed import feed_builder, feed_url
+from groups import group_availability
+from ics import import_ics
+from recurrence import last_occurrence, occurrences_between
 from calendar_generator import calendar_gen
+from background import user_tasks
+from gateway import create_session, gateway
+from cache import TTLCache
+from middlewares import CallbackAck, CallbackAckMiddleware, EarlyCallbackAckMiddleware, MetricsMiddleware
 from keyboards import *
-from datetime import datetime
+from datetime import date, datetime, timedelta
 import config
 import logging
+import metrics
+from memstats import memory_monitor
 import asyncio
+import calendar
+import io
 import os
+import tempfile
 import re
 import pytz
 from typing import Dict, List
@@ -19,14 +33,36 @@ from typing import Dict, List
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-bot = Bot(token=config.BOT_TOKEN)
+# Все исходящие запросы идут через gateway: лимиты, приоритеты, retry_after
+bot = Bot(token=config.BOT_TOKEN, session=create_session())
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
-db = Database()
+dp.callback_query.outer_middleware(CallbackAckMiddleware())
+dp.callback_query.middleware(EarlyCallbackAckMiddleware())
+dp.message.middleware(MetricsMiddleware())
+dp.callback_query.middleware(MetricsMiddleware())
+db = open_database()
 
 
 user_last_messages: Dict[int, List[int]] = {}
 
+# Последний отправленный календарь пользователя: данные и file_id картинки в Telegram
+rendered_calendars = TTLCache(config.RENDER_CACHE_SIZE, config.RENDER_CACHE_TTL)
+
+metrics.queue_depth.set_function(user_tasks.pending, 'background_tasks')
+metrics.queue_depth.set_function(lambda: len(user_last_messages), 'tracked_chats')
+
+memory_monitor.register('tracked_chats', lambda: len(user_last_messages))
+memory_monitor.register('tracked_messages', lambda: sum(map(len, user_last_messages.values())))
+memory_monitor.register('fsm_storage', lambda: len(storage.storage))
+memory_monitor.register('rendered_calendars', lambda: len(rendered_calendars))
+memory_monitor.register('background_tasks', user_tasks.pending)
+memory_monitor.register('gateway_chats', lambda: len(gateway.chats))
+memory_monitor.register('user_directory', lambda: len(user_directory))
+memory_monitor.register('group_member_cache', lambda: len(group_availability.members))
+memory_monitor.register('group_result_cache', lambda: len(group_availability.results))
+memory_monitor.register('feed_month_cache', lambda: len(feed_builder.months))
+
 
 class CalendarStates(StatesGroup):
     SELECT_TIMEZONE = State()
@@ -37,6 +73,7 @@ class CalendarStates(StatesGroup):
     TASK_NAME_INPUT = State()
     TASK_TIME_SELECT = State()
     TASK_REMINDER_SELECT = State()
+    TASK_REPEAT_SELECT = State()
     EDIT_TASKS_MODE = State()
     TASK_EDIT_MODE = State()
     DAY_TASKS_VIEW = State()
@@ -85,6 +122,22 @@ async def save_and_send_photo(chat_id: int, **kwargs) -> types.Message:
     
     return message
 
+def shorten(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit - 1] + '…'
+
+def format_settings_text(profile: UserProfile) -> str:
+    if profile is None:
+        profile = UserProfile(user_id=0, username='', full_name='')
+    return (
+        f"⚙️ Настройки:\n"
+        f"• Режим: {'встречи' if profile.mode == 'meeting' else 'to-do'}\n"
+        f"• Напоминание за: {profile.reminder} мин\n"
+        f"• Часовой пояс: {profile.timezone}\n"
+        f"• Тема: {profile.theme}\n"
+        f"• Сводка дня: {profile.digest_time or 'выключена'}\n\n"
+        "Выберите действие:"
+    )
+
 async def send_main_menu(chat_id, user_id):
     await cleanup_user_messages(chat_id)
     user_mode = await db.get_user_mode(user_id)
@@ -104,6 +157,7 @@ async def start_command(message: types.Message, state: FSMContext):
     
     if not await db.user_exists(user_id):
         await db.add_user(user_id, username, full_name)
+        user_directory.add(user_id, username, full_name)
         await state.set_state(CalendarStates.SELECT_TIMEZONE)
         await save_and_send(
             message.chat.id,
@@ -114,30 +168,141 @@ async def start_command(message: types.Message, state: FSMContext):
         await state.set_state(CalendarStates.MAIN_MENU)
         await send_main_menu(message.chat.id, user_id)
 
+@dp.message(Command("search"))
+async def search_command(message: types.Message, command: CommandObject):
+    query = (command.args or '').strip()
+    if not query:
+        await save_and_send(
+            message.chat.id,
+            text="🔍 Введите текст после команды.\nПример: /search молоко"
+        )
+        return
+    
+    tasks = await db.search_tasks(message.from_user.id, query)
+    # Запрос и задачи - свободный текст, а сообщение Telegram не длиннее 4096 символов
+    query = shorten(query, 100)
+    if not tasks:
+        await save_and_send(message.chat.id, text=f"🔍 По запросу «{query}» задач не найдено.")
+        return
+    
+    text = f"🔍 Найдено по запросу «{query}»:\n"
+    for task in tasks:
+        line = f"• {task['day']:02d}.{task['month']:02d}.{task['year']} {task['time']} — {shorten(task['task'], 100)}\n"
+        if len(text) + len(line) > 4000:
+            break
+        text += line
+    await save_and_send(message.chat.id, text=text)
+
+@dp.callback_query(F.data.startswith('group_'))
+async def process_saved_group(callback_query: types.CallbackQuery, state: FSMContext):
+    user_id = callback_query.from_user.id
+    action, _, group_id = callback_query.data[len('group_'):].partition('_')
+    user_tasks.schedule(user_id, open_saved_group(callback_query.message, user_id, action, int(group_id), state))
+
+async def open_saved_group(message: types.Message, user_id, action, group_id, state: FSMContext):
+    """Удаляет сохраненную группу или показывает ее общие свободные дни"""
+    group = await db.get_group(group_id)
+    if group is None or group['user_id'] != user_id:
+        await bot.send_message(message.chat.id, "Группа не найдена.")
+        return
+    
+    if action == 'delete':
+        await db.delete_group(group['id'])
+        groups = await db.get_user_groups(user_id)
+        await bot.edit_message_reply_markup(
+            chat_id=message.chat.id,
+            message_id=message.message_id,
+            reply_markup=create_saved_groups_keyboard(groups) if groups else None
+        )
+        return
+    
+    if await send_common_free_days(message.chat.id, user_id, group['user_ids']):
+        await state.set_state(CalendarStates.MAIN_MENU)
+        await send_main_menu(message.chat.id, user_id)
+
+@dp.message(Command("import"))
+async def import_command(message: types.Message):
+    await save_and_send(
+        message.chat.id,
+        text="📥 Отправьте файл .ics, выгруженный из Google Календаря, Outlook или Apple Календаря.\n"
+             "События со временем станут задачами, события на весь день - занятыми днями."
+    )
+
+@dp.message(Command("feed"))
+async def feed_command(message: types.Message):
+    url = feed_url(message.from_user.id)
+    if not url:
+        await save_and_send(message.chat.id, text="❌ Подписка на календарь не настроена.")
+        return
+    if not await db.user_exists(message.from_user.id):
+        await save_and_send(message.chat.id, text="Сначала выполните /start")
+        return
+    await save_and_send(
+        message.chat.id,
+        text="🔗 Ссылка для подписки на календарь (Google, Apple, Outlook):\n"
+             f"{url}\n\n"
+             "Задачи и занятые дни будут обновляться сами. Не передавайте ссылку другим."
+    )
+
+@dp.message(F.document)
+async def import_calendar_file(message: types.Message):
+    user_id = message.from_user.id
+    document = message.document
+    
+    if not (document.file_name or '').lower().endswith('.ics') and document.mime_type != 'text/calendar':
+        await save_and_send(message.chat.id, text="❌ Можно импортировать только файл календаря .ics")
+        return
+    if not await db.user_exists(user_id):
+        await save_and_send(message.chat.id, text="Сначала выполните /start")
+        return
+    if document.file_size and document.file_size > config.ICS_IMPORT_MAX_BYTES:
+        await save_and_send(message.chat.id, text="❌ Файл слишком большой для импорта.")
+        return
+    
+    await save_and_send(message.chat.id, text="⏳ Импортирую календарь...")
+    since = datetime.now().date() - timedelta(days=config.RETENTION_TASK_DAYS)
+    try:
+        # Файл лежит на диске и читается построчно, в памяти только текущая пачка событий
+        with tempfile.TemporaryFile() as buffer:
+            await bot.download(document, destination=buffer)
+            lines = io.TextIOWrapper(buffer, encoding='utf-8-sig', errors='replace', newline='')
+            stats = await import_ics(db, user_id, lines, config.ICS_IMPORT_BATCH_SIZE, since)
+    except Exception as e:
+        logger.error(f"Ошибка импорта календаря пользователя {user_id}: {e}")
+        await save_and_send(message.chat.id, text="❌ Не удалось импортировать файл.")
+        return
+    
+    logger.info(f"Импорт календаря пользователя {user_id}: {stats}")
+    text = f"✅ Импорт завершен.\nЗадач добавлено: {stats['tasks']}\nЗанятых дней добавлено: {stats['busy_days']}"
+    if stats['skipped']:
+        text += f"\nПропущено событий (прошедшие или без даты): {stats['skipped']}"
+    await save_and_send(message.chat.id, text=text)
+
 @dp.callback_query(CalendarStates.SELECT_TIMEZONE)
-async def process_timezone_selection(callback_query: types.CallbackQuery, state: FSMContext):
+async def process_timezone_selection(callback_query: types.CallbackQuery, state: FSMContext, ack: CallbackAck):
     data = callback_query.data
     if data.startswith('tz_'):
         tz = data[3:]
         user_id = callback_query.from_user.id
         
         if tz == 'other':
+            await ack()
             await state.set_state(CalendarStates.TIMEZONE_INPUT)
-            await save_and_send(
+            user_tasks.schedule(user_id, save_and_send(
                 callback_query.message.chat.id,
                 text="🌍 Введите ваш часовой пояс в формате:\nПример: Europe/Moscow, Asia/Tokyo"
-            )
+            ))
         else:
+            await ack(f"Часовой пояс установлен: {tz}")
             await db.set_user_timezone(user_id, tz)
-            await bot.answer_callback_query(callback_query.id, f"Часовой пояс установлен: {tz}")
             await state.set_state(CalendarStates.SELECT_MODE)
-            await save_and_send(
+            user_tasks.schedule(user_id, save_and_send(
                 callback_query.message.chat.id,
                 text="👋 Выберите режим работы бота:",
                 reply_markup=create_mode_selection_keyboard()
-            )
+            ))
     else:
-        await bot.answer_callback_query(callback_query.id, "Неверный выбор часового пояса")
+        await ack("Неверный выбор часового пояса")
 
 @dp.message(CalendarStates.TIMEZONE_INPUT)
 async def process_custom_timezone(message: types.Message, state: FSMContext):
@@ -160,15 +325,15 @@ async def process_custom_timezone(message: types.Message, state: FSMContext):
         )
 
 @dp.callback_query(CalendarStates.SELECT_MODE)
-async def process_mode_selection(callback_query: types.CallbackQuery, state: FSMContext):
+async def process_mode_selection(callback_query: types.CallbackQuery, state: FSMContext, ack: CallbackAck):
     user_id = callback_query.from_user.id
     mode = callback_query.data.split('_')[1]
     
+    await ack(f"Режим установлен: {'встречи' if mode == 'meeting' else 'to-do'}")
     await db.set_user_mode(user_id, mode)
-    await bot.answer_callback_query(callback_query.id, f"Режим установлен: {'встречи' if mode == 'meeting' else 'to-do'}")
     
     await state.set_state(CalendarStates.MAIN_MENU)
-    await send_main_menu(callback_query.message.chat.id, user_id)
+    user_tasks.schedule(user_id, send_main_menu(callback_query.message.chat.id, user_id))
 
 @dp.message(CalendarStates.MAIN_MENU)
 async def process_main_menu_message(message: types.Message, state: FSMContext):
@@ -191,28 +356,29 @@ async def process_main_menu_message(message: types.Message, state: FSMContext):
         await state.set_state(CalendarStates.GROUP_MODE)
         await save_and_send(
             message.chat.id,
-            text="👥 Введите @usernames пользователей через пробел (макс. 20):\nПример: @user1 @user2",
+            text="👥 Введите @usernames пользователей через пробел (макс. 20):\nПример: @user1 @user2\n\n"
+                 "Чтобы сохранить группу, начните с названия: Команда @user1 @user2",
             reply_markup=create_group_mode_keyboard()
         )
+        groups = await db.get_user_groups(user_id)
+        if groups:
+            await save_and_send(
+                message.chat.id,
+                text="💾 Сохраненные группы:",
+                reply_markup=create_saved_groups_keyboard(groups)
+            )
+        await save_and_send(
+            message.chat.id,
+            text="🔎 Или нажмите кнопку и начните вводить имя - бот подскажет знакомых ему пользователей. "
+                 "Несколько имен можно ввести через пробел.",
+            reply_markup=create_participant_picker_keyboard()
+        )
     
     elif text == "⚙️ Настройки":
-        user_mode = await db.get_user_mode(user_id)
-        current_reminder = await db.get_user_reminder(user_id)
-        timezone = await db.get_user_timezone(user_id)
-        theme = await db.get_user_theme(user_id)
-        
-        text = (
-            f"⚙️ Настройки:\n"
-            f"• Режим: {'встречи' if user_mode == 'meeting' else 'to-do'}\n"
-            f"• Напоминание за: {current_reminder} мин\n"
-            f"• Часовой пояс: {timezone}\n"
-            f"• Тема: {theme}\n\n"
-            "Выберите действие:"
-        )
-        
+        profile = await db.get_user_profile(user_id)
         await save_and_send(
             message.chat.id,
-            text=text,
+            text=format_settings_text(profile),
             reply_markup=create_settings_reply_keyboard()
         )
         await state.set_state(CalendarStates.SETTINGS_MODE)
@@ -223,75 +389,96 @@ async def show_calendar(chat_id, user_id, mode='normal'):
     month = current_date.month
     theme = await db.get_user_theme(user_id)
     
-    if mode == 'edit':
+    # Версия месяца растет при каждой записи, поэтому совпадение ключа значит,
+    # что и данные, и уже загруженная в Telegram картинка все еще актуальны
+    render_key = (year, month, await db.get_month_version(user_id, year, month), theme)
+    cached = rendered_calendars.get(user_id)
+    if cached and cached['key'] == render_key:
+        busy_days = cached['busy_days']
+    else:
+        cached = None
         calendar_data = await db.get_user_calendar(user_id, month, year)
         busy_days = {day: data for day, data in calendar_data.items() if data['status'] == 'busy' or data.get('task_count', 0) > 0}
+    
+    if mode == 'edit':
         if not busy_days:
-            # Создаем клавиатуру с кнопкой "Назад"
-            builder = InlineKeyboardBuilder()
-            builder.button(text="↩️ Назад", callback_data="back_to_calendar")
             await save_and_send(
                 chat_id,
                 text="В этом месяце нет дней с задачами.",
-                reply_markup=builder.as_markup()
+                reply_markup=create_back_to_calendar_keyboard()
             )
             return
     elif mode == 'delete':
-        calendar_data = await db.get_user_calendar(user_id, month, year)
-        busy_days = {day: data for day, data in calendar_data.items() if data['status'] == 'busy' or data.get('task_count', 0) > 0}
         if not busy_days:
-            # Создаем клавиатуру с кнопкой "Назад"
-            builder = InlineKeyboardBuilder()
-            builder.button(text="↩️ Назад", callback_data="back_to_calendar")
             await save_and_send(
                 chat_id,
                 text="В этом месяце нет дней с задачами для удаления.",
-                reply_markup=builder.as_markup()
+                reply_markup=create_back_to_calendar_keyboard()
             )
             return
-    else:
-        calendar_data = await db.get_user_calendar(user_id, month, year)
-        busy_days = {day: data for day, data in calendar_data.items() if data['status'] == 'busy' or data.get('task_count', 0) > 0}
     
-    calendar_img = calendar_gen.generate_calendar(year, month, busy_days=busy_days, theme=theme)
+    if cached:
+        await save_and_send_photo(
+            chat_id=chat_id,
+            photo=cached['file_id'],
+            reply_markup=create_calendar_keyboard(year, month, busy_days, mode),
+            caption="Выберите день:"
+        )
+        return
     
-    photo = FSInputFile(calendar_img)
-    await save_and_send_photo(
-        chat_id=chat_id,
-        photo=photo,
-        reply_markup=create_calendar_keyboard(year, month, busy_days, mode),
-        caption="Выберите день:"
-    )
-    os.remove(calendar_img)
+    calendar_img = await calendar_gen.render(year, month, busy_days=busy_days, theme=theme)
+    
+    # Отправку может отменить более новое действие пользователя: файл удаляется в любом случае
+    try:
+        message = await save_and_send_photo(
+            chat_id=chat_id,
+            photo=FSInputFile(calendar_img),
+            reply_markup=create_calendar_keyboard(year, month, busy_days, mode),
+            caption="Выберите день:"
+        )
+    finally:
+        os.remove(calendar_img)
+    
+    if message.photo:
+        rendered_calendars.set(user_id, {
+            'key': render_key,
+            'busy_days': busy_days,
+            'file_id': message.photo[-1].file_id
+        })
 
 @dp.callback_query(CalendarStates.CALENDAR_VIEW)
-async def process_calendar_interaction(callback_query: types.CallbackQuery, state: FSMContext):
+async def process_calendar_interaction(callback_query: types.CallbackQuery, state: FSMContext, ack: CallbackAck):
     data = callback_query.data
     user_id = callback_query.from_user.id
+    chat_id = callback_query.message.chat.id
     current_date = datetime.now()
     
     if data == 'reset_all':
+        await ack()
         await state.set_state(CalendarStates.CONFIRM_RESET)
-        await save_and_send(
-            callback_query.message.chat.id,
+        user_tasks.schedule(user_id, save_and_send(
+            chat_id,
             text="⚠️ Вы уверены, что хотите сбросить ВЕСЬ календарь?",
             reply_markup=create_confirmation_keyboard()
-        )
+        ))
         return
     
     elif data == 'edit_tasks':
-        await show_calendar(callback_query.message.chat.id, user_id, mode='edit')
+        await ack()
         await state.set_state(CalendarStates.EDIT_TASKS_MODE)
+        user_tasks.schedule(user_id, show_calendar(chat_id, user_id, mode='edit'))
         return
     
     elif data == 'delete_day_mode':
-        await show_calendar(callback_query.message.chat.id, user_id, mode='delete')
+        await ack()
         await state.set_state(CalendarStates.DELETE_DAY_MODE)
+        user_tasks.schedule(user_id, show_calendar(chat_id, user_id, mode='delete'))
         return
     
     elif data == 'done':
+        await ack()
         await state.set_state(CalendarStates.MAIN_MENU)
-        await send_main_menu(callback_query.message.chat.id, user_id)
+        user_tasks.schedule(user_id, send_main_menu(chat_id, user_id))
         return
     
     if data.startswith('select_day_'):
@@ -299,17 +486,18 @@ async def process_calendar_interaction(callback_query: types.CallbackQuery, stat
         user_mode = await db.get_user_mode(user_id)
         
         if user_mode == 'meeting':
+            await ack(f"День {day} отмечен как занятый")
             await db.mark_day_busy(user_id, current_date.year, current_date.month, day)
-            await bot.answer_callback_query(callback_query.id, f"День {day} отмечен как занятый")
-            await show_calendar(callback_query.message.chat.id, user_id)
+            user_tasks.schedule(user_id, show_calendar(chat_id, user_id))
         else:
+            await ack()
             await state.set_state(CalendarStates.TASK_NAME_INPUT)
             await state.update_data(day=day)
-            await save_and_send(
-                callback_query.message.chat.id,
+            user_tasks.schedule(user_id, save_and_send(
+                chat_id,
                 text=f"📝 Введите задачу для {day} числа (или пропустите):",
                 reply_markup=create_skip_button()
-            )
+            ))
 
 @dp.callback_query(CalendarStates.DELETE_DAY_MODE)
 async def process_delete_day(callback_query: types.CallbackQuery, state: FSMContext):
@@ -318,47 +506,49 @@ async def process_delete_day(callback_query: types.CallbackQuery, state: FSMCont
     
     if data == 'back_to_calendar':
         await state.set_state(CalendarStates.CALENDAR_VIEW)
-        await show_calendar(callback_query.message.chat.id, user_id)
+        user_tasks.schedule(user_id, show_calendar(callback_query.message.chat.id, user_id))
         return
     
     if data.startswith('delete_day_'):
         day = int(data.split('_')[2])
         await state.update_data(day=day)
         await state.set_state(CalendarStates.CONFIRM_DELETE_DAY)
-        await save_and_send(
+        user_tasks.schedule(user_id, save_and_send(
             callback_query.message.chat.id,
             text=f"⚠️ Вы уверены, что хотите удалить ВСЕ задачи и пометки для {day} числа?",
             reply_markup=create_confirmation_keyboard()
-        )
+        ))
 
 @dp.callback_query(CalendarStates.CONFIRM_DELETE_DAY)
-async def process_confirm_delete_day(callback_query: types.CallbackQuery, state: FSMContext):
+async def process_confirm_delete_day(callback_query: types.CallbackQuery, state: FSMContext, ack: CallbackAck):
     user_id = callback_query.from_user.id
     current_date = datetime.now()
     
     if callback_query.data == 'confirm_reset':
         data = await state.get_data()
         day = data['day']
+        await ack(f"✅ День {day} очищен")
         await db.mark_day_free(user_id, current_date.year, current_date.month, day)
-        await bot.answer_callback_query(callback_query.id, f"✅ День {day} очищен")
+        day_date = date(current_date.year, current_date.month, day)
+        await skip_series_between(user_id, day_date, day_date)
     else:
-        await bot.answer_callback_query(callback_query.id, "❌ Удаление отменено")
+        await ack("❌ Удаление отменено")
     
     await state.set_state(CalendarStates.CALENDAR_VIEW)
-    await show_calendar(callback_query.message.chat.id, user_id)
+    user_tasks.schedule(user_id, show_calendar(callback_query.message.chat.id, user_id))
 
 @dp.callback_query(CalendarStates.TASK_NAME_INPUT)
-async def process_task_skip(callback_query: types.CallbackQuery, state: FSMContext):
+async def process_task_skip(callback_query: types.CallbackQuery, state: FSMContext, ack: CallbackAck):
     if callback_query.data == 'skip_task':
         data = await state.get_data()
         day = data['day']
         user_id = callback_query.from_user.id
         current_date = datetime.now()
         
+        await ack(f"День {day} отмечен как занятый")
         await db.mark_day_busy(user_id, current_date.year, current_date.month, day)
-        await bot.answer_callback_query(callback_query.id, f"День {day} отмечен как занятый")
         await state.set_state(CalendarStates.CALENDAR_VIEW)
-        await show_calendar(callback_query.message.chat.id, user_id)
+        user_tasks.schedule(user_id, show_calendar(callback_query.message.chat.id, user_id))
 
 @dp.message(CalendarStates.TASK_NAME_INPUT)
 async def process_task_name(message: types.Message, state: FSMContext):
@@ -374,33 +564,61 @@ async def process_task_name(message: types.Message, state: FSMContext):
 @dp.callback_query(CalendarStates.TASK_TIME_SELECT)
 async def process_task_time(callback_query: types.CallbackQuery, state: FSMContext):
     data = callback_query.data
+    user_id = callback_query.from_user.id
     
     if data.startswith('time_'):
         time_str = data.split('_')[1]
         await state.update_data(task_time=time_str)
         await state.set_state(CalendarStates.TASK_REMINDER_SELECT)
-        await save_and_send(
+        user_tasks.schedule(user_id, save_and_send(
             callback_query.message.chat.id,
             text="⏱ За сколько минут напомнить о задаче?",
             reply_markup=create_compact_reminder_keyboard()
-        )
+        ))
     
     elif data.startswith('time_page_'):
         page = int(data.split('_')[2])
-        await bot.edit_message_reply_markup(
+        user_tasks.schedule(user_id, bot.edit_message_reply_markup(
             chat_id=callback_query.message.chat.id,
             message_id=callback_query.message.message_id,
             reply_markup=create_time_selection_keyboard(page)
-        )
+        ))
 
 @dp.callback_query(CalendarStates.TASK_REMINDER_SELECT)
 async def process_task_reminder(callback_query: types.CallbackQuery, state: FSMContext):
     if callback_query.data.startswith('reminder_'):
         reminder = int(callback_query.data.split('_')[1])
-        data = await state.get_data()
         user_id = callback_query.from_user.id
-        current_date = datetime.now()
         
+        await state.update_data(reminder=reminder)
+        await state.set_state(CalendarStates.TASK_REPEAT_SELECT)
+        user_tasks.schedule(user_id, save_and_send(
+            callback_query.message.chat.id,
+            text="🔁 Повторять задачу?",
+            reply_markup=create_repeat_keyboard()
+        ))
+
+@dp.callback_query(CalendarStates.TASK_REPEAT_SELECT)
+async def process_task_repeat(callback_query: types.CallbackQuery, state: FSMContext, ack: CallbackAck):
+    choice = callback_query.data
+    user_id = callback_query.from_user.id
+    
+    if choice in ('repeat_daily', 'repeat_weekly', 'repeat_monthly'):
+        await ack()
+        await state.update_data(repeat=choice.split('_')[1])
+        user_tasks.schedule(user_id, save_and_send(
+            callback_query.message.chat.id,
+            text="Сколько раз повторить?",
+            reply_markup=create_repeat_count_keyboard()
+        ))
+        return
+    if choice != 'repeat_none' and not choice.startswith('repeat_count_'):
+        return
+    
+    data = await state.get_data()
+    current_date = datetime.now()
+    await ack("✅ Задача добавлена!")
+    if choice == 'repeat_none':
         await db.add_task(
             user_id,
             current_date.year,
@@ -408,30 +626,43 @@ async def process_task_reminder(callback_query: types.CallbackQuery, state: FSMC
             data['day'],
             data['task_name'],
             data['task_time'],
-            reminder
+            data['reminder']
         )
-        
-        await bot.answer_callback_query(callback_query.id, "✅ Задача добавлена!")
-        await save_and_send(
-            callback_query.message.chat.id,
-            text="Хотите добавить еще одну задачу на этот день?",
-            reply_markup=create_task_decision_keyboard()
+    else:
+        # Серия хранится одной строкой, повторения бот вычисляет сам
+        count = int(choice.split('_')[2])
+        start = date(current_date.year, current_date.month, data['day'])
+        await db.add_task_series(
+            user_id,
+            current_date.year,
+            current_date.month,
+            data['day'],
+            data['task_name'],
+            data['task_time'],
+            data['reminder'],
+            data['repeat'],
+            until=last_occurrence(data['repeat'], 1, start, count) if count else None
         )
-        await state.set_state(CalendarStates.DAY_SELECTED)
+    
+    await state.set_state(CalendarStates.DAY_SELECTED)
+    user_tasks.schedule(user_id, save_and_send(
+        callback_query.message.chat.id,
+        text="Хотите добавить еще одну задачу на этот день?",
+        reply_markup=create_task_decision_keyboard()
+    ))
 
 @dp.callback_query(CalendarStates.DAY_SELECTED)
 async def process_task_decision(callback_query: types.CallbackQuery, state: FSMContext):
+    user_id = callback_query.from_user.id
     if callback_query.data == 'add_another_task':
         await state.set_state(CalendarStates.TASK_NAME_INPUT)
-        await save_and_send(
+        user_tasks.schedule(user_id, save_and_send(
             callback_query.message.chat.id,
             text="📝 Введите задачу:"
-        )
+        ))
     else:  # back_to_calendar
-        data = await state.get_data()
-        user_id = callback_query.from_user.id
         await state.set_state(CalendarStates.CALENDAR_VIEW)
-        await show_calendar(callback_query.message.chat.id, user_id)
+        user_tasks.schedule(user_id, show_calendar(callback_query.message.chat.id, user_id))
 
 @dp.callback_query(CalendarStates.EDIT_TASKS_MODE)
 async def process_edit_tasks(callback_query: types.CallbackQuery, state: FSMContext):
@@ -440,62 +671,135 @@ async def process_edit_tasks(callback_query: types.CallbackQuery, state: FSMCont
     
     if data == 'back_to_calendar':
         await state.set_state(CalendarStates.MAIN_MENU)
-        await send_main_menu(callback_query.message.chat.id, user_id)
+        user_tasks.schedule(user_id, send_main_menu(callback_query.message.chat.id, user_id))
         return
     
-    current_date = datetime.now()
-    
     if data.startswith('edit_day_'):
         day = int(data.split('_')[2])
-        tasks = await db.get_tasks_for_day(user_id, current_date.year, current_date.month, day)
         
-        if not tasks:
-            await bot.answer_callback_query(callback_query.id, "В этот день нет задач.")
+        if not await open_tasks_page(state, callback_query.message.chat.id, user_id, day, [None]):
+            # На callback уже ответили до запроса к БД, поэтому сообщением, а не всплывающим текстом
+            user_tasks.schedule(user_id, save_and_send(callback_query.message.chat.id, text="В этот день нет задач."))
             return
         
-        await state.update_data(day=day)
         await state.set_state(CalendarStates.DAY_TASKS_VIEW)
-        await show_day_tasks(callback_query.message.chat.id, day, tasks)
 
-async def show_day_tasks(chat_id, day, tasks):
+async def open_tasks_page(state: FSMContext, chat_id, user_id, day, cursors):
+    """Загружает страницу задач дня и планирует ее отправку.
+
+    cursors - курсоры начала уже пройденных страниц, последний открывается;
+    они хранятся в состоянии, чтобы кнопка "назад" не требовала обратного запроса.
+    """
+    current_date = datetime.now()
+    tasks, has_more = await db.get_tasks_page(
+        user_id, current_date.year, current_date.month, day,
+        after=cursors[-1], limit=config.TASKS_PAGE_SIZE
+    )
+    # После удаления последняя страница могла опустеть
+    while not tasks and len(cursors) > 1:
+        cursors.pop()
+        tasks, has_more = await db.get_tasks_page(
+            user_id, current_date.year, current_date.month, day,
+            after=cursors[-1], limit=config.TASKS_PAGE_SIZE
+        )
+    # Повторяющиеся задачи дня показываются на первой странице
+    series = []
+    if len(cursors) == 1:
+        series = await day_series(user_id, date(current_date.year, current_date.month, day))
+    if not tasks and not series:
+        return False
+    
+    await state.update_data(
+        day=day,
+        task_cursors=cursors,
+        task_next_cursor=[tasks[-1]['time'], tasks[-1]['id']] if has_more else None
+    )
+    first_number = (len(cursors) - 1) * config.TASKS_PAGE_SIZE + 1
+    user_tasks.schedule(
+        user_id, show_day_tasks(chat_id, day, tasks, first_number, len(cursors) > 1, has_more, series)
+    )
+    return True
+
+async def day_series(user_id, day):
+    """Серии пользователя, у которых есть повторение в день day"""
+    return [
+        series for series in await db.get_series_between(user_id, day, day)
+        if occurrences_between(series, day, day)
+    ]
+
+async def skip_series_between(user_id, start, end):
+    """Отменяет повторения серий с start по end: очистка дня или месяца убирает и их"""
+    for series in await db.get_series_between(user_id, start, end):
+        days = occurrences_between(series, start, end)
+        if days:
+            await db.skip_occurrences(series['id'], days)
+
+async def show_day_tasks(chat_id, day, tasks, first_number=1, has_prev=False, has_next=False, series=()):
     text = f"Задачи на {day} число:\n"
-    for idx, task in enumerate(tasks, 1):
+    for idx, task in enumerate(tasks, first_number):
         text += f"{idx}. {task['task']} ({task['time']})\n"
+    for item in series:
+        text += f"🔁 {item['task']} ({item['time']})\n"
     
     await save_and_send(
         chat_id,
         text=text,
-        reply_markup=create_tasks_list_keyboard(tasks)
+        reply_markup=create_tasks_list_keyboard(tasks, has_prev, has_next, series)
     )
 
 @dp.callback_query(CalendarStates.DAY_TASKS_VIEW)
-async def process_task_actions(callback_query: types.CallbackQuery, state: FSMContext):
+async def process_task_actions(callback_query: types.CallbackQuery, state: FSMContext, ack: CallbackAck):
     data = callback_query.data
     user_id = callback_query.from_user.id
-    current_date = datetime.now()
+    chat_id = callback_query.message.chat.id
     
     if data == 'back_to_days':
+        await ack()
         await state.set_state(CalendarStates.EDIT_TASKS_MODE)
-        await show_calendar(callback_query.message.chat.id, user_id, mode='edit')
+        user_tasks.schedule(user_id, show_calendar(chat_id, user_id, mode='edit'))
         return
     
-    if data.startswith('delete_task_'):
-        task_id = int(data.split('_')[2])
-        await db.delete_task(task_id)
-        await bot.answer_callback_query(callback_query.id, "✅ Задача удалена")
-        
+    if data in ('tasks_next', 'tasks_prev'):
+        await ack()
+        state_data = await state.get_data()
+        cursors = list(state_data.get('task_cursors') or [None])
+        if data == 'tasks_next' and state_data.get('task_next_cursor'):
+            cursors.append(state_data['task_next_cursor'])
+        elif data == 'tasks_prev' and len(cursors) > 1:
+            cursors.pop()
+        await open_tasks_page(state, chat_id, user_id, state_data.get('day'), cursors)
+        return
+    
+    if data.startswith(('delete_task_', 'skip_occurrence_', 'delete_series_')):
+        item_id = int(data.rsplit('_', 1)[1])
         state_data = await state.get_data()
         day = state_data.get('day')
-        tasks = await db.get_tasks_for_day(user_id, current_date.year, current_date.month, day)
         
-        if tasks:
-            await show_day_tasks(callback_query.message.chat.id, day, tasks)
+        if data.startswith('delete_task_'):
+            await ack("✅ Задача удалена")
+            await db.delete_task(item_id)
         else:
-            await save_and_send(callback_query.message.chat.id, text="Все задачи удалены")
+            # Проверка владельца читает БД, поэтому итог сообщается уже сообщением
+            await ack()
+            current_date = datetime.now()
+            day_date = date(current_date.year, current_date.month, day)
+            # id серии пришел из callback data: трогаем только серии пользователя из этого дня
+            if item_id not in {series['id'] for series in await day_series(user_id, day_date)}:
+                await bot.send_message(chat_id, "Задача не найдена.")
+                return
+            if data.startswith('skip_occurrence_'):
+                await db.skip_occurrences(item_id, [day_date])
+            else:
+                await db.delete_series(item_id)
+        
+        cursors = list(state_data.get('task_cursors') or [None])
+        
+        if not await open_tasks_page(state, chat_id, user_id, day, cursors):
             await state.set_state(CalendarStates.EDIT_TASKS_MODE)
-            await show_calendar(callback_query.message.chat.id, user_id, mode='edit')
+            user_tasks.schedule(user_id, show_all_tasks_deleted(chat_id, user_id))
     
     elif data.startswith('edit_task_'):
+        await ack()
         task_id = int(data.split('_')[2])
         task = await db.get_task_by_id(task_id)
         
@@ -505,24 +809,34 @@ async def process_task_actions(callback_query: types.CallbackQuery, state: FSMCo
                 day=task['day']
             )
             await state.set_state(CalendarStates.TASK_NAME_INPUT)
-            await save_and_send(
-                callback_query.message.chat.id,
+            user_tasks.schedule(user_id, save_and_send(
+                chat_id,
                 text=f"✏️ Введите новую задачу для {task['day']} числа:"
-            )
+            ))
+
+async def show_all_tasks_deleted(chat_id, user_id):
+    await save_and_send(chat_id, text="Все задачи удалены")
+    await show_calendar(chat_id, user_id, mode='edit')
 
 @dp.callback_query(CalendarStates.CONFIRM_RESET)
-async def process_reset_confirmation(callback_query: types.CallbackQuery, state: FSMContext):
+async def process_reset_confirmation(callback_query: types.CallbackQuery, state: FSMContext, ack: CallbackAck):
     user_id = callback_query.from_user.id
     current_date = datetime.now()
     
     if callback_query.data == 'confirm_reset':
+        await ack("✅ Календарь сброшен")
         await db.reset_user_calendar(user_id, current_date.year, current_date.month)
-        await bot.answer_callback_query(callback_query.id, "✅ Календарь сброшен")
+        _, days_in_month = calendar.monthrange(current_date.year, current_date.month)
+        await skip_series_between(
+            user_id,
+            date(current_date.year, current_date.month, 1),
+            date(current_date.year, current_date.month, days_in_month)
+        )
     else:
-        await bot.answer_callback_query(callback_query.id, "❌ Сброс отменен")
+        await ack("❌ Сброс отменен")
     
     await state.set_state(CalendarStates.MAIN_MENU)
-    await send_main_menu(callback_query.message.chat.id, user_id)
+    user_tasks.schedule(user_id, send_main_menu(callback_query.message.chat.id, user_id))
 
 @dp.message(CalendarStates.SETTINGS_MODE)
 async def process_settings_message(message: types.Message, state: FSMContext):
@@ -561,96 +875,84 @@ async def process_settings_message(message: types.Message, state: FSMContext):
             reply_markup=create_theme_selection_keyboard()
         )
     
+    elif text == "📰 Сводка дня":
+        profile = await db.get_user_profile(user_id)
+        current = profile.digest_time if profile else None
+        await save_and_send(
+            message.chat.id,
+            text=(
+                f"📰 Сводка дня: {current or 'выключена'}\n"
+                "Каждый день в выбранное время придет список задач на сегодня. Выберите время:"
+            ),
+            reply_markup=create_digest_keyboard()
+        )
+    
     elif text == "↩️ Главное меню":
         await state.set_state(CalendarStates.MAIN_MENU)
         await send_main_menu(message.chat.id, user_id)
 
 # Обновленный обработчик настроек
 @dp.callback_query(CalendarStates.SETTINGS_MODE)
-async def process_settings_callback(callback_query: types.CallbackQuery, state: FSMContext):
+async def process_settings_callback(callback_query: types.CallbackQuery, state: FSMContext, ack: CallbackAck):
     data = callback_query.data
     user_id = callback_query.from_user.id
     
     if data.startswith('theme_'):
         theme = data.split('_')[1]
+        await ack(f"✅ Тема установлена: {theme}")
         await db.set_user_theme(user_id, theme)
-        await bot.answer_callback_query(callback_query.id, f"✅ Тема установлена: {theme}")
-        
-        # Обновляем сообщение с настройками
-        user_mode = await db.get_user_mode(user_id)
-        current_reminder = await db.get_user_reminder(user_id)
-        timezone = await db.get_user_timezone(user_id)
-        theme = await db.get_user_theme(user_id)
-        
-        text = (
-            f"⚙️ Настройки:\n"
-            f"• Режим: {'встречи' if user_mode == 'meeting' else 'to-do'}\n"
-            f"• Напоминание за: {current_reminder} мин\n"
-            f"• Часовой пояс: {timezone}\n"
-            f"• Тема: {theme}\n\n"
-            "Выберите действие:"
-        )
-        
-        try:
-            await callback_query.message.edit_text(
-                text=text,
-                reply_markup=create_settings_reply_keyboard()
-            )
-        except:
-            # Если не удалось отредактировать, отправляем новое
-            await save_and_send(
-                callback_query.message.chat.id,
-                text=text,
-                reply_markup=create_settings_reply_keyboard()
-            )
+        user_tasks.schedule(user_id, refresh_settings_message(callback_query.message, user_id))
     
     elif data.startswith('reminder_'):
         # Обработка выбора напоминания
         reminder = int(data.split('_')[1])
+        await ack(f"⏱ Напоминание установлено: {reminder} мин")
         await db.set_user_reminder(user_id, reminder)
-        await bot.answer_callback_query(callback_query.id, f"⏱ Напоминание установлено: {reminder} мин")
-        
-        # Обновляем сообщение с настройками
-        user_mode = await db.get_user_mode(user_id)
-        current_reminder = reminder  # новое значение
-        timezone = await db.get_user_timezone(user_id)
-        theme = await db.get_user_theme(user_id)
-        
-        text = (
-            f"⚙️ Настройки:\n"
-            f"• Режим: {'встречи' if user_mode == 'meeting' else 'to-do'}\n"
-            f"• Напоминание за: {current_reminder} мин\n"
-            f"• Часовой пояс: {timezone}\n"
-            f"• Тема: {theme}\n\n"
-            "Выберите действие:"
+        user_tasks.schedule(user_id, refresh_settings_message(callback_query.message, user_id))
+    
+    elif data.startswith('digest_'):
+        digest_time = data.split('_')[1]
+        if digest_time == 'off':
+            await ack("🚫 Сводка дня выключена")
+            await db.set_user_digest(user_id, None)
+        elif digest_time in config.DIGEST_TIMES:
+            await ack(f"📰 Сводка дня в {digest_time}")
+            await db.set_user_digest(user_id, digest_time)
+        else:
+            return
+        user_tasks.schedule(user_id, refresh_settings_message(callback_query.message, user_id))
+
+async def refresh_settings_message(message: types.Message, user_id):
+    """Обновляет сообщение с настройками после изменения"""
+    profile = await db.get_user_profile(user_id)
+    text = format_settings_text(profile)
+    
+    try:
+        await message.edit_text(
+            text=text,
+            reply_markup=create_settings_reply_keyboard()
+        )
+    except:
+        # Если не удалось отредактировать, отправляем новое
+        await save_and_send(
+            message.chat.id,
+            text=text,
+            reply_markup=create_settings_reply_keyboard()
         )
-        
-        try:
-            await callback_query.message.edit_text(
-                text=text,
-                reply_markup=create_settings_reply_keyboard()
-            )
-        except:
-            # Если не удалось отредактировать, отправляем новое
-            await save_and_send(
-                callback_query.message.chat.id,
-                text=text,
-                reply_markup=create_settings_reply_keyboard()
-            )
 
 @dp.callback_query(CalendarStates.SETTINGS_MODE)
-async def process_theme_selection(callback_query: types.CallbackQuery, state: FSMContext):
+async def process_theme_selection(callback_query: types.CallbackQuery, state: FSMContext, ack: CallbackAck):
     if callback_query.data.startswith('theme_'):
         theme = callback_query.data.split('_')[1]
         user_id = callback_query.from_user.id
+        await ack(f"✅ Тема установлена: {theme}")
         await db.set_user_theme(user_id, theme)
-        await bot.answer_callback_query(callback_query.id, f"✅ Тема установлена: {theme}")
         await state.set_state(CalendarStates.SETTINGS_MODE)
-        await save_and_send(
+        user_tasks.schedule(user_id, save_and_send(
             callback_query.message.chat.id,
             text="Настройки обновлены. Что дальше?",
             reply_markup=create_settings_reply_keyboard()
-        )
+        ))
 
 @dp.message(CalendarStates.GROUP_MODE)
 async def process_group_usernames(message: types.Message, state: FSMContext):
@@ -663,82 +965,116 @@ async def process_group_usernames(message: types.Message, state: FSMContext):
         return
     
     usernames = [username.strip() for username in text.split() if username.startswith('@')]
+    group_name = ' '.join(word for word in text.split() if not word.startswith('@'))[:64]
     
     if not usernames:
-        builder = ReplyKeyboardBuilder()
-        builder.button(text="↩️ Назад")
-        builder.adjust(1)
-        
         await save_and_send(
             message.chat.id,
             text="❌ Не найдено ни одного юзернейма. Попробуйте снова.\nПример: @user1 @user2",
-            reply_markup=builder.as_markup(resize_keyboard=True)
+            reply_markup=create_group_mode_keyboard()
         )
         return
     
     if len(usernames) > 20:
-        builder = ReplyKeyboardBuilder()
-        builder.button(text="↩️ Назад")
-        builder.adjust(1)
-        
         await save_and_send(
             message.chat.id,
             text="❌ Превышен лимит пользователей (20).",
-            reply_markup=builder.as_markup(resize_keyboard=True)
+            reply_markup=create_group_mode_keyboard()
         )
         return
     
     user_ids = await db.get_user_ids_by_usernames([u[1:] for u in usernames])
     
     if not user_ids:
-        builder = ReplyKeyboardBuilder()
-        builder.button(text="↩️ Назад")
-        builder.adjust(1)
-        
         await save_and_send(
             message.chat.id,
             text="❌ Не найдено пользователей по указанным юзернеймам.",
-            reply_markup=builder.as_markup(resize_keyboard=True)
+            reply_markup=create_group_mode_keyboard()
         )
         return
     
     user_ids.append(user_id)
+    if group_name:
+        groups = await db.get_user_groups(user_id)
+        if len(groups) >= config.GROUP_MAX_SAVED and group_name not in {group['name'] for group in groups}:
+            await save_and_send(
+                message.chat.id,
+                text=f"❌ Можно сохранить не больше {config.GROUP_MAX_SAVED} групп. Удалите ненужные.",
+                reply_markup=create_group_mode_keyboard()
+            )
+            return
+        await db.save_group(user_id, group_name, user_ids)
+        await save_and_send(message.chat.id, text=f"💾 Группа «{group_name}» сохранена.")
+    
+    if not await send_common_free_days(message.chat.id, user_id, user_ids):
+        return
+    
+    await state.set_state(CalendarStates.MAIN_MENU)
+    await send_main_menu(message.chat.id, user_id)
+
+async def send_common_free_days(chat_id, user_id, user_ids):
+    """Отправляет календарь общих свободных дней текущего месяца; False, если их нет"""
     current_date = datetime.now()
-    free_days = await db.find_common_free_days(user_ids, current_date.year, current_date.month)
+    free_days = await group_availability.free_days(db, user_ids, current_date.year, current_date.month)
     
     if not free_days:
-        builder = ReplyKeyboardBuilder()
-        builder.button(text="↩️ Назад")
-        builder.adjust(1)
-        
         await save_and_send(
-            message.chat.id,
+            chat_id,
             text="❌ Нет общих свободных дней в этом месяце.",
-            reply_markup=builder.as_markup(resize_keyboard=True)
+            reply_markup=create_group_mode_keyboard()
         )
-        return
+        return False
     
     theme = await db.get_user_theme(user_id)
-    calendar_img = calendar_gen.generate_calendar(
+    calendar_img = await calendar_gen.render(
         current_date.year, 
         current_date.month, 
         common_free_days=free_days,
         theme=theme
     )
     
-    photo = FSInputFile(calendar_img)
-    sent_message = await bot.send_photo(
-        chat_id=message.chat.id,
-        photo=photo,
-        caption=f"Общие свободные дни: {', '.join(map(str, free_days))}",
-        reply_markup=create_group_mode_keyboard()
-    )
-    os.remove(calendar_img)
-    
-    await state.set_state(CalendarStates.MAIN_MENU)
-    await send_main_menu(message.chat.id, user_id)
+    try:
+        await bot.send_photo(
+            chat_id=chat_id,
+            photo=FSInputFile(calendar_img),
+            caption=f"Общие свободные дни: {', '.join(map(str, free_days))}",
+            reply_markup=create_group_mode_keyboard()
+        )
+    finally:
+        os.remove(calendar_img)
+    return True
 
 # Заглушки для состояний
+@dp.inline_query()
+async def participant_inline_query(inline_query: types.InlineQuery):
+    # Подсказки только в чате с ботом и только его пользователям
+    if inline_query.chat_type != 'sender' or not await db.user_exists(inline_query.from_user.id):
+        await inline_query.answer([], cache_time=60, is_personal=True)
+        return
+    
+    # Последнее слово - искомый префикс, предыдущие уже выбранные участники
+    query = inline_query.query
+    words = query.split()
+    if not words or query[-1].isspace():
+        words.append('')
+    *picked, prefix = words
+    picked = [word if word.startswith('@') else f"@{word}" for word in picked]
+    chosen = {word[1:].lower() for word in picked}
+    
+    results = [
+        types.InlineQueryResultArticle(
+            id=str(user_id),
+            title=f"@{username}",
+            description=full_name or None,
+            input_message_content=types.InputTextMessageContent(
+                message_text=' '.join([*picked, f"@{username}"])
+            )
+        )
+        for user_id, username, full_name in user_directory.search(prefix)
+        if username.lower() not in chosen
+    ]
+    await inline_query.answer(results, cache_time=5, is_personal=True)
+
 @dp.message(CalendarStates.CALENDAR_VIEW)
 async def handle_calendar_view_message(message: types.Message):
     await save_and_send(message.chat.id, text="ℹ️ Пожалуйста, используйте кнопки календаря для взаимодействия.")
@@ -768,7 +1104,10 @@ async def handle_reset_confirmation_message(message: types.Message):
     await save_and_send(message.chat.id, text="ℹ️ Пожалуйста, подтвердите или отмените сброс календаря с помощью кнопок.")
 
 async def run_bot():
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await user_tasks.shutdown()
 
 if __name__ == '__main__':
     asyncio.run(run_bot())
@@ -0,0 +1,40 @@
+from collections import OrderedDict
+import time
+
+
+class TTLCache:
+    """LRU-кэш с ограничением размера и временем жизни записей"""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return item[0] if item is not None else default
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -1,7 +1,10 @@
 from PIL import Image, ImageDraw, ImageFont
+import asyncio
 import calendar
 import os
-from datetime import datetime
+import tempfile
+import time
+import metrics
 
 class CalendarGenerator:
     THEMES = {
@@ -64,6 +67,35 @@ class CalendarGenerator:
             return ImageFont.load_default()
     
     def generate_calendar(self, year, month, busy_days=None, free_days=None, common_free_days=None, theme='default'):
+        if not metrics.registry.enabled:
+            return self._generate_calendar(year, month, busy_days, free_days, common_free_days, theme)
+        
+        started = time.perf_counter()
+        filename = self._generate_calendar(year, month, busy_days, free_days, common_free_days, theme)
+        self._observe(started, filename)
+        return filename
+    
+    async def render(self, year, month, busy_days=None, free_days=None, common_free_days=None, theme='default'):
+        """generate_calendar в потоке: рисование и запись PNG не держат цикл событий.
+        Файл удаляет вызывающий; при отмене - сам генератор, когда поток допишет его"""
+        started = time.perf_counter()
+        future = asyncio.ensure_future(asyncio.to_thread(
+            self._generate_calendar, year, month, busy_days, free_days, common_free_days, theme
+        ))
+        try:
+            filename = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            future.add_done_callback(_remove_rendered)
+            raise
+        if metrics.registry.enabled:
+            self._observe(started, filename)
+        return filename
+    
+    def _observe(self, started, filename):
+        metrics.render_latency.observe(time.perf_counter() - started)
+        metrics.render_bytes.observe(os.path.getsize(filename))
+    
+    def _generate_calendar(self, year, month, busy_days, free_days, common_free_days, theme):
         theme_data = self.THEMES.get(theme, self.THEMES['default'])
         img = Image.new('RGB', (self.width, self.height), theme_data["background"])
         draw = ImageDraw.Draw(img)
@@ -137,8 +169,16 @@ class CalendarGenerator:
                             fill=theme_data["task_count"]
                         )
         
-        filename = f"calendar_{year}_{month}_{datetime.now().strftime('%H%M%S')}.png"
+        # Уникальное имя: одновременные рендеры в одну секунду не должны делить файл
+        fd, filename = tempfile.mkstemp(prefix=f"calendar_{year}_{month}_", suffix='.png')
+        os.close(fd)
         img.save(filename)
+        # Буфер картинки освобождается сразу, не дожидаясь сборщика
+        img.close()
         return filename
 
+def _remove_rendered(future):
+    if not future.cancelled() and future.exception() is None:
+        os.remove(future.result())
+
 calendar_gen = CalendarGenerator()
\ No newline at end of file
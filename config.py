@@ -5,4 +5,78 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DB_PATH = os.getenv("DB_PATH", "calendar_bot.db")
-TIMEZONE_API_KEY = os.getenv("TIMEZONE_API_KEY", "YOUR_API_KEY")
\ No newline at end of file
+TIMEZONE_API_KEY = os.getenv("TIMEZONE_API_KEY", "YOUR_API_KEY")
+
+# Кэш профилей пользователей
+PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", "600"))
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+
+# HTTP-сервер процесса бота (/metrics и прочие ручки) и метрики Prometheus.
+# Бот и планировщик работают в единственном worker, поэтому порт задается
+# отдельно: PORT от Heroku принадлежит web-дино
+WEB_PORT = os.getenv("WEB_PORT")
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+
+# Групповой commit записей: не больше N операций или ожидание в мс
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "100"))
+WRITE_BATCH_DELAY_MS = float(os.getenv("WRITE_BATCH_DELAY_MS", "5"))
+
+# Чистка старых данных: сроки хранения в днях, период запуска и размер пачки
+RETENTION_CALENDAR_DAYS = int(os.getenv("RETENTION_CALENDAR_DAYS", "60"))
+RETENTION_TASK_DAYS = int(os.getenv("RETENTION_TASK_DAYS", "60"))
+RETENTION_GROUP_DAYS = int(os.getenv("RETENTION_GROUP_DAYS", "30"))
+RETENTION_INTERVAL_HOURS = float(os.getenv("RETENTION_INTERVAL_HOURS", "24"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+RETENTION_PAUSE_MS = float(os.getenv("RETENTION_PAUSE_MS", "50"))
+
+# Кэш отрисованных календарей (file_id картинок в Telegram)
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "5000"))
+RENDER_CACHE_TTL = int(os.getenv("RENDER_CACHE_TTL", "86400"))
+
+# Сколько задач дня показывать на одной странице
+TASKS_PAGE_SIZE = int(os.getenv("TASKS_PAGE_SIZE", "8"))
+
+# Число файлов БД, по которым раскладываются пользователи (1 - один файл DB_PATH)
+DB_SHARDS = int(os.getenv("DB_SHARDS", "1"))
+
+# Импорт .ics: предельный размер файла (лимит скачивания Bot API) и размер пачки записи
+ICS_IMPORT_MAX_BYTES = int(os.getenv("ICS_IMPORT_MAX_BYTES", str(20 * 1024 * 1024)))
+ICS_IMPORT_BATCH_SIZE = int(os.getenv("ICS_IMPORT_BATCH_SIZE", "500"))
+
+# Подписка на календарь по ссылке: внешний адрес web-процесса, секрет ссылок и окно месяцев
+PUBLIC_URL = os.getenv("PUBLIC_URL", "")
+FEED_SECRET = os.getenv("FEED_SECRET", "")
+FEED_MONTHS_BACK = int(os.getenv("FEED_MONTHS_BACK", "1"))
+FEED_MONTHS_AHEAD = int(os.getenv("FEED_MONTHS_AHEAD", "12"))
+FEED_CACHE_SIZE = int(os.getenv("FEED_CACHE_SIZE", "20000"))
+FEED_CACHE_TTL = int(os.getenv("FEED_CACHE_TTL", "86400"))
+
+# Сохраненные группы: сколько групп у одного пользователя и кэш занятости участников
+GROUP_MAX_SAVED = int(os.getenv("GROUP_MAX_SAVED", "20"))
+GROUP_CACHE_SIZE = int(os.getenv("GROUP_CACHE_SIZE", "10000"))
+GROUP_CACHE_TTL = int(os.getenv("GROUP_CACHE_TTL", "86400"))
+
+# Напоминания, срок которых наступит в пределах окна (секунды), уходят одним сообщением
+REMINDER_COALESCE_SECONDS = int(os.getenv("REMINDER_COALESCE_SECONDS", "300"))
+# Время ежедневной сводки на выбор в настройках
+DIGEST_TIMES = ("07:00", "08:00", "09:00", "10:00", "20:00", "21:00")
+
+# Исходящие запросы к Bot API: общий лимит бота и лимит на чат (запросов в секунду и запас),
+# повторы после 429 и пул соединений
+BOT_API_GLOBAL_RATE = float(os.getenv("BOT_API_GLOBAL_RATE", "25"))
+BOT_API_GLOBAL_BURST = int(os.getenv("BOT_API_GLOBAL_BURST", "30"))
+BOT_API_CHAT_RATE = float(os.getenv("BOT_API_CHAT_RATE", "1"))
+BOT_API_CHAT_BURST = int(os.getenv("BOT_API_CHAT_BURST", "3"))
+BOT_API_MAX_RETRIES = int(os.getenv("BOT_API_MAX_RETRIES", "3"))
+BOT_API_CONNECTIONS = int(os.getenv("BOT_API_CONNECTIONS", "100"))
+BOT_API_KEEPALIVE = float(os.getenv("BOT_API_KEEPALIVE", "60"))
+# Свой сервер Bot API (локальный telegram-bot-api или заглушка loadtest.py); пусто - api.telegram.org
+BOT_API_URL = os.getenv("BOT_API_URL", "")
+
+# Память процесса: период замеров RSS и размеров структур (секунды, 0 - выключено),
+# длина истории замеров, tracemalloc с запуска (кадров стека, 0 - только по запросу)
+# и токен HTTP-ручек /debug/memory (пусто - ручки выключены)
+MEMORY_SAMPLE_INTERVAL = float(os.getenv("MEMORY_SAMPLE_INTERVAL", "60"))
+MEMORY_HISTORY_SIZE = int(os.getenv("MEMORY_HISTORY_SIZE", "1440"))
+MEMORY_TRACEMALLOC_FRAMES = int(os.getenv("MEMORY_TRACEMALLOC_FRAMES", "0"))
+MEMORY_DEBUG_TOKEN = os.getenv("MEMORY_DEBUG_TOKEN", "")
\ No newline at end of file
@@ -1,25 +1,585 @@
 import aiosqlite
-from datetime import datetime, timedelta, timezone
+import asyncio
+from dataclasses import dataclass, replace
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
 import logging
+from typing import Optional, Protocol
 import json
 import pytz
+from cache import TTLCache
+from batching import BatchLoader
+from writer import WriteQueue
+from recurrence import month_occurrences, next_reminder, occurrences_between
+from digest import next_digest
+import metrics
+from memstats import memory_monitor
 
 logger = logging.getLogger(__name__)
 
-class Database:
+_TABLE_KEYWORDS = {'FROM', 'INTO', 'UPDATE', 'TABLE'}
+
+
+@lru_cache(maxsize=1024)
+def query_name(query):
+    """Короткое имя запроса для метрик: глагол и таблица, например 'select users'"""
+    words = query.split()
+    if not words:
+        return 'empty'
+    for i, word in enumerate(words[:-1]):
+        if word.upper() in _TABLE_KEYWORDS:
+            return f"{words[0].lower()} {words[i + 1].split('(')[0]}"
+    return words[0].lower()
+
+# Кэши профилей и писатели общие для всех экземпляров SQLiteBackend с одним файлом БД
+_profile_caches = {}
+_writers = {}
+# Открытые хранилища по DB_PATH, см. open_database
+_databases = {}
+memory_monitor.register('profile_cache', lambda: sum(map(len, _profile_caches.values())))
+
+
+@dataclass(frozen=True)
+class UserProfile:
+    user_id: int
+    username: str
+    full_name: str
+    mode: str = 'meeting'
+    reminder: int = 60
+    timezone: str = 'Europe/Moscow'
+    theme: str = 'default'
+    digest_time: Optional[str] = None
+
+
+EPOCH_DATE = date(1970, 1, 1)
+DAY_ORDINAL_SQL = "CAST(julianday(printf('%04d-%02d-%02d', year, month, day)) - 2440587.5 AS INTEGER)"
+
+
+def day_ordinal(year, month, day):
+    """Номер дня от 1970-01-01, как в колонке day_ordinal"""
+    return (date(year, month, day) - EPOCH_DATE).days
+
+
+# Месяц (0, 0) в month_versions - версия повторяющихся задач пользователя:
+# серия затрагивает сразу все месяцы, поэтому ее версия прибавляется к каждому
+SERIES_MONTH = (0, 0)
+
+
+def make_series(series_id, user_id, task, time, reminder, freq, interval, start_ordinal, until_ordinal,
+                exception_ordinals=()):
+    """Серия повторяющейся задачи в виде, который понимает recurrence.py"""
+    return {
+        'id': series_id, 'user_id': user_id, 'task': task, 'time': time, 'reminder': reminder,
+        'freq': freq, 'interval': interval,
+        'start': EPOCH_DATE + timedelta(days=start_ordinal),
+        'until': EPOCH_DATE + timedelta(days=until_ordinal) if until_ordinal is not None else None,
+        'exceptions': {EPOCH_DATE + timedelta(days=ordinal) for ordinal in exception_ordinals},
+    }
+
+
+def add_series_to_digests(digests, series_list):
+    """Добавляет в сводки {user_id: сводка} повторения серий в их день и упорядочивает задачи по времени"""
+    for series in series_list:
+        digest = digests[series['user_id']]
+        if occurrences_between(series, digest['day'], digest['day']):
+            digest['tasks'].append({'time': series['time'], 'task': series['task']})
+    for digest in digests.values():
+        digest['tasks'].sort(key=lambda task: task['time'] or '')
+
+
+def compute_reminder_time(user_timezone, year, month, day, task_time, reminder):
+    """Момент напоминания в UTC: время задачи в часовом поясе пользователя минус reminder минут"""
+    try:
+        tz = pytz.timezone(user_timezone)
+        task_datetime = tz.localize(datetime(
+            year, month, day,
+            int(task_time.split(':')[0]),
+            int(task_time.split(':')[1])
+        ))
+        reminder_time = task_datetime - timedelta(minutes=reminder)
+        return reminder_time.astimezone(pytz.utc)
+    except Exception as e:
+        logger.error(f"Error calculating reminder time: {e}")
+        # Fallback: текущее время + reminder минут
+        return datetime.now(timezone.utc) + timedelta(minutes=reminder)
+
+
+# Миграции схемы по порядку. Номер последней примененной хранится в PRAGMA user_version
+MIGRATIONS = [
+    # 1: материализованная сводка по дням (user_id, year, month, day), которую
+    # поддерживают триггеры на user_calendar и tasks. status - статус последней
+    # пометки дня в user_calendar или NULL, если пометки нет.
+    '''
+    CREATE INDEX IF NOT EXISTS idx_user_calendar_day ON user_calendar (user_id, year, month, day);
+    CREATE INDEX IF NOT EXISTS idx_tasks_day ON tasks (user_id, year, month, day);
+
+    CREATE TABLE IF NOT EXISTS month_summary (
+        user_id INTEGER NOT NULL,
+        year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        status TEXT,
+        task_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, year, month, day)
+    ) WITHOUT ROWID;
+
+    CREATE TRIGGER IF NOT EXISTS month_summary_calendar_insert
+    AFTER INSERT ON user_calendar BEGIN
+        INSERT INTO month_summary (user_id, year, month, day, status, task_count)
+        VALUES (NEW.user_id, NEW.year, NEW.month, NEW.day, NEW.status, 0)
+        ON CONFLICT (user_id, year, month, day) DO UPDATE SET status = excluded.status;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS month_summary_calendar_update
+    AFTER UPDATE OF status ON user_calendar BEGIN
+        UPDATE month_summary SET status = (
+            SELECT status FROM user_calendar
+            WHERE user_id = NEW.user_id AND year = NEW.year AND month = NEW.month AND day = NEW.day
+            ORDER BY id DESC LIMIT 1
+        )
+        WHERE user_id = NEW.user_id AND year = NEW.year AND month = NEW.month AND day = NEW.day;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS month_summary_calendar_delete
+    AFTER DELETE ON user_calendar BEGIN
+        UPDATE month_summary SET status = (
+            SELECT status FROM user_calendar
+            WHERE user_id = OLD.user_id AND year = OLD.year AND month = OLD.month AND day = OLD.day
+            ORDER BY id DESC LIMIT 1
+        )
+        WHERE user_id = OLD.user_id AND year = OLD.year AND month = OLD.month AND day = OLD.day;
+        DELETE FROM month_summary
+        WHERE user_id = OLD.user_id AND year = OLD.year AND month = OLD.month AND day = OLD.day
+            AND status IS NULL AND task_count = 0;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS month_summary_task_insert
+    AFTER INSERT ON tasks BEGIN
+        INSERT INTO month_summary (user_id, year, month, day, status, task_count)
+        VALUES (NEW.user_id, NEW.year, NEW.month, NEW.day, NULL, 1)
+        ON CONFLICT (user_id, year, month, day) DO UPDATE SET task_count = task_count + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS month_summary_task_delete
+    AFTER DELETE ON tasks BEGIN
+        UPDATE month_summary SET task_count = task_count - 1
+        WHERE user_id = OLD.user_id AND year = OLD.year AND month = OLD.month AND day = OLD.day;
+        DELETE FROM month_summary
+        WHERE user_id = OLD.user_id AND year = OLD.year AND month = OLD.month AND day = OLD.day
+            AND status IS NULL AND task_count <= 0;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS month_summary_task_move
+    AFTER UPDATE OF user_id, year, month, day ON tasks BEGIN
+        UPDATE month_summary SET task_count = task_count - 1
+        WHERE user_id = OLD.user_id AND year = OLD.year AND month = OLD.month AND day = OLD.day;
+        DELETE FROM month_summary
+        WHERE user_id = OLD.user_id AND year = OLD.year AND month = OLD.month AND day = OLD.day
+            AND status IS NULL AND task_count <= 0;
+        INSERT INTO month_summary (user_id, year, month, day, status, task_count)
+        VALUES (NEW.user_id, NEW.year, NEW.month, NEW.day, NULL, 1)
+        ON CONFLICT (user_id, year, month, day) DO UPDATE SET task_count = task_count + 1;
+    END;
+
+    -- Заполнение по существующим данным: статус берем из последней пометки дня
+    DELETE FROM month_summary;
+    INSERT INTO month_summary (user_id, year, month, day, status, task_count)
+    SELECT user_id, year, month, day, status, 0 FROM (
+        SELECT user_id, year, month, day, status, MAX(id)
+        FROM user_calendar GROUP BY user_id, year, month, day
+    );
+    INSERT INTO month_summary (user_id, year, month, day, status, task_count)
+    SELECT user_id, year, month, day, NULL, COUNT(*)
+    FROM tasks WHERE true GROUP BY user_id, year, month, day
+    ON CONFLICT (user_id, year, month, day) DO UPDATE SET task_count = excluded.task_count;
+    ''',
+    # 2: версия данных каждого (user_id, year, month). Растет при любой записи
+    # в user_calendar и tasks этого месяца в той же транзакции, строки не удаляются
+    '''
+    CREATE TABLE IF NOT EXISTS month_versions (
+        user_id INTEGER NOT NULL,
+        year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        version INTEGER NOT NULL,
+        PRIMARY KEY (user_id, year, month)
+    ) WITHOUT ROWID;
+
+    CREATE TRIGGER IF NOT EXISTS month_version_calendar_insert
+    AFTER INSERT ON user_calendar BEGIN
+        INSERT INTO month_versions (user_id, year, month, version)
+        VALUES (NEW.user_id, NEW.year, NEW.month, 1)
+        ON CONFLICT (user_id, year, month) DO UPDATE SET version = version + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS month_version_calendar_update
+    AFTER UPDATE ON user_calendar BEGIN
+        INSERT INTO month_versions (user_id, year, month, version)
+        VALUES (NEW.user_id, NEW.year, NEW.month, 1)
+        ON CONFLICT (user_id, year, month) DO UPDATE SET version = version + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS month_version_calendar_delete
+    AFTER DELETE ON user_calendar BEGIN
+        INSERT INTO month_versions (user_id, year, month, version)
+        VALUES (OLD.user_id, OLD.year, OLD.month, 1)
+        ON CONFLICT (user_id, year, month) DO UPDATE SET version = version + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS month_version_task_insert
+    AFTER INSERT ON tasks BEGIN
+        INSERT INTO month_versions (user_id, year, month, version)
+        VALUES (NEW.user_id, NEW.year, NEW.month, 1)
+        ON CONFLICT (user_id, year, month) DO UPDATE SET version = version + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS month_version_task_update
+    AFTER UPDATE ON tasks BEGIN
+        INSERT INTO month_versions (user_id, year, month, version)
+        VALUES (OLD.user_id, OLD.year, OLD.month, 1)
+        ON CONFLICT (user_id, year, month) DO UPDATE SET version = version + 1;
+        INSERT INTO month_versions (user_id, year, month, version)
+        VALUES (NEW.user_id, NEW.year, NEW.month, 1)
+        ON CONFLICT (user_id, year, month) DO UPDATE SET version = version + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS month_version_task_delete
+    AFTER DELETE ON tasks BEGIN
+        INSERT INTO month_versions (user_id, year, month, version)
+        VALUES (OLD.user_id, OLD.year, OLD.month, 1)
+        ON CONFLICT (user_id, year, month) DO UPDATE SET version = version + 1;
+    END;
+
+    INSERT OR IGNORE INTO month_versions (user_id, year, month, version)
+    SELECT DISTINCT user_id, year, month, 1 FROM month_summary;
+    ''',
+    # 3: полнотекстовый индекс задач. Таблица без собственного содержимого:
+    # rowid = tasks.id, owner = 'u<user_id>', чтобы фильтр по пользователю
+    # пересекал списки документов внутри FTS, а не отсекал чужие совпадения после
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+        owner, task, content='', tokenize='unicode61 remove_diacritics 2'
+    );
+
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_insert
+    AFTER INSERT ON tasks BEGIN
+        INSERT INTO tasks_fts (rowid, owner, task)
+        VALUES (NEW.id, 'u' || NEW.user_id, coalesce(NEW.task, ''));
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_delete
+    AFTER DELETE ON tasks BEGIN
+        INSERT INTO tasks_fts (tasks_fts, rowid, owner, task)
+        VALUES ('delete', OLD.id, 'u' || OLD.user_id, coalesce(OLD.task, ''));
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_update
+    AFTER UPDATE OF user_id, task ON tasks BEGIN
+        INSERT INTO tasks_fts (tasks_fts, rowid, owner, task)
+        VALUES ('delete', OLD.id, 'u' || OLD.user_id, coalesce(OLD.task, ''));
+        INSERT INTO tasks_fts (rowid, owner, task)
+        VALUES (NEW.id, 'u' || NEW.user_id, coalesce(NEW.task, ''));
+    END;
+
+    INSERT INTO tasks_fts (rowid, owner, task)
+    SELECT id, 'u' || user_id, coalesce(task, '') FROM tasks;
+    ''',
+    # 4: индекс под постраничный вывод задач дня по (time, id); старый индекс - его префикс
+    '''
+    CREATE INDEX IF NOT EXISTS idx_tasks_day_time ON tasks (user_id, year, month, day, time);
+    DROP INDEX IF EXISTS idx_tasks_day;
+    ''',
+    # 5: целочисленные дата и время. day_ordinal - номер дня от 1970-01-01,
+    # вычисляется из year/month/day и индексируется, поэтому диапазоны через
+    # границы месяцев - обычный range scan. reminder_at - момент напоминания
+    # в секундах Unix вместо строки, которую выдает адаптер sqlite3 для datetime
+    f'''
+    ALTER TABLE tasks ADD COLUMN day_ordinal INTEGER
+        GENERATED ALWAYS AS ({DAY_ORDINAL_SQL}) VIRTUAL;
+    ALTER TABLE user_calendar ADD COLUMN day_ordinal INTEGER
+        GENERATED ALWAYS AS ({DAY_ORDINAL_SQL}) VIRTUAL;
+    ALTER TABLE tasks ADD COLUMN reminder_at INTEGER;
+
+    UPDATE tasks SET reminder_at = CAST(strftime('%s', reminder_time) AS INTEGER)
+    WHERE reminder_time IS NOT NULL;
+
+    CREATE INDEX IF NOT EXISTS idx_tasks_user_ordinal ON tasks (user_id, day_ordinal, time);
+    CREATE INDEX IF NOT EXISTS idx_user_calendar_user_ordinal ON user_calendar (user_id, day_ordinal);
+    CREATE INDEX IF NOT EXISTS idx_tasks_reminder_due ON tasks (reminder_at) WHERE reminder_sent = 0;
+    ''',
+    # 6: поиск по юзернейму без учета регистра (юзернеймы Telegram - только ASCII)
+    '''
+    CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users (username COLLATE NOCASE);
+    ''',
+    # 7: UID события из импортированного .ics, чтобы повторный импорт не дублировал задачи
+    '''
+    ALTER TABLE tasks ADD COLUMN source_uid TEXT;
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_tasks_source_uid ON tasks (user_id, source_uid)
+        WHERE source_uid IS NOT NULL;
+    ''',
+    # 8: сохраненные группы. Строка group_requests с name - именованная группа
+    # владельца user_id, в user_ids - id участников через запятую
+    '''
+    ALTER TABLE group_requests ADD COLUMN name TEXT;
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_group_requests_name ON group_requests (user_id, name)
+        WHERE name IS NOT NULL;
+    ''',
+    # 9: повторяющиеся задачи. Серия хранится одной строкой, повторения
+    # вычисляются при чтении (recurrence.py). Исключения - отмененные
+    # повторения. next_reminder_at - момент ближайшего неотправленного
+    # напоминания серии, его пересчитывает бот после отправки
+    '''
+    CREATE TABLE IF NOT EXISTS task_series (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        task TEXT,
+        time TEXT,
+        reminder INTEGER,
+        freq TEXT NOT NULL,
+        interval INTEGER NOT NULL DEFAULT 1,
+        start_ordinal INTEGER NOT NULL,
+        until_ordinal INTEGER,
+        next_reminder_at INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(user_id) REFERENCES users(user_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_task_series_user ON task_series (user_id, start_ordinal);
+    CREATE INDEX IF NOT EXISTS idx_task_series_reminder_due ON task_series (next_reminder_at)
+        WHERE next_reminder_at IS NOT NULL;
+
+    CREATE TABLE IF NOT EXISTS task_series_exceptions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        series_id INTEGER NOT NULL,
+        day_ordinal INTEGER NOT NULL,
+        UNIQUE (series_id, day_ordinal)
+    );
+
+    CREATE TRIGGER IF NOT EXISTS month_version_series_insert
+    AFTER INSERT ON task_series BEGIN
+        INSERT INTO month_versions (user_id, year, month, version)
+        VALUES (NEW.user_id, 0, 0, 1)
+        ON CONFLICT (user_id, year, month) DO UPDATE SET version = version + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS month_version_series_update
+    AFTER UPDATE OF user_id, task, time, freq, interval, start_ordinal, until_ordinal ON task_series BEGIN
+        INSERT INTO month_versions (user_id, year, month, version)
+        VALUES (NEW.user_id, 0, 0, 1)
+        ON CONFLICT (user_id, year, month) DO UPDATE SET version = version + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS month_version_series_delete
+    AFTER DELETE ON task_series BEGIN
+        DELETE FROM task_series_exceptions WHERE series_id = OLD.id;
+        INSERT INTO month_versions (user_id, year, month, version)
+        VALUES (OLD.user_id, 0, 0, 1)
+        ON CONFLICT (user_id, year, month) DO UPDATE SET version = version + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS month_version_series_exception_insert
+    AFTER INSERT ON task_series_exceptions BEGIN
+        INSERT INTO month_versions (user_id, year, month, version)
+        SELECT user_id, 0, 0, 1 FROM task_series WHERE id = NEW.series_id
+        ON CONFLICT (user_id, year, month) DO UPDATE SET version = version + 1;
+    END;
+    ''',
+    # 10: ежедневная сводка. digest_next_at - момент следующей отправки,
+    # digest_day - день (day_ordinal), задачи которого в нее попадут
+    '''
+    ALTER TABLE users ADD COLUMN digest_time TEXT;
+    ALTER TABLE users ADD COLUMN digest_next_at INTEGER;
+    ALTER TABLE users ADD COLUMN digest_day INTEGER;
+    CREATE INDEX IF NOT EXISTS idx_users_digest_due ON users (digest_next_at)
+        WHERE digest_next_at IS NOT NULL;
+    ''',
+    # 11: версия месяца растет только при изменении видимых полей задачи. Отметка
+    # reminder_sent после каждого напоминания сбрасывала кэши рендера, ленты и групп
+    '''
+    DROP TRIGGER IF EXISTS month_version_task_update;
+    CREATE TRIGGER month_version_task_update
+    AFTER UPDATE OF user_id, year, month, day, task, time ON tasks BEGIN
+        INSERT INTO month_versions (user_id, year, month, version)
+        VALUES (OLD.user_id, OLD.year, OLD.month, 1)
+        ON CONFLICT (user_id, year, month) DO UPDATE SET version = version + 1;
+        INSERT INTO month_versions (user_id, year, month, version)
+        VALUES (NEW.user_id, NEW.year, NEW.month, 1)
+        ON CONFLICT (user_id, year, month) DO UPDATE SET version = version + 1;
+    END;
+    ''',
+]
+
+
+def pack_member_ids(user_ids):
+    return ','.join(map(str, sorted(set(user_ids))))
+
+
+def unpack_member_ids(packed):
+    return [int(user_id) for user_id in packed.split(',') if user_id]
+
+
+class UnitOfWork:
+    """Группа запросов на одном соединении внутри одной транзакции"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def execute(self, query, params=()):
+        if metrics.registry.enabled:
+            with metrics.db_query_latency.time(query_name(query)):
+                cursor = await self.conn.execute(query, params)
+                return await cursor.fetchall()
+        cursor = await self.conn.execute(query, params)
+        return await cursor.fetchall()
+
+    async def executemany(self, query, params_seq):
+        """Один запрос на много наборов параметров; возвращает число измененных строк"""
+        if metrics.registry.enabled:
+            with metrics.db_query_latency.time(query_name(query)):
+                cursor = await self.conn.executemany(query, params_seq)
+                return cursor.rowcount
+        cursor = await self.conn.executemany(query, params_seq)
+        return cursor.rowcount
+
+
+class StorageBackend(Protocol):
+    """Все, что бот, планировщик и чистка вызывают у хранилища.
+
+    Реализации: SQLiteBackend (файл БД) и MemoryBackend из memory_backend.py
+    (словари и индексы в памяти). Возвращаемые значения у них совпадают.
+    """
+
+    db_path: str
+
+    async def init_db(self): ...
+    async def start_writer(self): ...
+    async def stop_writer(self): ...
+
+    async def get_user_profile(self, user_id) -> Optional[UserProfile]: ...
+    async def user_exists(self, user_id) -> bool: ...
+    async def add_user(self, user_id, username, full_name): ...
+    async def set_user_mode(self, user_id, mode): ...
+    async def get_user_mode(self, user_id) -> str: ...
+    async def set_user_reminder(self, user_id, reminder): ...
+    async def get_user_reminder(self, user_id) -> int: ...
+    async def set_user_timezone(self, user_id, timezone): ...
+    async def get_user_timezone(self, user_id) -> str: ...
+    async def set_user_theme(self, user_id, theme): ...
+    async def get_user_theme(self, user_id) -> str: ...
+    async def set_user_digest(self, user_id, digest_time): ...
+    async def get_due_digests(self) -> list: ...
+    async def mark_digests_sent(self, digests): ...
+    async def get_user_ids_by_usernames(self, usernames) -> list: ...
+    async def list_users(self) -> list: ...
+
+    async def mark_day_busy(self, user_id, year, month, day): ...
+    async def mark_day_free(self, user_id, year, month, day): ...
+    async def reset_user_calendar(self, user_id, year, month): ...
+    async def get_user_calendar(self, user_id, month, year) -> dict: ...
+    async def get_month_version(self, user_id, year, month) -> int: ...
+    async def get_month_versions(self, user_ids, year, month) -> dict: ...
+    async def get_user_month_versions(self, user_id, first, last) -> dict: ...
+    async def find_common_free_days(self, user_ids, year, month) -> list: ...
+    async def get_month_busy_days(self, user_ids, year, month) -> dict: ...
+    async def get_busy_days_between(self, user_id, start, end) -> list: ...
+
+    async def add_task_series(self, user_id, year, month, day, task_text, task_time, reminder,
+                              freq, interval=1, until=None) -> int: ...
+    async def get_series_between(self, user_id, start, end) -> list: ...
+    async def skip_occurrences(self, series_id, days): ...
+    async def delete_series(self, series_id) -> bool: ...
+    async def get_series_for_reminders(self, horizon=0) -> list: ...
+    async def mark_series_reminder_sent(self, series_id, reminder_at): ...
+
+    async def save_group(self, user_id, name, member_ids) -> int: ...
+    async def get_user_groups(self, user_id) -> list: ...
+    async def get_group(self, group_id) -> Optional[dict]: ...
+    async def delete_group(self, group_id) -> bool: ...
+
+    async def add_task(self, user_id, year, month, day, task_text, task_time, reminder): ...
+    async def import_batch(self, user_id, tasks, busy_days) -> tuple: ...
+    async def get_tasks_for_day(self, user_id, year, month, day) -> list: ...
+    async def get_tasks_page(self, user_id, year, month, day, after=None, limit=10) -> tuple: ...
+    async def get_task_by_id(self, task_id) -> Optional[dict]: ...
+    async def delete_task(self, task_id) -> bool: ...
+    async def search_tasks(self, user_id, text, limit=20) -> list: ...
+    async def get_tasks_between(self, user_id, start, end) -> list: ...
+    async def get_tasks_for_reminders(self, horizon=0) -> list: ...
+    async def mark_reminder_sent(self, task_id): ...
+
+    async def cleanup_old_data(self, calendar_days=60, task_days=60, group_days=30,
+                               batch_size=500, pause=0.05, vacuum_pages=256) -> dict: ...
+
+
+class SQLiteBackend:
     def __init__(self, db_path=None):
-        from config import DB_PATH
+        from config import DB_PATH, PROFILE_CACHE_TTL, PROFILE_CACHE_SIZE
         self.db_path = db_path or DB_PATH
+        if self.db_path not in _profile_caches:
+            _profile_caches[self.db_path] = TTLCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
+        self.profiles = _profile_caches[self.db_path]
+        
+        # Точечные запросы одного тика объединяются в один WHERE ... IN (...)
+        self._profile_loader = BatchLoader(self._load_profiles)
+        self._task_loader = BatchLoader(self._load_tasks)
+        self._username_loader = BatchLoader(self._load_user_ids_by_username)
+
+    @property
+    def writer(self):
+        return _writers.get(self.db_path)
+
+    async def start_writer(self):
+        """Запускает единственного писателя: дальше все записи идут через групповой commit"""
+        from config import WRITE_BATCH_SIZE, WRITE_BATCH_DELAY_MS
+        if self.writer and self.writer.running:
+            return self.writer
+        writer = WriteQueue(self.db_path, UnitOfWork, WRITE_BATCH_SIZE, WRITE_BATCH_DELAY_MS / 1000)
+        await writer.start()
+        _writers[self.db_path] = writer
+        metrics.queue_depth.set_function(writer.depth, 'write_queue')
+        return writer
+
+    async def stop_writer(self):
+        writer = _writers.pop(self.db_path, None)
+        if writer:
+            await writer.stop()
 
     async def execute(self, query, params=(), commit=False):
+        writer = self.writer
+        if commit and writer and writer.running:
+            return await writer.submit(lambda uow: uow.execute(query, params))
+        if metrics.registry.enabled:
+            with metrics.db_query_latency.time(query_name(query)):
+                return await self._execute(query, params, commit)
+        return await self._execute(query, params, commit)
+
+    async def _execute(self, query, params, commit):
         async with aiosqlite.connect(self.db_path) as conn:
             cursor = await conn.execute(query, params)
+            # Строки читаем до commit: DELETE ... RETURNING иначе не даст закоммитить
+            rows = await cursor.fetchall()
             if commit:
                 await conn.commit()
-            return await cursor.fetchall()
+            return rows
+
+    async def atomic(self, work):
+        """Выполняет work(uow) на одном соединении с одним commit; при ошибке откатывает все"""
+        writer = self.writer
+        if writer and writer.running:
+            return await writer.submit(work)
+        async with aiosqlite.connect(self.db_path) as conn:
+            await conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = await work(UnitOfWork(conn))
+            except BaseException:
+                await conn.rollback()
+                raise
+            await conn.commit()
+            return result
 
     async def init_db(self):
         async with aiosqlite.connect(self.db_path) as conn:
+            # WAL: читатели не ждут писателя, а commit группы стоит один fsync
+            await conn.execute("PRAGMA journal_mode=WAL")
+            
             # Таблица пользователей
             await conn.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -78,10 +638,86 @@ class Database:
             ''')
             
             await conn.commit()
+            await self._migrate(conn)
+            
+            # Инкрементальный vacuum: место после чистки старых данных возвращается по частям.
+            # На существующей базе режим включается только через полный VACUUM (один раз)
+            cursor = await conn.execute("PRAGMA auto_vacuum")
+            if (await cursor.fetchone())[0] != 2:
+                logger.info("Включаем auto_vacuum=INCREMENTAL, выполняется VACUUM")
+                await conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                await conn.execute("VACUUM")
 
+    async def _migrate(self, conn):
+        cursor = await conn.execute("PRAGMA user_version")
+        version = (await cursor.fetchone())[0]
+        for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            logger.info(f"Применяем миграцию схемы {number}")
+            await conn.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {number};\nCOMMIT;")
+
+    async def get_user_profile(self, user_id):
+        profile = self.profiles.get(user_id)
+        if profile is not None:
+            return profile
+        
+        profile = await self._profile_loader.load(user_id)
+        if profile is not None:
+            self.profiles.set(user_id, profile)
+        return profile
+    
+    @staticmethod
+    def _placeholders(values):
+        return ', '.join(['?'] * len(values))
+    
+    async def _load_profiles(self, user_ids):
+        result = await self.execute(
+            "SELECT user_id, username, full_name, mode, reminder, timezone, theme, digest_time "
+            f"FROM users WHERE user_id IN ({self._placeholders(user_ids)})",
+            user_ids
+        )
+        return {row[0]: UserProfile(*row) for row in result}
+    
+    async def _load_tasks(self, task_ids):
+        result = await self.execute(
+            "SELECT id, user_id, year, month, day, task, time, reminder, reminder_time "
+            f"FROM tasks WHERE id IN ({self._placeholders(task_ids)})",
+            task_ids
+        )
+        return {
+            row[0]: {
+                'id': row[0],
+                'user_id': row[1],
+                'year': row[2],
+                'month': row[3],
+                'day': row[4],
+                'task': row[5],
+                'time': row[6],
+                'reminder': row[7],
+                'reminder_time': row[8]
+            }
+            for row in result
+        }
+    
+    async def _load_user_ids_by_username(self, usernames):
+        # Ключи приходят в нижнем регистре; COLLATE NOCASE берет idx_users_username_nocase
+        result = await self.execute(
+            "SELECT username, user_id FROM users "
+            f"WHERE username COLLATE NOCASE IN ({self._placeholders(usernames)}) "
+            "ORDER BY user_id",
+            usernames
+        )
+        user_ids = {}
+        for username, user_id in result:
+            user_ids.setdefault(username.lower(), []).append(user_id)
+        return user_ids
+    
+    def _update_cached_profile(self, user_id, **changes):
+        profile = self.profiles.get(user_id)
+        if profile is not None:
+            self.profiles.set(user_id, replace(profile, **changes))
+    
     async def user_exists(self, user_id):
-        result = await self.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
-        return bool(result)
+        return await self.get_user_profile(user_id) is not None
     
     async def add_user(self, user_id, username, full_name):
         await self.execute(
@@ -89,6 +725,7 @@ class Database:
             (user_id, username or '', full_name or ''),
             commit=True
         )
+        self.profiles.pop(user_id)
     
     async def set_user_mode(self, user_id, mode):
         await self.execute(
@@ -96,10 +733,11 @@ class Database:
             (mode, user_id),
             commit=True
         )
+        self._update_cached_profile(user_id, mode=mode)
     
     async def get_user_mode(self, user_id):
-        result = await self.execute("SELECT mode FROM users WHERE user_id = ?", (user_id,))
-        return result[0][0] if result else 'meeting'
+        profile = await self.get_user_profile(user_id)
+        return profile.mode if profile else 'meeting'
     
     async def set_user_reminder(self, user_id, reminder):
         await self.execute(
@@ -107,10 +745,11 @@ class Database:
             (reminder, user_id),
             commit=True
         )
+        self._update_cached_profile(user_id, reminder=reminder)
     
     async def get_user_reminder(self, user_id):
-        result = await self.execute("SELECT reminder FROM users WHERE user_id = ?", (user_id,))
-        return result[0][0] if result else 60
+        profile = await self.get_user_profile(user_id)
+        return profile.reminder if profile else 60
     
     async def set_user_timezone(self, user_id, timezone):
         await self.execute(
@@ -118,10 +757,14 @@ class Database:
             (timezone, user_id),
             commit=True
         )
+        self._update_cached_profile(user_id, timezone=timezone)
+        profile = await self.get_user_profile(user_id)
+        if profile and profile.digest_time:
+            await self.set_user_digest(user_id, profile.digest_time)
     
     async def get_user_timezone(self, user_id):
-        result = await self.execute("SELECT timezone FROM users WHERE user_id = ?", (user_id,))
-        return result[0][0] if result else 'Europe/Moscow'
+        profile = await self.get_user_profile(user_id)
+        return profile.timezone if profile else 'Europe/Moscow'
     
     async def set_user_theme(self, user_id, theme):
         await self.execute(
@@ -129,57 +772,138 @@ class Database:
             (theme, user_id),
             commit=True
         )
+        self._update_cached_profile(user_id, theme=theme)
     
     async def get_user_theme(self, user_id):
-        result = await self.execute("SELECT theme FROM users WHERE user_id = ?", (user_id,))
-        return result[0][0] if result else 'default'
+        profile = await self.get_user_profile(user_id)
+        return profile.theme if profile else 'default'
     
-    async def mark_day_busy(self, user_id, year, month, day):
+    async def set_user_digest(self, user_id, digest_time):
+        """Включает ежедневную сводку в digest_time (ЧЧ:ММ по времени пользователя), None - выключает"""
+        next_at = digest_day = None
+        if digest_time:
+            now_ts = int(datetime.now(timezone.utc).timestamp())
+            next_at, day = next_digest(digest_time, await self.get_user_timezone(user_id), now_ts)
+            digest_day = (day - EPOCH_DATE).days
         await self.execute(
-            "INSERT OR REPLACE INTO user_calendar (user_id, year, month, day, status) "
-            "VALUES (?, ?, ?, ?, 'busy')",
-            (user_id, year, month, day),
+            "UPDATE users SET digest_time = ?, digest_next_at = ?, digest_day = ? WHERE user_id = ?",
+            (digest_time, next_at, digest_day, user_id),
             commit=True
         )
+        self._update_cached_profile(user_id, digest_time=digest_time)
     
-    async def mark_day_free(self, user_id, year, month, day):
-        await self.execute(
-            "DELETE FROM user_calendar "
-            "WHERE user_id = ? AND year = ? AND month = ? AND day = ?",
-            (user_id, year, month, day),
-            commit=True
+    async def get_due_digests(self):
+        """Сводки, время которых подошло, одним запросом для всех пользователей:
+        [{'user_id', 'timezone', 'digest_time', 'day', 'tasks': [{'time', 'task'}]}]"""
+        now_ts = int(datetime.now(timezone.utc).timestamp())
+        # Частичный индекс idx_users_digest_due содержит только включенные сводки. Порядок
+        # по digest_next_at идет по этому индексу; ORDER BY u.user_id дал бы просмотр всех users
+        result = await self.execute(
+            "SELECT u.user_id, u.timezone, u.digest_time, u.digest_day, t.time, t.task "
+            "FROM users u LEFT JOIN tasks t ON t.user_id = u.user_id AND t.day_ordinal = u.digest_day "
+            "WHERE u.digest_next_at <= ? ORDER BY u.digest_next_at, u.user_id, t.time, t.id",
+            (now_ts,)
         )
+        digests = {}
+        for user_id, user_timezone, digest_time, digest_day, task_time, task in result:
+            digest = digests.get(user_id)
+            if digest is None:
+                digest = digests[user_id] = {
+                    'user_id': user_id, 'timezone': user_timezone, 'digest_time': digest_time,
+                    'day': EPOCH_DATE + timedelta(days=digest_day), 'tasks': []
+                }
+            if task is not None:
+                digest['tasks'].append({'time': task_time, 'task': task})
+        if digests:
+            days = [digest['day'] for digest in digests.values()]
+            add_series_to_digests(digests, await self._load_series(list(digests), min(days), max(days)))
+        return [digests[user_id] for user_id in sorted(digests)]
+    
+    async def mark_digests_sent(self, digests):
+        """Переводит сводки на следующий день. Пропущенные за время простоя не досылаются"""
+        now_ts = int(datetime.now(timezone.utc).timestamp())
+        updates = []
+        for digest in digests:
+            next_at, day = next_digest(digest['digest_time'], digest['timezone'], now_ts)
+            updates.append((next_at, (day - EPOCH_DATE).days, digest['user_id']))
+        
+        async def work(uow):
+            await uow.executemany(
+                "UPDATE users SET digest_next_at = ?, digest_day = ? WHERE user_id = ? "
+                "AND digest_time IS NOT NULL",
+                updates
+            )
+        
+        await self.atomic(work)
+    
+    async def mark_day_busy(self, user_id, year, month, day):
         await self.execute(
-            "DELETE FROM tasks "
-            "WHERE user_id = ? AND year = ? AND month = ? AND day = ?",
+            "INSERT OR REPLACE INTO user_calendar (user_id, year, month, day, status) "
+            "VALUES (?, ?, ?, ?, 'busy')",
             (user_id, year, month, day),
             commit=True
         )
     
+    async def mark_day_free(self, user_id, year, month, day):
+        async def work(uow):
+            await uow.execute(
+                "DELETE FROM user_calendar "
+                "WHERE user_id = ? AND year = ? AND month = ? AND day = ?",
+                (user_id, year, month, day)
+            )
+            await uow.execute(
+                "DELETE FROM tasks "
+                "WHERE user_id = ? AND year = ? AND month = ? AND day = ?",
+                (user_id, year, month, day)
+            )
+        await self.atomic(work)
+    
     async def add_task(self, user_id, year, month, day, task_text, task_time, reminder):
         # Рассчитываем время напоминания в UTC
         user_timezone = await self.get_user_timezone(user_id)
-        try:
-            tz = pytz.timezone(user_timezone)
-            task_datetime = tz.localize(datetime(
-                year, month, day,
-                int(task_time.split(':')[0]),
-                int(task_time.split(':')[1])
-            ))
-            reminder_time = task_datetime - timedelta(minutes=reminder)
-            reminder_time = reminder_time.astimezone(pytz.utc)
-        except Exception as e:
-            logger.error(f"Error calculating reminder time: {e}")
-            # Fallback: текущее время + reminder минут
-            reminder_time = datetime.now(timezone.utc) + timedelta(minutes=reminder)
+        reminder_time = compute_reminder_time(user_timezone, year, month, day, task_time, reminder)
         
         await self.execute(
-            "INSERT INTO tasks (user_id, year, month, day, task, time, reminder, reminder_time) "
-            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-            (user_id, year, month, day, task_text, task_time, reminder, reminder_time),
+            "INSERT INTO tasks (user_id, year, month, day, task, time, reminder, reminder_time, reminder_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, year, month, day, task_text, task_time, reminder, reminder_time,
+             int(reminder_time.timestamp())),
             commit=True
         )
     
+    async def import_batch(self, user_id, tasks, busy_days):
+        """Пачка импортированных задач и занятых дней одной транзакцией.
+        tasks - (year, month, day, task, time, reminder, source_uid). Задачи с уже
+        известным source_uid и уже занятые дни пропускаются, у прошедших напоминаний
+        сразу стоит reminder_sent. Возвращает (добавлено задач, добавлено дней)."""
+        user_timezone = await self.get_user_timezone(user_id)
+        now = datetime.now(timezone.utc)
+        task_rows = []
+        for year, month, day, task_text, task_time, reminder, source_uid in tasks:
+            reminder_time = compute_reminder_time(user_timezone, year, month, day, task_time, reminder)
+            task_rows.append((
+                user_id, year, month, day, task_text, task_time, reminder, reminder_time,
+                int(reminder_time.timestamp()), int(reminder_time <= now), source_uid
+            ))
+        day_rows = [(user_id, *day) * 2 for day in dict.fromkeys(busy_days)]
+        
+        async def work(uow):
+            added_tasks = await uow.executemany(
+                "INSERT OR IGNORE INTO tasks (user_id, year, month, day, task, time, reminder, "
+                "reminder_time, reminder_at, reminder_sent, source_uid) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                task_rows
+            ) if task_rows else 0
+            added_days = await uow.executemany(
+                "INSERT INTO user_calendar (user_id, year, month, day, status) "
+                "SELECT ?, ?, ?, ?, 'busy' WHERE NOT EXISTS (SELECT 1 FROM user_calendar "
+                "WHERE user_id = ? AND year = ? AND month = ? AND day = ? AND status = 'busy')",
+                day_rows
+            ) if day_rows else 0
+            return added_tasks, added_days
+        
+        return await self.atomic(work)
+    
     async def get_tasks_for_day(self, user_id, year, month, day):
         result = await self.execute(
             "SELECT id, task, time FROM tasks "
@@ -188,104 +912,157 @@ class Database:
         )
         return [{'id': row[0], 'task': row[1], 'time': row[2]} for row in result]
     
+    async def get_tasks_page(self, user_id, year, month, day, after=None, limit=10):
+        """Одна страница задач дня по (time, id) после курсора after = (time, id).
+        Возвращает (задачи, есть ли еще)."""
+        query = (
+            "SELECT id, task, time FROM tasks "
+            "WHERE user_id = ? AND year = ? AND month = ? AND day = ? "
+        )
+        params = [user_id, year, month, day]
+        if after:
+            query += "AND (time, id) > (?, ?) "
+            params.extend(after)
+        query += "ORDER BY time, id LIMIT ?"
+        params.append(limit + 1)
+        
+        result = await self.execute(query, params)
+        tasks = [{'id': row[0], 'task': row[1], 'time': row[2]} for row in result[:limit]]
+        return tasks, len(result) > limit
+    
     async def get_task_by_id(self, task_id):
-        result = await self.execute(
-            "SELECT * FROM tasks WHERE id = ?",
-            (task_id,)
-        )
-        if result:
-            return {
-                'id': result[0][0],
-                'user_id': result[0][1],
-                'year': result[0][2],
-                'month': result[0][3],
-                'day': result[0][4],
-                'task': result[0][5],
-                'time': result[0][6],
-                'reminder': result[0][7],
-                'reminder_time': result[0][8]
-            }
-        return None
+        return await self._task_loader.load(task_id)
     
     async def delete_task(self, task_id):
-        task = await self.get_task_by_id(task_id)
-        if not task:
-            return False
-        
-        await self.execute(
-            "DELETE FROM tasks WHERE id = ?",
-            (task_id,),
-            commit=True
-        )
-        
-        remaining = await self.execute(
-            "SELECT COUNT(*) FROM tasks "
-            "WHERE user_id = ? AND year = ? AND month = ? AND day = ?",
-            (task['user_id'], task['year'], task['month'], task['day'])
-        )
-        if remaining and remaining[0][0] == 0:
-            await self.execute(
+        async def work(uow):
+            deleted = await uow.execute(
+                "DELETE FROM tasks WHERE id = ? RETURNING user_id, year, month, day",
+                (task_id,)
+            )
+            if not deleted:
+                return False
+            
+            # Если это была последняя задача дня, снимаем и пометку дня
+            await uow.execute(
                 "DELETE FROM user_calendar "
-                "WHERE user_id = ? AND year = ? AND month = ? AND day = ?",
-                (task['user_id'], task['year'], task['month'], task['day']),
-                commit=True
+                "WHERE user_id = ? AND year = ? AND month = ? AND day = ? "
+                "AND NOT EXISTS (SELECT 1 FROM tasks "
+                "WHERE user_id = ? AND year = ? AND month = ? AND day = ?)",
+                tuple(deleted[0]) * 2
             )
+            return True
         
-        return True
+        return await self.atomic(work)
     
     async def get_user_calendar(self, user_id, month, year):
-        days_result = await self.execute(
-            "SELECT day, status FROM user_calendar "
+        result = await self.execute(
+            "SELECT day, status, task_count FROM month_summary "
             "WHERE user_id = ? AND year = ? AND month = ?",
             (user_id, year, month)
         )
-        
-        tasks_result = await self.execute(
-            "SELECT day, COUNT(*) as count FROM tasks "
-            "WHERE user_id = ? AND year = ? AND month = ? "
-            "GROUP BY day",
-            (user_id, year, month)
+        # День, у которого есть только задачи, считается занятым
+        calendar_days = {
+            day: {'status': status or 'busy', 'task_count': task_count}
+            for day, status, task_count in result
+        }
+        for day, count in (await self._series_days([user_id], year, month)).get(user_id, {}).items():
+            entry = calendar_days.setdefault(day, {'status': 'busy', 'task_count': 0})
+            entry['task_count'] += count
+        return calendar_days
+    
+    @staticmethod
+    def _fts_query(user_id, text):
+        """Переводит ввод пользователя в запрос FTS5: каждое слово ищется как префикс"""
+        words = [word.replace('"', '""') for word in text.split()]
+        if not words:
+            return None
+        terms = ' AND '.join(f'"{word}"*' for word in words)
+        return f'owner:"u{int(user_id)}" AND task:({terms})'
+    
+    async def search_tasks(self, user_id, text, limit=20):
+        """Задачи пользователя, подходящие под text: сначала самые релевантные, затем самые поздние"""
+        query = self._fts_query(user_id, text)
+        if not query:
+            return []
+        result = await self.execute(
+            "SELECT t.id, t.year, t.month, t.day, t.task, t.time "
+            "FROM tasks_fts JOIN tasks t ON t.id = tasks_fts.rowid "
+            "WHERE tasks_fts MATCH ? "
+            "ORDER BY bm25(tasks_fts, 0.0, 1.0), t.year DESC, t.month DESC, t.day DESC, t.time DESC "
+            "LIMIT ?",
+            (query, limit)
         )
-        
-        calendar_data = {}
-        for row in days_result:
-            day = row[0]
-            calendar_data[day] = {
-                'status': row[1],
-                'task_count': 0
-            }
-        
-        for row in tasks_result:
-            day = row[0]
-            if day in calendar_data:
-                calendar_data[day]['task_count'] = row[1]
-            else:
-                calendar_data[day] = {'status': 'busy', 'task_count': row[1]}
-        
-        return calendar_data
+        return [
+            {'id': row[0], 'year': row[1], 'month': row[2], 'day': row[3], 'task': row[4], 'time': row[5]}
+            for row in result
+        ]
     
-    async def reset_user_calendar(self, user_id, year, month):
-        await self.execute(
-            "DELETE FROM user_calendar "
-            "WHERE user_id = ? AND year = ? AND month = ?",
-            (user_id, year, month),
-            commit=True
+    async def get_month_version(self, user_id, year, month):
+        """Версия данных месяца пользователя; 0, если в этом месяце еще ничего не писали"""
+        result = await self.execute(
+            "SELECT sum(version) FROM month_versions "
+            "WHERE user_id = ? AND ((year = ? AND month = ?) OR (year = ? AND month = ?))",
+            (user_id, year, month, *SERIES_MONTH)
         )
-        await self.execute(
-            "DELETE FROM tasks "
-            "WHERE user_id = ? AND year = ? AND month = ?",
-            (user_id, year, month),
-            commit=True
+        return result[0][0] or 0
+    
+    async def get_month_versions(self, user_ids, year, month):
+        if not user_ids:
+            return {}
+        result = await self.execute(
+            "SELECT user_id, sum(version) FROM month_versions "
+            f"WHERE user_id IN ({self._placeholders(user_ids)}) "
+            "AND ((year = ? AND month = ?) OR (year = ? AND month = ?)) GROUP BY user_id",
+            (*user_ids, year, month, *SERIES_MONTH)
         )
+        versions = dict.fromkeys(user_ids, 0)
+        versions.update(result)
+        return versions
+    
+    async def get_user_month_versions(self, user_id, first, last):
+        """{(year, month): version} месяцев пользователя с first по last включительно.
+        first и last - пары (year, month); месяцы без записей в ответ не попадают."""
+        result = await self.execute(
+            "SELECT year, month, version FROM month_versions "
+            "WHERE user_id = ? AND ((year, month) BETWEEN (?, ?) AND (?, ?) OR (year = ? AND month = ?))",
+            (user_id, *first, *last, *SERIES_MONTH)
+        )
+        versions = {(year, month): version for year, month, version in result}
+        return spread_series_version(versions, first, last)
+    
+    async def reset_user_calendar(self, user_id, year, month):
+        async def work(uow):
+            await uow.execute(
+                "DELETE FROM user_calendar "
+                "WHERE user_id = ? AND year = ? AND month = ?",
+                (user_id, year, month)
+            )
+            await uow.execute(
+                "DELETE FROM tasks "
+                "WHERE user_id = ? AND year = ? AND month = ?",
+                (user_id, year, month)
+            )
+        await self.atomic(work)
     
     async def get_user_ids_by_usernames(self, usernames):
+        found = await self.user_ids_by_username(usernames)
+        return [user_id for user_ids in found.values() for user_id in user_ids]
+    
+    async def user_ids_by_username(self, usernames):
+        """{username: [user_id, ...]} для найденных юзернеймов в порядке usernames, без учета регистра"""
         if not usernames:
-            return []
+            return {}
         
-        placeholders = ', '.join(['?'] * len(usernames))
-        query = f"SELECT user_id FROM users WHERE username IN ({placeholders})"
-        result = await self.execute(query, usernames)
-        return [row[0] for row in result]
+        unique = list(dict.fromkeys(usernames))
+        found = await self._username_loader.load_many([username.lower() for username in unique])
+        return {username: user_ids for username, user_ids in zip(unique, found) if user_ids}
+    
+    async def list_users(self):
+        """(user_id, username, full_name) всех пользователей с юзернеймом - для справочника"""
+        result = await self.execute(
+            "SELECT user_id, username, full_name FROM users WHERE username != ''"
+        )
+        return [tuple(row) for row in result]
     
     async def find_common_free_days(self, user_ids, year, month):
         if not user_ids or len(user_ids) > 20:
@@ -295,35 +1072,225 @@ class Database:
         _, days_in_month = calendar.monthrange(year, month)
         all_days = set(range(1, days_in_month + 1))
         
-        busy_days = set()
-        for user_id in user_ids:
-            result = await self.execute(
-                "SELECT day FROM user_calendar "
-                "WHERE user_id = ? AND year = ? AND month = ? AND status = 'busy'",
-                (user_id, year, month)
-            )
-            calendar_busy = {row[0] for row in result}
-            
-            result = await self.execute(
-                "SELECT DISTINCT day FROM tasks "
-                "WHERE user_id = ? AND year = ? AND month = ?",
-                (user_id, year, month))
-            tasks_busy = {row[0] for row in result}
-            
-            user_busy_days = calendar_busy | tasks_busy
-            busy_days |= user_busy_days
+        result = await self.execute(
+            "SELECT DISTINCT day FROM month_summary "
+            f"WHERE user_id IN ({self._placeholders(user_ids)}) AND year = ? AND month = ? "
+            "AND (status = 'busy' OR task_count > 0)",
+            (*user_ids, year, month)
+        )
+        busy_days = {row[0] for row in result}
+        for days in (await self._series_days(user_ids, year, month)).values():
+            busy_days.update(days)
         
         free_days = all_days - busy_days
         return sorted(free_days)
     
-    async def get_tasks_for_reminders(self):
-        now_utc = datetime.now(timezone.utc)
+    async def get_month_busy_days(self, user_ids, year, month):
+        """Занятые дни месяца по каждому пользователю: {user_id: [day, ...]}"""
+        if not user_ids:
+            return {}
+        result = await self.execute(
+            "SELECT user_id, day FROM month_summary "
+            f"WHERE user_id IN ({self._placeholders(user_ids)}) AND year = ? AND month = ? "
+            "AND (status = 'busy' OR task_count > 0)",
+            (*user_ids, year, month)
+        )
+        busy = {user_id: [] for user_id in user_ids}
+        for user_id, day in result:
+            busy[user_id].append(day)
+        for user_id, days in (await self._series_days(user_ids, year, month)).items():
+            busy[user_id] = sorted(set(busy[user_id]).union(days))
+        return busy
+    
+    # Повторяющиеся задачи
+    
+    _SERIES_COLUMNS = (
+        "s.id, s.user_id, s.task, s.time, s.reminder, s.freq, s.interval, s.start_ordinal, s.until_ordinal"
+    )
+    
+    async def _load_series(self, user_ids, start, end):
+        """Серии пользователей, у которых могут быть повторения с start по end,
+        вместе с исключениями в этом диапазоне"""
+        first, last = (start - EPOCH_DATE).days, (end - EPOCH_DATE).days
+        result = await self.execute(
+            f"SELECT {self._SERIES_COLUMNS}, ("
+            "SELECT group_concat(e.day_ordinal) FROM task_series_exceptions e "
+            "WHERE e.series_id = s.id AND e.day_ordinal BETWEEN ? AND ?"
+            f") FROM task_series s WHERE s.user_id IN ({self._placeholders(user_ids)}) "
+            "AND s.start_ordinal <= ? AND (s.until_ordinal IS NULL OR s.until_ordinal >= ?) ORDER BY s.id",
+            (first, last, *user_ids, last, first)
+        )
+        return [make_series(*row[:9], map(int, row[9].split(',')) if row[9] else ()) for row in result]
+    
+    async def _load_series_by_id(self, series_id):
+        """Серия со всеми исключениями; None, если ее нет"""
         result = await self.execute(
-            "SELECT id, user_id, task FROM tasks "
-            "WHERE reminder_sent = 0 AND reminder_time <= ?",
-            (now_utc,)
+            f"SELECT {self._SERIES_COLUMNS}, ("
+            "SELECT group_concat(e.day_ordinal) FROM task_series_exceptions e WHERE e.series_id = s.id"
+            ") FROM task_series s WHERE s.id = ?",
+            (series_id,)
         )
-        return [{'id': row[0], 'user_id': row[1], 'task': row[2]} for row in result]
+        if not result:
+            return None
+        row = result[0]
+        return make_series(*row[:9], map(int, row[9].split(',')) if row[9] else ())
+    
+    async def _series_days(self, user_ids, year, month):
+        first = date(year, month, 1)
+        last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+        return month_occurrences(await self._load_series(user_ids, first, last), year, month)
+    
+    async def _next_series_reminder(self, series, after=None):
+        after = after or int(datetime.now(timezone.utc).timestamp())
+        found = next_reminder(series, await self.get_user_timezone(series['user_id']), after)
+        return found[1] if found else None
+    
+    async def add_task_series(self, user_id, year, month, day, task_text, task_time, reminder,
+                              freq, interval=1, until=None):
+        """Повторяющаяся задача: одна строка на всю серию с первого повторения year-month-day.
+        until - дата последнего повторения или None. Возвращает id серии."""
+        start_ordinal = day_ordinal(year, month, day)
+        until_ordinal = (until - EPOCH_DATE).days if until else None
+        series = make_series(None, user_id, task_text, task_time, reminder, freq, interval,
+                             start_ordinal, until_ordinal)
+        result = await self.execute(
+            "INSERT INTO task_series (user_id, task, time, reminder, freq, interval, "
+            "start_ordinal, until_ordinal, next_reminder_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING id",
+            (user_id, task_text, task_time, reminder, freq, interval, start_ordinal, until_ordinal,
+             await self._next_series_reminder(series)),
+            commit=True
+        )
+        return result[0][0]
+    
+    async def get_series_between(self, user_id, start, end):
+        """Серии пользователя с повторениями с start по end (исключения - только из этого диапазона)"""
+        return await self._load_series([user_id], start, end)
+    
+    async def skip_occurrences(self, series_id, days):
+        """Отменяет повторения серии в даты days, остальные остаются"""
+        async def work(uow):
+            await uow.executemany(
+                "INSERT OR IGNORE INTO task_series_exceptions (series_id, day_ordinal) VALUES (?, ?)",
+                [(series_id, (day - EPOCH_DATE).days) for day in days]
+            )
+        
+        await self.atomic(work)
+        await self._refresh_series_reminder(series_id)
+    
+    async def _refresh_series_reminder(self, series_id, after=None):
+        series = await self._load_series_by_id(series_id)
+        if series is None:
+            return
+        await self.execute(
+            "UPDATE task_series SET next_reminder_at = ? WHERE id = ?",
+            (await self._next_series_reminder(series, after), series_id),
+            commit=True
+        )
+    
+    async def delete_series(self, series_id):
+        result = await self.execute(
+            "DELETE FROM task_series WHERE id = ? RETURNING id", (series_id,), commit=True
+        )
+        return bool(result)
+    
+    async def get_series_for_reminders(self, horizon=0):
+        """Серии, у которых подошло ближайшее напоминание, в том же виде, что get_tasks_for_reminders"""
+        now_ts = int(datetime.now(timezone.utc).timestamp())
+        result = await self.execute(
+            "SELECT id, user_id, task, time, next_reminder_at FROM task_series "
+            "WHERE next_reminder_at IS NOT NULL AND next_reminder_at <= ?",
+            (now_ts + horizon,)
+        )
+        return [
+            {'id': row[0], 'user_id': row[1], 'task': row[2], 'time': row[3], 'reminder_at': row[4]}
+            for row in result
+        ]
+    
+    async def mark_series_reminder_sent(self, series_id, reminder_at):
+        """Переводит серию на следующее повторение. Пропущенные за время простоя
+        напоминания серии не досылаются: следующее ищется позже текущего момента"""
+        now_ts = int(datetime.now(timezone.utc).timestamp())
+        await self._refresh_series_reminder(series_id, max(reminder_at, now_ts))
+    
+    async def save_group(self, user_id, name, member_ids):
+        """Сохраняет группу под именем; группа с тем же именем перезаписывается. Возвращает id"""
+        result = await self.execute(
+            "INSERT INTO group_requests (user_id, name, user_ids) VALUES (?, ?, ?) "
+            "ON CONFLICT (user_id, name) WHERE name IS NOT NULL "
+            "DO UPDATE SET user_ids = excluded.user_ids, created_at = CURRENT_TIMESTAMP "
+            "RETURNING id",
+            (user_id, name, pack_member_ids(member_ids)),
+            commit=True
+        )
+        return result[0][0]
+    
+    async def get_user_groups(self, user_id):
+        result = await self.execute(
+            "SELECT id, name, user_ids FROM group_requests "
+            "WHERE user_id = ? AND name IS NOT NULL ORDER BY name",
+            (user_id,)
+        )
+        return [
+            {'id': row[0], 'user_id': user_id, 'name': row[1], 'user_ids': unpack_member_ids(row[2])}
+            for row in result
+        ]
+    
+    async def get_group(self, group_id):
+        result = await self.execute(
+            "SELECT id, user_id, name, user_ids FROM group_requests WHERE id = ? AND name IS NOT NULL",
+            (group_id,)
+        )
+        if not result:
+            return None
+        row = result[0]
+        return {'id': row[0], 'user_id': row[1], 'name': row[2], 'user_ids': unpack_member_ids(row[3])}
+    
+    async def delete_group(self, group_id):
+        result = await self.execute(
+            "DELETE FROM group_requests WHERE id = ? AND name IS NOT NULL RETURNING id",
+            (group_id,),
+            commit=True
+        )
+        return bool(result)
+    
+    async def get_tasks_for_reminders(self, horizon=0):
+        """Неотправленные напоминания, срок которых наступит в ближайшие horizon секунд"""
+        now_ts = int(datetime.now(timezone.utc).timestamp())
+        # Частичный индекс idx_tasks_reminder_due содержит только неотправленные
+        result = await self.execute(
+            "SELECT id, user_id, task, time, reminder_at FROM tasks "
+            "WHERE reminder_sent = 0 AND reminder_at <= ?",
+            (now_ts + horizon,)
+        )
+        return [
+            {'id': row[0], 'user_id': row[1], 'task': row[2], 'time': row[3], 'reminder_at': row[4]}
+            for row in result
+        ]
+    
+    async def get_tasks_between(self, user_id, start, end):
+        """Задачи пользователя с даты start по end включительно, в том числе через границы месяцев"""
+        result = await self.execute(
+            "SELECT id, year, month, day, task, time, reminder FROM tasks "
+            "WHERE user_id = ? AND day_ordinal BETWEEN ? AND ? "
+            "ORDER BY day_ordinal, time, id",
+            (user_id, (start - EPOCH_DATE).days, (end - EPOCH_DATE).days)
+        )
+        return [
+            {'id': row[0], 'year': row[1], 'month': row[2], 'day': row[3],
+             'task': row[4], 'time': row[5], 'reminder': row[6]}
+            for row in result
+        ]
+    
+    async def get_busy_days_between(self, user_id, start, end):
+        """Даты из user_calendar со статусом 'busy' в диапазоне [start, end]"""
+        result = await self.execute(
+            "SELECT DISTINCT year, month, day FROM user_calendar "
+            "WHERE user_id = ? AND day_ordinal BETWEEN ? AND ? AND status = 'busy' "
+            "ORDER BY day_ordinal",
+            (user_id, (start - EPOCH_DATE).days, (end - EPOCH_DATE).days)
+        )
+        return [date(*row) for row in result]
     
     async def mark_reminder_sent(self, task_id):
         await self.execute(
@@ -332,20 +1299,118 @@ class Database:
             commit=True
         )
     
-    async def cleanup_old_data(self):
-        two_months_ago = datetime.now() - timedelta(days=60)
-        await self.execute(
-            "DELETE FROM user_calendar WHERE updated_at < ?",
-            (two_months_ago,),
+    async def purge_batch(self, table, condition, params, after_id, limit):
+        """Удаляет до limit строк table с id > after_id, подходящих под condition.
+        Возвращает удаленные id по возрастанию."""
+        result = await self.execute(
+            f"DELETE FROM {table} WHERE id IN ("
+            f"SELECT id FROM {table} WHERE id > ? AND {condition} ORDER BY id LIMIT ?"
+            ") RETURNING id",
+            (after_id, *params, limit),
             commit=True
         )
-        await self.execute(
-            "DELETE FROM tasks WHERE created_at < ?",
-            (two_months_ago,),
-            commit=True
+        return sorted(row[0] for row in result)
+    
+    async def storage_stats(self):
+        page_size = await self.execute("PRAGMA page_size")
+        page_count = await self.execute("PRAGMA page_count")
+        freelist = await self.execute("PRAGMA freelist_count")
+        return {
+            'page_size': page_size[0][0],
+            'page_count': page_count[0][0],
+            'freelist_count': freelist[0][0]
+        }
+    
+    async def incremental_vacuum(self, pages):
+        await self.execute(f"PRAGMA incremental_vacuum({int(pages)})", commit=True)
+    
+    async def cleanup_old_data(self, calendar_days=60, task_days=60, group_days=30,
+                               batch_size=500, pause=0.05, vacuum_pages=256):
+        """Удаляет старые данные небольшими пачками по возрастанию id,
+        уступая цикл событий между пачками, и возвращает освободившееся место.
+        Дни календаря и задачи считаются старыми по своей дате, а не по дате создания."""
+        today = datetime.now().date()
+        
+        def day_key(days):
+            return (today - timedelta(days=days) - EPOCH_DATE).days
+        
+        group_cutoff = datetime.now(timezone.utc) - timedelta(days=group_days)
+        rules = [
+            ('user_calendar', "day_ordinal < ?", (day_key(calendar_days),)),
+            ('tasks', "day_ordinal < ?", (day_key(task_days),)),
+            ('task_series', "until_ordinal < ?", (day_key(task_days),)),
+            ('task_series_exceptions', "day_ordinal < ?", (day_key(task_days),)),
+            # Сохраненные группы живут, пока их не удалит владелец
+            ('group_requests', "created_at < ? AND name IS NULL", (group_cutoff.strftime('%Y-%m-%d %H:%M:%S'),)),
+        ]
+        
+        stats_before = await self.storage_stats()
+        report = {'rows': {}}
+        for table, condition, params in rules:
+            deleted = 0
+            after_id = 0
+            while True:
+                ids = await self.purge_batch(table, condition, params, after_id, batch_size)
+                if not ids:
+                    break
+                deleted += len(ids)
+                after_id = ids[-1]
+                await asyncio.sleep(pause)
+            report['rows'][table] = deleted
+        
+        freelist = (await self.storage_stats())['freelist_count']
+        while freelist:
+            await self.incremental_vacuum(vacuum_pages)
+            remaining = (await self.storage_stats())['freelist_count']
+            if remaining >= freelist:
+                break
+            freelist = remaining
+            await asyncio.sleep(pause)
+        
+        stats_after = await self.storage_stats()
+        report['bytes_reclaimed'] = (
+            (stats_before['page_count'] - stats_after['page_count']) * stats_after['page_size']
         )
+        return report
+
+
+def spread_series_version(versions, first, last):
+    """Прибавляет версию серий пользователя ко всем месяцам с first по last"""
+    series_version = versions.pop(SERIES_MONTH, 0)
+    if not series_version:
+        return versions
+    spread = {}
+    year, month = first
+    while (year, month) <= tuple(last):
+        spread[(year, month)] = versions.get((year, month), 0) + series_version
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return spread
+
+
+def is_memory_path(db_path):
+    return db_path == ':memory:' or db_path.startswith('memory://')
+
+
+def open_database(db_path=None) -> StorageBackend:
+    """Хранилище для db_path (по умолчанию config.DB_PATH): ':memory:' или
+    'memory://имя' - MemoryBackend, иначе файл SQLite, при DB_SHARDS > 1 -
+    несколько файлов по user_id (см. sharding.py). На один путь создается
+    один экземпляр, его делят бот, планировщик и чистка."""
+    from config import DB_PATH, DB_SHARDS
+    db_path = db_path or DB_PATH
+    if db_path not in _databases:
+        if is_memory_path(db_path):
+            from memory_backend import MemoryBackend
+            _databases[db_path] = MemoryBackend(db_path)
+        elif DB_SHARDS > 1:
+            from sharding import ShardedBackend
+            _databases[db_path] = ShardedBackend(db_path, DB_SHARDS)
+        else:
+            _databases[db_path] = SQLiteBackend(db_path)
+    return _databases[db_path]
+
 
 async def init_db():
-    db = Database()
+    db = open_database()
     await db.init_db()
     return db
\ No newline at end of file
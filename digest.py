@@ -0,0 +1,25 @@
+from datetime import datetime, timedelta
+
+import pytz
+
+
+def next_digest(digest_time, user_timezone, after):
+    """(момент в секундах Unix, день) ближайшей сводки позже момента after.
+    День - локальная дата пользователя, задачи которой попадут в сводку."""
+    try:
+        tz = pytz.timezone(user_timezone)
+    except pytz.UnknownTimeZoneError:
+        tz = pytz.timezone('Europe/Moscow')
+    hour, minute = map(int, digest_time.split(':'))
+    day = datetime.fromtimestamp(after, tz).date()
+    while True:
+        moment = int(tz.localize(datetime(day.year, day.month, day.day, hour, minute)).timestamp())
+        if moment > after:
+            return moment, day
+        day += timedelta(days=1)
+
+
+def format_digest(day, tasks):
+    lines = [f"☀️ Задачи на {day:%d.%m}:"]
+    lines += [f"• {task['time'] or ''} — {task['task']}" for task in tasks]
+    return '\n'.join(lines)
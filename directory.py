@@ -0,0 +1,75 @@
+from array import array
+from bisect import bisect_left, bisect_right
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class UserDirectory:
+    """Известные боту пользователи для подсказок по префиксу.
+
+    Ключи - юзернейм, полное имя и каждое слово имени в нижнем регистре -
+    лежат в отсортированном списке, рядом массив user_id той же длины.
+    Поиск - bisect до первого ключа с префиксом и проход вперед, пока
+    префикс совпадает. Пользователи без юзернейма не индексируются: выбрать
+    их в группу все равно нельзя.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._user_ids = array('q')
+        self._users = {}
+
+    def __len__(self):
+        return len(self._users)
+
+    @staticmethod
+    def _index_keys(username, full_name):
+        keys = {username.lower()}
+        if full_name:
+            full_name = full_name.lower()
+            keys.add(full_name)
+            keys.update(full_name.split())
+        return keys
+
+    def load(self, users):
+        """Строит индекс заново по (user_id, username, full_name)"""
+        self._users = {}
+        entries = []
+        for user_id, username, full_name in users:
+            if not username or user_id in self._users:
+                continue
+            self._users[user_id] = (username, full_name or '')
+            entries.extend((key, user_id) for key in self._index_keys(username, full_name))
+        entries.sort()
+        self._keys = [key for key, _ in entries]
+        self._user_ids = array('q', (user_id for _, user_id in entries))
+        logger.info(f"Справочник пользователей: {len(self._users)} пользователей, {len(self._keys)} ключей")
+
+    def add(self, user_id, username, full_name):
+        """Добавляет нового пользователя; уже известный не меняется, как INSERT OR IGNORE в add_user"""
+        if not username or user_id in self._users:
+            return
+        self._users[user_id] = (username, full_name or '')
+        for key in self._index_keys(username, full_name):
+            position = bisect_right(self._keys, key)
+            self._keys.insert(position, key)
+            self._user_ids.insert(position, user_id)
+
+    def search(self, prefix, limit=20):
+        """До limit пользователей, у которых юзернейм, имя или слово имени начинается с prefix.
+        Возвращает [(user_id, username, full_name)] по алфавиту ключей."""
+        prefix = prefix.lstrip('@').lower()
+        found = {}
+        position = bisect_left(self._keys, prefix)
+        while position < len(self._keys) and len(found) < limit:
+            if not self._keys[position].startswith(prefix):
+                break
+            user_id = self._user_ids[position]
+            if user_id not in found:
+                found[user_id] = (user_id, *self._users[user_id])
+            position += 1
+        return list(found.values())
+
+
+user_directory = UserDirectory()
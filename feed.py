@@ -0,0 +1,172 @@
+import calendar
+from datetime import date, datetime, timedelta, timezone
+import hashlib
+import hmac
+import logging
+
+import pytz
+
+import config
+from cache import TTLCache
+from recurrence import occurrences_between
+
+logger = logging.getLogger(__name__)
+
+FEED_HEADER = (
+    "BEGIN:VCALENDAR\r\n"
+    "VERSION:2.0\r\n"
+    "PRODID:-//Notion Calendar Bot//RU\r\n"
+    "CALSCALE:GREGORIAN\r\n"
+    "X-WR-CALNAME:Календарь бота\r\n"
+).encode('utf-8')
+FEED_FOOTER = b"END:VCALENDAR\r\n"
+
+
+def feed_token(user_id):
+    """Секретная часть адреса ленты: HMAC от user_id, хранить ничего не нужно"""
+    secret = (config.FEED_SECRET or config.BOT_TOKEN or '').encode()
+    return hmac.new(secret, f"feed:{user_id}".encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def check_feed_token(user_id, token):
+    return hmac.compare_digest(feed_token(user_id), token)
+
+
+def feed_url(user_id):
+    if not config.PUBLIC_URL:
+        return None
+    return f"{config.PUBLIC_URL.rstrip('/')}/calendar/{user_id}/{feed_token(user_id)}.ics"
+
+
+def feed_months(today, back, ahead):
+    """Месяцы ленты: от back месяцев назад до ahead месяцев вперед, как пары (year, month)"""
+    index = today.year * 12 + today.month - 1
+    return [(i // 12, i % 12 + 1) for i in range(index - back, index + ahead + 1)]
+
+
+def escape_text(value):
+    return (
+        value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+    )
+
+
+def fold(line):
+    """Строка свойства с переносами по 75 байт (RFC 5545), не разрывая символы UTF-8"""
+    parts = []
+    current = []
+    size = 0
+    limit = 75
+    for char in line:
+        width = len(char.encode('utf-8'))
+        if size + width > limit:
+            parts.append(''.join(current))
+            current = []
+            size = 0
+            limit = 74
+        current.append(char)
+        size += width
+    parts.append(''.join(current))
+    return '\r\n '.join(parts) + '\r\n'
+
+
+class FeedBuilder:
+    """ICS-ленты пользователей, собранные из кусков по месяцам.
+
+    Кусок месяца перестраивается, только если изменилась версия месяца
+    (month_versions) или часовой пояс пользователя. ETag ленты - хэш версий
+    всех месяцев окна, поэтому проверка If-None-Match стоит один запрос к
+    month_versions. Last-Modified - момент, когда этот процесс впервые увидел
+    текущий ETag.
+    """
+
+    def __init__(self, db, cache_size, ttl):
+        self.db = db
+        self.months = TTLCache(cache_size, ttl)
+        self.seen = TTLCache(cache_size, ttl)
+
+    async def state(self, user_id):
+        """(профиль, месяцы, версии, {'etag', 'last_modified'}) или None для неизвестного пользователя"""
+        profile = await self.db.get_user_profile(user_id)
+        if profile is None:
+            return None
+        months = feed_months(datetime.now().date(), config.FEED_MONTHS_BACK, config.FEED_MONTHS_AHEAD)
+        versions = await self.db.get_user_month_versions(user_id, months[0], months[-1])
+        signature = (profile.timezone, *((year, month, versions.get((year, month), 0)) for year, month in months))
+        etag = '"' + hashlib.sha1(repr(signature).encode()).hexdigest()[:24] + '"'
+
+        seen = self.seen.get(user_id)
+        if seen is None or seen['etag'] != etag:
+            seen = {'etag': etag, 'last_modified': datetime.now(timezone.utc).replace(microsecond=0)}
+            self.seen.set(user_id, seen)
+        return profile, months, versions, seen
+
+    async def month_chunk(self, profile, year, month, version):
+        if not version:
+            return b''
+        key = (profile.user_id, year, month)
+        cached = self.months.get(key)
+        if cached and cached[0] == version and cached[1] == profile.timezone:
+            return cached[2]
+
+        chunk = await self._render_month(profile, year, month)
+        self.months.set(key, (version, profile.timezone, chunk))
+        return chunk
+
+    async def _render_month(self, profile, year, month):
+        first = date(year, month, 1)
+        last = date(year, month, calendar.monthrange(year, month)[1])
+        tasks = await self.db.get_tasks_between(profile.user_id, first, last)
+        busy_days = await self.db.get_busy_days_between(profile.user_id, first, last)
+        # Повторения серий разворачиваются только для этого месяца
+        events = [
+            (f"task-{task['id']}", date(task['year'], task['month'], task['day']), task['time'], task['task'])
+            for task in tasks
+        ]
+        for series in await self.db.get_series_between(profile.user_id, first, last):
+            events.extend(
+                (f"series-{series['id']}-{day:%Y%m%d}", day, series['time'], series['task'])
+                for day in occurrences_between(series, first, last)
+            )
+
+        try:
+            tz = pytz.timezone(profile.timezone)
+        except pytz.UnknownTimeZoneError:
+            tz = pytz.timezone('Europe/Moscow')
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+        lines = []
+        for uid, day, task_time, text in events:
+            try:
+                hour, minute = map(int, task_time.split(':'))
+                start = tz.localize(datetime(day.year, day.month, day.day, hour, minute))
+            except (AttributeError, ValueError):
+                continue
+            lines += [
+                "BEGIN:VEVENT",
+                f"UID:{uid}@calendar-bot",
+                f"DTSTAMP:{stamp}",
+                f"DTSTART:{start.astimezone(pytz.utc).strftime('%Y%m%dT%H%M%SZ')}",
+                fold(f"SUMMARY:{escape_text(text or '')}").rstrip('\r\n'),
+                "END:VEVENT",
+            ]
+        for day in busy_days:
+            lines += [
+                "BEGIN:VEVENT",
+                f"UID:busy-{profile.user_id}-{day:%Y%m%d}@calendar-bot",
+                f"DTSTAMP:{stamp}",
+                f"DTSTART;VALUE=DATE:{day:%Y%m%d}",
+                f"DTEND;VALUE=DATE:{day + timedelta(days=1):%Y%m%d}",
+                "SUMMARY:Занято",
+                "TRANSP:OPAQUE",
+                "END:VEVENT",
+            ]
+        return ''.join(line + '\r\n' for line in lines).encode('utf-8')
+
+
+def _create_feed_builder():
+    from database import open_database
+    return FeedBuilder(open_database(), config.FEED_CACHE_SIZE, config.FEED_CACHE_TTL)
+
+
+feed_builder = _create_feed_builder()
@@ -0,0 +1,211 @@
+import asyncio
+from contextvars import ContextVar
+from heapq import heappop, heappush
+from itertools import count
+import logging
+import time
+
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Полосы исходящих запросов: меньшее число обслуживается раньше
+INTERACTIVE = 0
+BACKGROUND = 1
+LANE_NAMES = {INTERACTIVE: 'interactive', BACKGROUND: 'background'}
+
+# Полоса текущей задачи asyncio. По умолчанию запросы интерактивные;
+# фоновые циклы (напоминания, сводки) переключают себя через set_lane
+current_lane: ContextVar[int] = ContextVar('bot_api_lane', default=INTERACTIVE)
+
+# Служебные методы не ограничиваются: long polling не должен ждать в очереди
+UNLIMITED_METHODS = {'GetUpdates', 'GetMe', 'SetWebhook', 'DeleteWebhook', 'GetWebhookInfo', 'Close', 'LogOut'}
+# Лимиты Telegram считают сообщения: общий - отправку и правку, на чат - только
+# отправку. Удаление и ответы на callback в лимиты не входят и очереди не ждут
+LIMITED_PREFIXES = ('Send', 'Copy', 'Forward', 'Edit')
+CHAT_LIMITED_PREFIXES = ('Send', 'Copy', 'Forward')
+
+
+def set_lane(lane):
+    current_lane.set(lane)
+
+
+class RateLimiter:
+    """Ведро токенов с очередью по полосам.
+
+    Пока токены есть и никто не ждет, запрос проходит сразу. Иначе он
+    встает в кучу (полоса, порядок поступления), и один насос выдает
+    токены по мере пополнения: сначала интерактивным, потом фоновым.
+    Полосу можно приостановить (retry_after); новые запросы будят насос,
+    чтобы интерактивный запрос не ждал окончания паузы фоновых.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = {}
+        self._waiters = []
+        self._order = count()
+        self._wakeup = asyncio.Event()
+        self._pump = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+    def pause(self, seconds, lanes=(INTERACTIVE, BACKGROUND)):
+        until = time.monotonic() + seconds
+        for lane in lanes:
+            self.paused_until[lane] = max(self.paused_until.get(lane, 0), until)
+        self._wakeup.set()
+
+    def waiting(self, lane=None):
+        return sum(1 for waiter_lane, _, future in self._waiters
+                   if not future.done() and (lane is None or waiter_lane == lane))
+
+    def idle(self):
+        self._refill()
+        return not self._waiters and self.tokens >= self.burst and max(self.paused_until.values(), default=0) <= self.updated
+
+    async def acquire(self, lane):
+        now = self._refill()
+        if not self._waiters and self.tokens >= 1 and self.paused_until.get(lane, 0) <= now:
+            self.tokens -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heappush(self._waiters, (lane, next(self._order), future))
+        self._wakeup.set()
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run())
+        await future
+
+    async def _run(self):
+        while self._waiters:
+            lane, _, future = self._waiters[0]
+            if future.done():
+                # Ожидание отменено, пока запрос стоял в очереди
+                heappop(self._waiters)
+                continue
+            now = self._refill()
+            delay = self.paused_until.get(lane, 0) - now
+            if self.tokens < 1:
+                delay = max(delay, (1 - self.tokens) / self.rate)
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heappop(self._waiters)
+            self.tokens -= 1
+            future.set_result(None)
+
+
+class OutboundGateway(BaseRequestMiddleware):
+    """Единая точка всех исходящих запросов к Bot API.
+
+    Подключается middleware сессии бота, поэтому через нее идут и прямые
+    вызовы bot.send_message, и message.edit_text, и ответы на callback.
+    Каждый запрос берет токен из общего ведра (лимит бота) и, если это
+    сообщение в чат, из ведра чата. 429 обрабатывается здесь: чат (или
+    фоновая полоса целиком) ставится на паузу retry_after, и запрос
+    повторяется, так что вызывающий код про флуд-контроль не знает.
+    """
+
+    def __init__(self, global_rate, global_burst, chat_rate, chat_burst, max_retries=3, max_chats=10000):
+        self.global_limiter = RateLimiter(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self.chats = {}
+
+    def _chat_limiter(self, chat_id):
+        limiter = self.chats.get(chat_id)
+        if limiter is None:
+            if len(self.chats) >= self.max_chats:
+                # Забываем чаты, ведра которых полны и никто не ждет
+                self.chats = {key: value for key, value in self.chats.items() if not value.idle()}
+            limiter = self.chats[chat_id] = RateLimiter(self.chat_rate, self.chat_burst)
+        return limiter
+
+    def waiting(self, lane):
+        return self.global_limiter.waiting(lane) + sum(limiter.waiting(lane) for limiter in self.chats.values())
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        if name in UNLIMITED_METHODS:
+            return await make_request(bot, method)
+
+        lane = current_lane.get()
+        chat_id = getattr(method, 'chat_id', None)
+        limited = name.startswith(LIMITED_PREFIXES)
+        chat_limiter = None
+        if chat_id is not None and name.startswith(CHAT_LIMITED_PREFIXES):
+            chat_limiter = self._chat_limiter(chat_id)
+
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            if chat_limiter:
+                await chat_limiter.acquire(lane)
+            if limited:
+                await self.global_limiter.acquire(lane)
+                metrics.outbound_wait.observe(time.monotonic() - started, LANE_NAMES[lane])
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                metrics.outbound_throttled.inc(LANE_NAMES[lane])
+                logger.warning(f"Флуд-контроль на {name} (чат {chat_id}, полоса {LANE_NAMES[lane]}): "
+                               f"пауза {e.retry_after} с, попытка {attempt + 1}")
+                if chat_id is not None:
+                    self._chat_limiter(chat_id).pause(e.retry_after)
+                if chat_id is None or lane == BACKGROUND:
+                    # Фоновая рассылка уперлась в лимит - притормаживаем ее всю,
+                    # интерактивные запросы продолжают идти
+                    self.global_limiter.pause(e.retry_after, (lane,) if chat_id is not None else (INTERACTIVE, BACKGROUND))
+                if attempt == self.max_retries:
+                    raise
+                # Повтор ждет паузу в ведре чата или общей полосы. Правки ведра чата
+                # не берут, а интерактивная полоса из-за одного чата не встает,
+                # поэтому без паузы в ведре retry_after выжидается здесь
+                paused = chat_limiter is not None or (limited and (chat_id is None or lane == BACKGROUND))
+                if not paused:
+                    await asyncio.sleep(e.retry_after)
+
+
+class GatewaySession(AiohttpSession):
+    """Сессия aiohttp с настроенным пулом соединений к Bot API"""
+
+    def __init__(self, limit, keepalive_timeout, **kwargs):
+        super().__init__(limit=limit, **kwargs)
+        # Все запросы идут на один хост: держим соединения дольше 15 с по умолчанию,
+        # чтобы паузы между пачками напоминаний не стоили нового TLS-рукопожатия
+        self._connector_init.update(limit_per_host=limit, keepalive_timeout=keepalive_timeout)
+
+
+def create_session():
+    session = GatewaySession(config.BOT_API_CONNECTIONS, config.BOT_API_KEEPALIVE)
+    if config.BOT_API_URL:
+        session.api = TelegramAPIServer.from_base(config.BOT_API_URL)
+    session.middleware(gateway)
+    return session
+
+
+gateway = OutboundGateway(
+    config.BOT_API_GLOBAL_RATE, config.BOT_API_GLOBAL_BURST,
+    config.BOT_API_CHAT_RATE, config.BOT_API_CHAT_BURST,
+    config.BOT_API_MAX_RETRIES
+)
+metrics.queue_depth.set_function(lambda: gateway.waiting(INTERACTIVE), 'outbound_interactive')
+metrics.queue_depth.set_function(lambda: gateway.waiting(BACKGROUND), 'outbound_background')
@@ -0,0 +1,67 @@
+import calendar
+import logging
+
+from cache import TTLCache
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class GroupAvailability:
+    """Общие свободные дни групп с кэшем по участникам.
+
+    Вклад участника - битовая маска занятых дней месяца вместе с версией
+    месяца (month_versions), по которой она построена. На запрос группы
+    сначала читаются только версии участников; маски перечитываются у тех,
+    чья версия изменилась, остальные берутся из кэша. Маски общие для всех
+    групп, где есть участник, а готовый ответ группы хранится отдельно и
+    отдается без пересчета, пока версии всех участников прежние.
+    """
+
+    def __init__(self, cache_size=10000, ttl=86400):
+        self.members = TTLCache(cache_size, ttl)
+        self.results = TTLCache(cache_size, ttl)
+
+    async def free_days(self, db, user_ids, year, month):
+        user_ids = sorted(set(user_ids))
+        if not user_ids or len(user_ids) > 20:
+            return []
+
+        versions = await db.get_month_versions(user_ids, year, month)
+        signature = tuple(versions[user_id] for user_id in user_ids)
+        result_key = (tuple(user_ids), year, month)
+        cached = self.results.get(result_key)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+        masks = {}
+        stale = []
+        for user_id in user_ids:
+            member = self.members.get((user_id, year, month))
+            if member and member[0] == versions[user_id]:
+                masks[user_id] = member[1]
+            elif versions[user_id] == 0:
+                # Месяц пользователя не менялся ни разу - занятых дней нет
+                masks[user_id] = 0
+            else:
+                stale.append(user_id)
+
+        if stale:
+            busy = await db.get_month_busy_days(stale, year, month)
+            for user_id in stale:
+                mask = 0
+                for day in busy[user_id]:
+                    mask |= 1 << day
+                masks[user_id] = mask
+                self.members.set((user_id, year, month), (versions[user_id], mask))
+
+        busy_mask = 0
+        for mask in masks.values():
+            busy_mask |= mask
+        _, days_in_month = calendar.monthrange(year, month)
+        days = [day for day in range(1, days_in_month + 1) if not busy_mask >> day & 1]
+        self.results.set(result_key, (signature, days))
+        return days
+
+
+group_availability = GroupAvailability(config.GROUP_CACHE_SIZE, config.GROUP_CACHE_TTL)
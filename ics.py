@@ -0,0 +1,224 @@
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+import logging
+import re
+
+import pytz
+
+logger = logging.getLogger(__name__)
+
+# Сколько дней подряд может занимать одно событие на весь день
+MAX_ALL_DAY_SPAN = 366
+
+Event = namedtuple('Event', 'uid summary start end all_day alarm')
+
+_ESCAPED = re.compile(r'\\([\\;,nN])')
+_DURATION = re.compile(
+    r'^(?P<sign>[+-])?P(?:(?P<weeks>\d+)W)?(?:(?P<days>\d+)D)?'
+    r'(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:(?P<seconds>\d+)S)?)?$'
+)
+
+
+def unfold(lines):
+    """Склеивает свернутые строки iCalendar: продолжение начинается с пробела или табуляции"""
+    current = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t'):
+            if current is not None:
+                current += line[1:]
+            continue
+        if current:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def split_property(line):
+    """'DTSTART;TZID=Europe/Moscow:20240101T100000' -> ('DTSTART', {'TZID': ...}, '20240101T100000')"""
+    if '"' not in line:
+        i = line.find(':')
+        if i < 0:
+            return None
+    else:
+        # В кавычках параметра может быть двоеточие, например в ALTREP
+        quoted = False
+        for i, char in enumerate(line):
+            if char == '"':
+                quoted = not quoted
+            elif char == ':' and not quoted:
+                break
+        else:
+            return None
+    name, *params = line[:i].split(';')
+    parsed = {}
+    for param in params:
+        key, _, value = param.partition('=')
+        parsed[key.upper()] = value.strip('"')
+    return name.upper(), parsed, line[i + 1:]
+
+
+def unescape(value):
+    return _ESCAPED.sub(lambda m: '\n' if m.group(1) in 'nN' else m.group(1), value)
+
+
+def parse_moment(value, params):
+    """Дата (событие на весь день) или datetime; с TZID или Z - с часовым поясом,
+    иначе плавающее время, которое понимается в поясе пользователя"""
+    value = value.strip()
+    if params.get('VALUE') == 'DATE' or len(value) == 8:
+        return date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+    if len(value) < 15 or value[8] != 'T':
+        raise ValueError(f"Неверная дата-время: {value}")
+    moment = datetime(
+        int(value[:4]), int(value[4:6]), int(value[6:8]),
+        int(value[9:11]), int(value[11:13]), int(value[13:15])
+    )
+    if value.endswith('Z'):
+        return pytz.utc.localize(moment)
+    if 'TZID' in params:
+        try:
+            return pytz.timezone(params['TZID']).localize(moment)
+        except pytz.UnknownTimeZoneError:
+            logger.debug(f"Неизвестный TZID {params['TZID']}, время считается местным")
+    return moment
+
+
+def alarm_minutes(value, params):
+    """За сколько минут до начала срабатывает TRIGGER вида -PT15M; None, если не так"""
+    if params.get('RELATED', 'START') != 'START':
+        return None
+    match = _DURATION.match(value.strip())
+    if not match:
+        return None
+    parts = {key: int(number or 0) for key, number in match.groupdict().items() if key != 'sign'}
+    minutes = (
+        parts['weeks'] * 7 * 24 * 60 + parts['days'] * 24 * 60
+        + parts['hours'] * 60 + parts['minutes'] + parts['seconds'] // 60
+    )
+    return minutes if match.group('sign') == '-' else None
+
+
+def _make_event(properties):
+    if 'DTSTART' not in properties:
+        return None
+    if properties.get('STATUS', ({}, ''))[1].upper() == 'CANCELLED':
+        return None
+    try:
+        params, value = properties['DTSTART']
+        start = parse_moment(value, params)
+        end = None
+        if 'DTEND' in properties:
+            params, value = properties['DTEND']
+            end = parse_moment(value, params)
+    except ValueError:
+        return None
+
+    uid = properties.get('UID', ({}, None))[1]
+    recurrence_id = properties.get('RECURRENCE-ID', ({}, None))[1]
+    if uid and recurrence_id:
+        # Измененные повторения делят UID с серией
+        uid = f"{uid}/{recurrence_id}"
+    alarm = properties.get('TRIGGER')
+    return Event(
+        uid=uid,
+        summary=unescape(properties.get('SUMMARY', ({}, ''))[1]).strip(),
+        start=start,
+        end=end,
+        all_day=not isinstance(start, datetime),
+        alarm=alarm_minutes(alarm[1], alarm[0]) if alarm else None
+    )
+
+
+def iter_events(lines):
+    """События VEVENT по одному, без загрузки всего файла и без дерева объектов.
+    Для событий, которые не удалось разобрать, выдает None."""
+    properties = None
+    depth = 0
+    for line in unfold(lines):
+        parsed = split_property(line)
+        if parsed is None:
+            continue
+        name, params, value = parsed
+
+        if name == 'BEGIN':
+            if properties is None:
+                if value.upper() == 'VEVENT':
+                    properties = {}
+            else:
+                depth += 1
+        elif name == 'END':
+            if properties is None:
+                continue
+            if depth:
+                depth -= 1
+            elif value.upper() == 'VEVENT':
+                yield _make_event(properties)
+                properties = None
+        elif properties is not None:
+            if depth:
+                # Вложенный VALARM: берем только первое напоминание
+                if name == 'TRIGGER':
+                    properties.setdefault('TRIGGER', (params, value))
+            elif name in ('UID', 'SUMMARY', 'DTSTART', 'DTEND', 'STATUS', 'RECURRENCE-ID'):
+                properties[name] = (params, value)
+
+
+def event_days(event):
+    """Дни, которые занимает событие на весь день; DTEND в iCalendar не включается"""
+    end = event.end if event.end and not isinstance(event.end, datetime) else None
+    span = (end - event.start).days if end and end > event.start else 1
+    return [event.start + timedelta(days=offset) for offset in range(min(span, MAX_ALL_DAY_SPAN))]
+
+
+async def import_ics(db, user_id, lines, batch_size=500, since=None):
+    """Переносит события из строк файла .ics: события со временем - в задачи,
+    события на весь день - в занятые дни. Пишет пачками по batch_size одной
+    транзакцией на пачку. События раньше since пропускаются."""
+    profile = await db.get_user_profile(user_id)
+    try:
+        user_tz = pytz.timezone(profile.timezone)
+    except pytz.UnknownTimeZoneError:
+        user_tz = pytz.timezone('Europe/Moscow')
+
+    stats = {'tasks': 0, 'busy_days': 0, 'skipped': 0}
+    tasks = []
+    busy_days = []
+
+    async def flush():
+        added_tasks, added_days = await db.import_batch(user_id, tasks, busy_days)
+        stats['tasks'] += added_tasks
+        stats['busy_days'] += added_days
+        tasks.clear()
+        busy_days.clear()
+
+    for event in iter_events(lines):
+        if event is None:
+            stats['skipped'] += 1
+            continue
+
+        if event.all_day:
+            days = [day for day in event_days(event) if not since or day >= since]
+            if not days:
+                stats['skipped'] += 1
+            busy_days.extend((day.year, day.month, day.day) for day in days)
+        else:
+            start = event.start.astimezone(user_tz) if event.start.tzinfo else event.start
+            if since and start.date() < since:
+                stats['skipped'] += 1
+                continue
+            tasks.append((
+                start.year, start.month, start.day,
+                event.summary or 'Без названия',
+                start.strftime('%H:%M'),
+                event.alarm if event.alarm is not None else profile.reminder,
+                event.uid
+            ))
+
+        if len(tasks) + len(busy_days) >= batch_size:
+            await flush()
+
+    if tasks or busy_days:
+        await flush()
+    return stats
@@ -2,7 +2,24 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 import calendar
 from datetime import datetime
+from functools import lru_cache, wraps
 
+import config
+from memstats import memory_monitor
+
+# Сколько разных календарных клавиатур держать в памяти
+CALENDAR_KEYBOARD_CACHE_SIZE = 512
+
+def static_keyboard(build):
+    """Строит неизменяемую клавиатуру один раз при импорте и дальше отдает ее же"""
+    markup = build()
+
+    @wraps(build)
+    def wrapper():
+        return markup
+    return wrapper
+
+@static_keyboard
 def create_mode_selection_keyboard():
     builder = InlineKeyboardBuilder()
     builder.button(text="📅 Режим встреч", callback_data="mode_meeting")
@@ -10,6 +27,7 @@ def create_mode_selection_keyboard():
     builder.adjust(1)
     return builder.as_markup()
 
+@static_keyboard
 def create_timezone_keyboard():
     builder = InlineKeyboardBuilder()
     timezones = [
@@ -25,6 +43,7 @@ def create_timezone_keyboard():
     builder.adjust(2)
     return builder.as_markup()
 
+@static_keyboard
 def create_theme_selection_keyboard():
     builder = InlineKeyboardBuilder()
     themes = [
@@ -39,19 +58,43 @@ def create_theme_selection_keyboard():
     builder.adjust(2)
     return builder.as_markup()
 
+@static_keyboard
+def create_digest_keyboard():
+    builder = InlineKeyboardBuilder()
+    for digest_time in config.DIGEST_TIMES:
+        builder.button(text=digest_time, callback_data=f"digest_{digest_time}")
+    builder.button(text="🚫 Выключить", callback_data="digest_off")
+    builder.adjust(3)
+    return builder.as_markup()
+
+def occupancy_signature(busy_days):
+    """Сжимает занятость месяца в две битовые маски: дни без задач и дни с задачами"""
+    busy_mask = 0
+    task_mask = 0
+    if busy_days:
+        for day, data in busy_days.items():
+            if data.get('task_count', 0) > 0:
+                task_mask |= 1 << day
+            else:
+                busy_mask |= 1 << day
+    return busy_mask, task_mask
+
 def create_calendar_keyboard(year, month, busy_days=None, mode='normal'):
+    busy_mask, task_mask = occupancy_signature(busy_days)
+    return _build_calendar_keyboard(year, month, busy_mask, task_mask, mode)
+
+@lru_cache(maxsize=CALENDAR_KEYBOARD_CACHE_SIZE)
+def _build_calendar_keyboard(year, month, busy_mask, task_mask, mode):
     builder = InlineKeyboardBuilder()
     
     _, days_in_month = calendar.monthrange(year, month)
     days = list(range(1, days_in_month + 1))
     
     for day in days:
-        if busy_days and day in busy_days:
-            task_count = busy_days[day].get('task_count', 0)
-            if task_count > 0:
-                btn_text = f"{day}📝"
-            else:
-                btn_text = f"{day}✅"
+        if task_mask >> day & 1:
+            btn_text = f"{day}📝"
+        elif busy_mask >> day & 1:
+            btn_text = f"{day}✅"
         else:
             btn_text = str(day)
         
@@ -80,6 +123,7 @@ def create_calendar_keyboard(year, month, busy_days=None, mode='normal'):
     
     return builder.as_markup()
 
+@lru_cache(maxsize=None)
 def create_time_selection_keyboard(page=0):
     builder = InlineKeyboardBuilder()
     
@@ -103,17 +147,20 @@ def create_time_selection_keyboard(page=0):
     builder.adjust(4, 1)
     return builder.as_markup()
 
+@static_keyboard
 def create_skip_button():
     builder = InlineKeyboardBuilder()
     builder.button(text="⏩ Пропустить", callback_data="skip_task")
     return builder.as_markup()
 
+@static_keyboard
 def create_task_decision_keyboard():
     builder = InlineKeyboardBuilder()
     builder.button(text="➕ Добавить задачу", callback_data="add_another_task")
     builder.button(text="↩️ К календарю", callback_data="back_to_calendar")
     return builder.as_markup()
 
+@static_keyboard
 def create_compact_reminder_keyboard():
     builder = InlineKeyboardBuilder()
     reminders = [5, 15, 30, 60, 120]
@@ -123,7 +170,26 @@ def create_compact_reminder_keyboard():
     builder.adjust(3)
     return builder.as_markup()
 
-def create_tasks_list_keyboard(tasks):
+@static_keyboard
+def create_repeat_keyboard():
+    builder = InlineKeyboardBuilder()
+    builder.button(text="Не повторять", callback_data="repeat_none")
+    builder.button(text="🔁 Каждый день", callback_data="repeat_daily")
+    builder.button(text="🔁 Каждую неделю", callback_data="repeat_weekly")
+    builder.button(text="🔁 Каждый месяц", callback_data="repeat_monthly")
+    builder.adjust(1)
+    return builder.as_markup()
+
+@static_keyboard
+def create_repeat_count_keyboard():
+    builder = InlineKeyboardBuilder()
+    for count, text in ((4, "4 раза"), (8, "8 раз"), (12, "12 раз")):
+        builder.button(text=text, callback_data=f"repeat_count_{count}")
+    builder.button(text="♾ Без конца", callback_data="repeat_count_0")
+    builder.adjust(3, 1)
+    return builder.as_markup()
+
+def create_tasks_list_keyboard(tasks, has_prev=False, has_next=False, series=()):
     builder = InlineKeyboardBuilder()
     for task in tasks:
         builder.button(
@@ -134,16 +200,32 @@ def create_tasks_list_keyboard(tasks):
             text="❌", 
             callback_data=f"delete_task_{task['id']}"
         )
+    # Повторение можно отменить только в этот день или удалить всю серию
+    for item in series:
+        builder.button(text=f"⏭ {item['task'][:10]}", callback_data=f"skip_occurrence_{item['id']}")
+        builder.button(text="🗑 🔁", callback_data=f"delete_series_{item['id']}")
+    if has_prev:
+        builder.button(text="⬅️ Пред.", callback_data="tasks_prev")
+    if has_next:
+        builder.button(text="След. ➡️", callback_data="tasks_next")
     builder.button(text="↩️ Назад", callback_data="back_to_days")
     builder.adjust(2, repeat=True)
     return builder.as_markup()
 
+@static_keyboard
+def create_back_to_calendar_keyboard():
+    builder = InlineKeyboardBuilder()
+    builder.button(text="↩️ Назад", callback_data="back_to_calendar")
+    return builder.as_markup()
+
+@static_keyboard
 def create_confirmation_keyboard():
     builder = InlineKeyboardBuilder()
     builder.button(text="✅ Да", callback_data="confirm_reset")
     builder.button(text="❌ Нет", callback_data="cancel_reset")
     return builder.as_markup()
 
+@lru_cache(maxsize=8)
 def create_main_reply_keyboard(user_mode):
     builder = ReplyKeyboardBuilder()
     builder.button(text="📅 Календарь")
@@ -155,17 +237,42 @@ def create_main_reply_keyboard(user_mode):
     builder.adjust(2)
     return builder.as_markup(resize_keyboard=True, one_time_keyboard=False)
 
+@static_keyboard
 def create_settings_reply_keyboard():
     builder = ReplyKeyboardBuilder()
     builder.button(text="🔄 Сменить режим")
     builder.button(text="⏱ Напоминание")
     builder.button(text="🌍 Часовой пояс")
     builder.button(text="🎨 Тема")
+    builder.button(text="📰 Сводка дня")
     builder.button(text="↩️ Главное меню")
     builder.adjust(2)
     return builder.as_markup(resize_keyboard=True)
 
+@static_keyboard
 def create_group_mode_keyboard():
     builder = ReplyKeyboardBuilder()
     builder.button(text="↩️ Назад")
-    return builder.as_markup(resize_keyboard=True)
\ No newline at end of file
+    return builder.as_markup(resize_keyboard=True)
+
+def create_saved_groups_keyboard(groups):
+    builder = InlineKeyboardBuilder()
+    for group in groups:
+        builder.button(text=f"👥 {group['name']}", callback_data=f"group_show_{group['id']}")
+        builder.button(text="❌", callback_data=f"group_delete_{group['id']}")
+    builder.adjust(2, repeat=True)
+    return builder.as_markup()
+
+@static_keyboard
+def create_participant_picker_keyboard():
+    builder = InlineKeyboardBuilder()
+    builder.button(text="🔎 Найти по имени", switch_inline_query_current_chat="")
+    return builder.as_markup()
+
+# Прогреваем обе страницы выбора времени и оба варианта главного меню
+for _page in (0, 1):
+    create_time_selection_keyboard(_page)
+for _mode in ('meeting', 'todo'):
+    create_main_reply_keyboard(_mode)
+
+memory_monitor.register('calendar_keyboards', lambda: _build_calendar_keyboard.cache_info().currsize)
@@ -0,0 +1,537 @@
+"""Нагрузочный тест бота на локальной заглушке Bot API.
+
+    python loadtest.py --users 2000 --duration 120
+    python loadtest.py --users 300 --duration 60 --record updates.jsonl
+    python loadtest.py --replay updates.jsonl --speed 5
+
+Поднимает HTTP-сервер, который отвечает на getUpdates, sendMessage,
+sendPhoto, deleteMessage, editMessage* и остальные методы так же, как
+Telegram, и запускает бота (main.py) отдельным процессом с BOT_API_URL на
+этот сервер и чистой БД. Виртуальные пользователи проходят сценарии
+CalendarStates - регистрацию, отметку дней, добавление задач, поиск общих
+дней и настройки, - нажимая кнопки из клавиатур, которые прислал бот.
+
+Задержка шага - от появления апдейта на сервере до первого подходящего
+ответа бота в чат, то есть то, что видит пользователь. В конце печатается
+пропускная способность, перцентили задержек по шагам и ошибки.
+
+Запись (--record) сохраняет выданные боту апдейты с отметками времени;
+воспроизведение (--replay) принимает такой файл или просто апдейты
+Telegram по одному JSON в строке.
+"""
+import argparse
+import asyncio
+from itertools import count
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+
+FAKE_TOKEN = '123456:loadtest'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Calendar', 'username': 'calendar_loadtest_bot'}
+# Ответы, которые пользователь видит в чате; по первому из них считается задержка шага
+VISIBLE_METHODS = {
+    'sendmessage', 'sendphoto', 'senddocument',
+    'editmessagetext', 'editmessagereplymarkup', 'editmessagecaption',
+}
+SEND_METHODS = {'sendmessage', 'sendphoto', 'senddocument'}
+TIMEZONES = ('Europe/Moscow', 'Asia/Yekaterinburg', 'Europe/Kaliningrad', 'Asia/Novosibirsk')
+TASK_NAMES = ('Созвон', 'Тренировка', 'Врач', 'Отчет', 'Купить продукты', 'День рождения')
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Stats:
+    """Задержки по шагам, ошибки и число запросов к Bot API"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.api_calls = {}
+        self.updates = 0
+        self.started = time.monotonic()
+
+    def observe(self, step, seconds):
+        self.latencies.setdefault(step, []).append(seconds)
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        every = [value for values in self.latencies.values() for value in values]
+        steps = {}
+        for step, values in sorted(self.latencies.items()) + [('all', every)]:
+            steps[step] = {
+                'count': len(values),
+                'p50': percentile(values, 0.5),
+                'p95': percentile(values, 0.95),
+                'p99': percentile(values, 0.99),
+                'max': max(values, default=0.0),
+            }
+        api_total = sum(self.api_calls.values())
+        failed = sum(self.errors.values())
+        return {
+            'elapsed': elapsed,
+            'updates': self.updates,
+            'updates_per_second': self.updates / elapsed if elapsed else 0.0,
+            'api_calls': dict(sorted(self.api_calls.items())),
+            'api_calls_per_second': api_total / elapsed if elapsed else 0.0,
+            'error_rate': failed / (len(every) + failed) if every or failed else 0.0,
+            'errors': dict(sorted(self.errors.items())),
+            'steps': steps,
+        }
+
+
+def print_report(report, header):
+    print(header)
+    print(f"Длительность: {report['elapsed']:.1f} с")
+    print(f"Апдейтов: {report['updates']} ({report['updates_per_second']:.1f}/с), "
+          f"запросов к Bot API: {sum(report['api_calls'].values())} ({report['api_calls_per_second']:.1f}/с)")
+    print(f"{'шаг':<24}{'число':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  мс")
+    for step, row in report['steps'].items():
+        print(f"{step:<24}{row['count']:>8}" + ''.join(
+            f"{row[key] * 1000:>9.0f}" for key in ('p50', 'p95', 'p99', 'max')
+        ))
+    print(f"Ошибки: {report['error_rate']:.2%}")
+    for kind, number in report['errors'].items():
+        print(f"  {kind}: {number}")
+
+
+class FakeBotAPI:
+    """Заглушка Bot API: отдает апдейты через long polling и принимает ответы бота.
+
+    Видимые ответы (сообщения и их правка) складываются в очередь чата, из
+    которой их ждут виртуальные пользователи. flood_rate - доля отправок,
+    на которые сервер отвечает 429, как Telegram при превышении лимитов.
+    """
+
+    def __init__(self, stats, flood_rate=0.0, record=None):
+        self.stats = stats
+        self.flood_rate = flood_rate
+        self.record = record
+        self.pending = []
+        self.update_ids = count(1)
+        self.arrived = asyncio.Condition()
+        self.inboxes = {}
+        self.message_ids = {}
+        self.delivered = set()
+        self.polling = asyncio.Event()
+        self.started = time.monotonic()
+
+    def inbox(self, chat_id):
+        queue = self.inboxes.get(chat_id)
+        if queue is None:
+            queue = self.inboxes[chat_id] = asyncio.Queue()
+        return queue
+
+    async def push(self, update):
+        """Кладет апдейт в очередь бота; возвращает момент, от которого считается задержка"""
+        update = {**update, 'update_id': next(self.update_ids)}
+        async with self.arrived:
+            self.pending.append(update)
+            self.arrived.notify_all()
+        self.stats.updates += 1
+        return time.monotonic()
+
+    async def handle(self, request):
+        method = request.match_info['method'].lower()
+        try:
+            params = dict(await request.post()) if request.can_read_body else dict(request.query)
+        except ConnectionResetError:
+            # Бот остановлен посреди загрузки картинки
+            return web.Response(status=499)
+        self.stats.api_calls[method] = self.stats.api_calls.get(method, 0) + 1
+
+        if method == 'getupdates':
+            return self._ok(await self._get_updates(params))
+        if method == 'getme':
+            return self._ok(BOT_USER)
+        if method in SEND_METHODS and self.flood_rate and random.random() < self.flood_rate:
+            return web.json_response({
+                'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                'parameters': {'retry_after': 1},
+            })
+        if method not in VISIBLE_METHODS:
+            return self._ok(True)
+
+        chat_id = int(params['chat_id'])
+        markup = json.loads(params['reply_markup']) if params.get('reply_markup') else None
+        if method in SEND_METHODS:
+            message_id = self.message_ids[chat_id] = self.message_ids.get(chat_id, 0) + 1
+        else:
+            message_id = int(params.get('message_id') or 0)
+        self.inbox(chat_id).put_nowait((method, params.get('text') or params.get('caption') or '', markup,
+                                        message_id, time.monotonic()))
+
+        message = {'message_id': message_id, 'date': int(time.time()),
+                   'chat': {'id': chat_id, 'type': 'private'}, 'from': BOT_USER}
+        if params.get('text'):
+            message['text'] = params['text']
+        if method == 'sendphoto':
+            message['photo'] = [{'file_id': f"photo-{chat_id}-{message_id}",
+                                 'file_unique_id': f"u{chat_id}-{message_id}", 'width': 800, 'height': 600}]
+        if markup and 'inline_keyboard' in markup:
+            message['reply_markup'] = markup
+        return self._ok(message)
+
+    async def _get_updates(self, params):
+        self.polling.set()
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        async with self.arrived:
+            # offset подтверждает все апдейты до него
+            self.pending = [update for update in self.pending if update['update_id'] >= offset]
+            if not self.pending and timeout:
+                try:
+                    await asyncio.wait_for(self.arrived.wait_for(lambda: self.pending), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            batch = self.pending[:100]
+        if self.record:
+            for update in batch:
+                if update['update_id'] not in self.delivered:
+                    self.delivered.add(update['update_id'])
+                    self.record.write(json.dumps(
+                        {'t': round(time.monotonic() - self.started, 3), 'update': update}, ensure_ascii=False
+                    ) + '\n')
+        return batch
+
+    @staticmethod
+    def _ok(result):
+        return web.json_response({'ok': True, 'result': result})
+
+
+class StepFailed(Exception):
+    pass
+
+
+class SimUser:
+    """Виртуальный пользователь: шлет апдейты по одному и ждет ответа бота"""
+
+    def __init__(self, api, stats, user_id, rng, timeout, think, directory):
+        self.api = api
+        self.stats = stats
+        self.user_id = user_id
+        self.username = f"load{user_id}"
+        self.rng = rng
+        self.timeout = timeout
+        self.think = think
+        self.directory = directory
+        self.callback_ids = count(1)
+        self.mode = None
+        self.last_message_id = 0
+        self.last_method = None
+        self.markup = None
+
+    def _from(self):
+        return {'id': self.user_id, 'is_bot': False, 'first_name': 'Load', 'username': self.username}
+
+    def message(self, text):
+        return {'message': {
+            'message_id': next(self.callback_ids), 'date': int(time.time()), 'text': text,
+            'chat': {'id': self.user_id, 'type': 'private'}, 'from': self._from(),
+        }}
+
+    def callback(self, data):
+        return {'callback_query': {
+            'id': f"{self.user_id}-{next(self.callback_ids)}", 'from': self._from(), 'chat_instance': 'loadtest',
+            'data': data, 'message': {
+                'message_id': self.last_message_id, 'date': int(time.time()),
+                'chat': {'id': self.user_id, 'type': 'private'},
+            },
+        }}
+
+    def buttons(self, prefix):
+        rows = (self.markup or {}).get('inline_keyboard', [])
+        return [button['callback_data'] for row in rows for button in row
+                if button.get('callback_data', '').startswith(prefix)]
+
+    def pick(self, prefix, exclude=None):
+        found = [data for data in self.buttons(prefix) if not (exclude and data.startswith(exclude))]
+        if not found:
+            self.stats.error(f"no_button:{prefix}")
+            raise StepFailed(prefix)
+        return self.rng.choice(found)
+
+    async def step(self, name, update, expect=None):
+        """Отправляет апдейт и ждет первого ответа, в клавиатуре которого есть кнопка expect"""
+        inbox = self.api.inbox(self.user_id)
+        await asyncio.sleep(self.rng.uniform(*self.think))
+        # Поздние ответы прошлого шага к этому не относятся
+        while not inbox.empty():
+            inbox.get_nowait()
+        sent_at = await self.api.push(update)
+        deadline = sent_at + self.timeout
+        while True:
+            try:
+                method, text, markup, message_id, at = await asyncio.wait_for(
+                    inbox.get(), max(0.0, deadline - time.monotonic())
+                )
+            except asyncio.TimeoutError:
+                self.stats.error(f"timeout:{name}")
+                raise StepFailed(name)
+            if at < sent_at:
+                continue
+            self.markup = markup
+            self.last_message_id = message_id
+            self.last_method = method
+            if expect is None or self.buttons(expect):
+                self.stats.observe(name, at - sent_at)
+                return text
+
+    async def onboard(self):
+        await self.step('start', self.message('/start'), 'tz_')
+        await self.step('timezone', self.callback(f"tz_{self.rng.choice(TIMEZONES)}"), 'mode_')
+        await self.step('mode', self.callback(f"mode_{self.mode}"))
+        self.directory.append(self.username)
+
+    async def mark_days(self):
+        await self.step('calendar.open', self.message("📅 Календарь"), 'select_day_')
+        for _ in range(self.rng.randint(1, 3)):
+            await self.step('calendar.mark', self.callback(self.pick('select_day_')), 'select_day_')
+        await self.step('calendar.done', self.callback('done'))
+
+    async def add_task(self):
+        await self.step('calendar.open', self.message("📅 Календарь"), 'select_day_')
+        await self.step('task.day', self.callback(self.pick('select_day_')), 'skip_task')
+        await self.step('task.name', self.message(self.rng.choice(TASK_NAMES)), 'time_')
+        await self.step('task.time', self.callback(self.pick('time_', exclude='time_page_')), 'reminder_')
+        await self.step('task.reminder', self.callback(self.pick('reminder_')), 'repeat_')
+        if self.rng.random() < 0.1:
+            await self.step('task.repeat', self.callback('repeat_weekly'), 'repeat_count_')
+            await self.step('task.save', self.callback('repeat_count_4'), 'add_another_task')
+        else:
+            await self.step('task.save', self.callback('repeat_none'), 'add_another_task')
+        await self.step('calendar.back', self.callback('back_to_calendar'), 'select_day_')
+        await self.step('calendar.done', self.callback('done'))
+
+    async def group_lookup(self):
+        await self.step('group.open', self.message("👥 Общие дни"))
+        others = [name for name in self.rng.sample(self.directory, min(3, len(self.directory)))
+                  if name != self.username] or [self.username]
+        await self.step('group.lookup', self.message(' '.join(f"@{name}" for name in others)))
+        # Найденные дни бот присылает картинкой и сам возвращает в главное меню
+        if self.last_method != 'sendphoto':
+            await self.step('group.back', self.message("↩️ Назад"))
+
+    async def settings(self):
+        await self.step('settings.open', self.message("⚙️ Настройки"))
+        await self.step('settings.theme', self.message("🎨 Тема"), 'theme_')
+        await self.step('settings.set_theme', self.callback(self.pick('theme_')))
+        await self.step('settings.back', self.message("↩️ Главное меню"))
+
+    async def run(self, deadline, mix, todo_share):
+        self.mode = 'todo' if self.rng.random() < todo_share else 'meeting'
+        scenarios = {
+            'calendar': self.add_task if self.mode == 'todo' else self.mark_days,
+            'groups': self.group_lookup,
+            'settings': self.settings,
+        }
+        names = [name for name in mix if mix[name] > 0]
+        try:
+            await self.onboard()
+        except StepFailed:
+            return
+        while time.monotonic() < deadline:
+            scenario = scenarios[self.rng.choices(names, [mix[name] for name in names])[0]]
+            try:
+                await scenario()
+            except StepFailed:
+                # Как живой пользователь: после сбоя начинаем с главного меню
+                try:
+                    await self.step('recover', self.message('/start'))
+                except StepFailed:
+                    return
+
+
+async def run_users(api, stats, args):
+    mix = dict((name, float(weight)) for name, weight in (part.split('=') for part in args.mix.split(',')))
+    deadline = time.monotonic() + args.ramp + args.duration
+    directory = []
+    think = (args.think_min, args.think_max)
+
+    async def user(index):
+        await asyncio.sleep(args.ramp * index / args.users)
+        rng = random.Random(args.seed * 1000003 + index)
+        await SimUser(api, stats, args.first_user_id + index, rng, args.timeout, think, directory).run(
+            deadline, mix, args.todo_share
+        )
+
+    await asyncio.gather(*(user(index) for index in range(args.users)))
+
+
+def load_log(path, rate):
+    """(смещение в секундах, апдейт) из записи loadtest или из апдейтов Telegram по строке"""
+    entries = []
+    with open(path, encoding='utf-8') as log:
+        for line in log:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if 'update' in entry:
+                entries.append((entry['t'], entry['update']))
+            else:
+                entries.append((len(entries) / rate, entry))
+    return entries
+
+
+def update_chat(update):
+    for key in ('message', 'edited_message', 'callback_query', 'inline_query'):
+        if key in update:
+            item = update[key]
+            if 'chat' in item:
+                return item['chat']['id']
+            if 'message' in item:
+                return item['message']['chat']['id']
+            return item['from']['id']
+    return None
+
+
+async def replay(api, stats, args):
+    """Отдает апдейты из лога с исходными интервалами (ускоренными в speed раз).
+    Апдейты одного чата идут по порядку, разные чаты - параллельно"""
+    by_chat = {}
+    for offset, update in load_log(args.replay, args.rate):
+        by_chat.setdefault(update_chat(update), []).append((offset / args.speed, update))
+    started = time.monotonic()
+
+    async def play(chat_id, entries):
+        inbox = api.inbox(chat_id)
+        for offset, update in entries:
+            await asyncio.sleep(max(0.0, started + offset - time.monotonic()))
+            while not inbox.empty():
+                inbox.get_nowait()
+            sent_at = await api.push({key: value for key, value in update.items() if key != 'update_id'})
+            kind = next((key for key in update if key != 'update_id'), 'update')
+            try:
+                at = sent_at - 1
+                while at < sent_at:
+                    *_, at = await asyncio.wait_for(inbox.get(), max(0.0, sent_at + args.timeout - time.monotonic()))
+                stats.observe(f"replay.{kind}", at - sent_at)
+            except asyncio.TimeoutError:
+                # Не на каждый апдейт бот отвечает сообщением, это не всегда ошибка
+                stats.error(f"no_reply:{kind}")
+
+    await asyncio.gather(*(play(chat_id, entries) for chat_id, entries in by_chat.items()))
+
+
+def bot_environment(args, api_url):
+    env = dict(os.environ, BOT_TOKEN=FAKE_TOKEN, BOT_API_URL=api_url, DB_PATH=args.db, METRICS_ENABLED='0')
+    env.pop('WEB_PORT', None)
+    if args.unlimited:
+        # Снимаем лимиты gateway, чтобы мерить сам бот, а не ограничитель
+        for name in ('BOT_API_GLOBAL_RATE', 'BOT_API_GLOBAL_BURST', 'BOT_API_CHAT_RATE', 'BOT_API_CHAT_BURST'):
+            env[name] = '1000000'
+    return env
+
+
+async def start_bot(args, api_url, workdir):
+    """Запускает бота отдельным процессом или (--inprocess) в этом же цикле событий"""
+    env = bot_environment(args, api_url)
+    if args.inprocess:
+        os.environ.update(env)
+        import main
+        return asyncio.create_task(main.main())
+    log_path = os.path.join(workdir, 'bot.log')
+    print(f"Лог бота: {log_path}")
+    with open(log_path, 'wb') as log:
+        return await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py'),
+            env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+
+
+async def stop_bot(args, handle):
+    if args.inprocess:
+        from bot import dp
+        await dp.stop_polling()
+        await asyncio.gather(handle, return_exceptions=True)
+        return
+    handle.terminate()
+    try:
+        await asyncio.wait_for(handle.wait(), 10)
+    except asyncio.TimeoutError:
+        handle.kill()
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix='calendar-loadtest-')
+    args.db = args.db or os.path.join(workdir, 'loadtest.db')
+    stats = Stats()
+    record = open(args.record, 'w', encoding='utf-8') if args.record else None
+    api = FakeBotAPI(stats, args.flood_rate, record)
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_route('*', '/bot{token}/{method}', api.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', args.port)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    bot = await start_bot(args, f"http://127.0.0.1:{port}", workdir)
+    try:
+        await asyncio.wait_for(api.polling.wait(), 60)
+        stats.started = time.monotonic()
+        if args.replay:
+            await replay(api, stats, args)
+            header = f"Воспроизведение {args.replay} (x{args.speed})"
+        else:
+            await run_users(api, stats, args)
+            header = f"Пользователей: {args.users}, сценарии: {args.mix}"
+        report = stats.report()
+    finally:
+        await stop_bot(args, bot)
+        await runner.cleanup()
+        if record:
+            record.close()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report, header)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as output:
+            json.dump({'args': vars(args), **report}, output, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на заглушке Bot API")
+    parser.add_argument('--users', type=int, default=100, help="число виртуальных пользователей")
+    parser.add_argument('--duration', type=float, default=60, help="сколько секунд гонять сценарии после разгона")
+    parser.add_argument('--ramp', type=float, default=10, help="за сколько секунд подключаются все пользователи")
+    parser.add_argument('--mix', default='calendar=8,groups=1,settings=1',
+                        help="веса сценариев: calendar (дни или задачи по режиму), groups, settings")
+    parser.add_argument('--todo-share', type=float, default=0.5, help="доля пользователей в режиме to-do")
+    parser.add_argument('--think-min', type=float, default=0.5, help="пауза пользователя между шагами, от")
+    parser.add_argument('--think-max', type=float, default=2.0, help="пауза пользователя между шагами, до")
+    parser.add_argument('--timeout', type=float, default=15, help="сколько ждать ответа бота на шаг")
+    parser.add_argument('--seed', type=int, default=1, help="зерно случайных сценариев")
+    parser.add_argument('--first-user-id', type=int, default=10_000_000)
+    parser.add_argument('--replay', help="воспроизвести лог апдейтов вместо сценариев")
+    parser.add_argument('--speed', type=float, default=1.0, help="ускорение воспроизведения")
+    parser.add_argument('--rate', type=float, default=20, help="апдейтов в секунду для лога без отметок времени")
+    parser.add_argument('--record', help="записать выданные боту апдейты для --replay")
+    parser.add_argument('--flood-rate', type=float, default=0.0, help="доля отправок, на которые отвечать 429")
+    parser.add_argument('--unlimited', action='store_true', help="снять лимиты исходящих запросов бота")
+    parser.add_argument('--inprocess', action='store_true', help="запустить бота в этом же процессе")
+    parser.add_argument('--db', help="БД бота (по умолчанию новый файл во временном каталоге, :memory: - в памяти)")
+    parser.add_argument('--keep', action='store_true', help="не удалять временный каталог с БД и логом")
+    parser.add_argument('--port', type=int, default=0, help="порт заглушки Bot API (0 - любой свободный)")
+    parser.add_argument('--json', help="сохранить отчет в JSON")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,27 @@
 import asyncio
+import config
 from bot import run_bot
 from database import init_db
+from directory import user_directory
+from memstats import memory_monitor
 from scheduler import start_scheduler
+from web import start_web_server
 
 async def main():
-    await init_db()
+    db = await init_db()
+    await db.start_writer()
+    user_directory.load(await db.list_users())
+    if config.MEMORY_TRACEMALLOC_FRAMES:
+        memory_monitor.start_tracing(config.MEMORY_TRACEMALLOC_FRAMES)
+    if config.MEMORY_SAMPLE_INTERVAL:
+        asyncio.create_task(memory_monitor.run(config.MEMORY_SAMPLE_INTERVAL))
+    if config.WEB_PORT:
+        await start_web_server(config.WEB_PORT)
     asyncio.create_task(start_scheduler())
-    await run_bot()
+    try:
+        await run_bot()
+    finally:
+        await db.stop_writer()
 
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,759 @@
+import asyncio
+from bisect import bisect_left, bisect_right, insort
+import calendar
+from dataclasses import replace
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from itertools import islice
+import logging
+from math import log
+import re
+import unicodedata
+
+from database import (
+    EPOCH_DATE, SERIES_MONTH, UserProfile, add_series_to_digests, compute_reminder_time, day_ordinal,
+    make_series, pack_member_ids, spread_series_version, unpack_member_ids
+)
+from digest import next_digest
+from recurrence import month_occurrences, next_reminder
+
+logger = logging.getLogger(__name__)
+
+# Параметры bm25 в FTS5
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Буквы и цифры подряд; остальное, как и в unicode61, - разделители
+_TOKEN = re.compile(r'[^\W_]+')
+
+
+@lru_cache(maxsize=4096)
+def _fold_char(char):
+    decomposed = unicodedata.normalize('NFD', char)
+    if decomposed[0] < '\u0250':
+        return ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return char
+
+
+@lru_cache(maxsize=65536)
+def _fold(token):
+    """Как unicode61 remove_diacritics 2: нижний регистр, у латиницы без диакритики"""
+    token = token.lower()
+    if token.isascii():
+        return token
+    return ''.join(map(_fold_char, token))
+
+
+def tokenize(text):
+    """Токены как у токенизатора FTS5 unicode61"""
+    return [_fold(token) for token in _TOKEN.findall(text)]
+
+
+def _phrase_hits(tokens, phrase):
+    """Сколько раз фраза встречается в tokens; последний токен фразы ищется как префикс"""
+    *exact, prefix = phrase
+    size = len(phrase)
+    hits = 0
+    for i in range(len(tokens) - size + 1):
+        if tokens[i + size - 1].startswith(prefix) and tokens[i:i + size - 1] == exact:
+            hits += 1
+    return hits
+
+
+def _day_range(items, first, last):
+    """Срез отсортированного списка кортежей (day_ordinal, ...) с first по last включительно"""
+    return items[bisect_left(items, (first,)):bisect_left(items, (last + 1,))]
+
+
+class MemoryBackend:
+    """Хранилище в памяти процесса с той же семантикой, что у SQLiteBackend.
+
+    Строки таблиц лежат в словарях по id, а рядом - то, что в SQLite дают
+    индексы и триггеры: сводка месяцев, версии месяцев, отсортированные
+    списки задач и пометок по day_ordinal, очередь напоминаний и
+    инвертированный индекс для поиска. Методы меняют данные без await
+    посередине, поэтому в одном цикле событий каждый из них атомарен, как
+    транзакция. Данные живут до конца процесса: это фикстура для тестов и
+    бенчмарков без диска.
+    """
+
+    def __init__(self, db_path=':memory:'):
+        self.db_path = db_path
+        self.users = {}
+        self.calendar = {}
+        self.tasks = {}
+        self.group_requests = {}
+        # AUTOINCREMENT: id не переиспользуются после удаления
+        self._last_ids = {'user_calendar': 0, 'tasks': 0, 'group_requests': 0, 'task_series': 0}
+
+        self._user_ids_by_username = {}
+        # user_id -> отсортированный список (day_ordinal, id) пометок дней
+        self._calendar_by_user = {}
+        # user_id -> отсортированный список (day_ordinal, time, id) задач
+        self._tasks_by_user = {}
+        # (user_id, year, month) -> {day: [status, task_count]}, как month_summary
+        self._summary = {}
+        self._versions = {}
+        # (reminder_at, id) неотправленных задач, как idx_tasks_reminder_due
+        self._due = []
+        # (user_id, source_uid) -> id задачи, как уникальный idx_tasks_source_uid
+        self._task_by_source = {}
+        # (user_id, name) -> id сохраненной группы, как уникальный idx_group_requests_name
+        self._group_by_name = {}
+        # Повторяющиеся задачи: строки task_series, их id по пользователю, отмененные
+        # повторения (day_ordinal) по серии и (next_reminder_at, id), как idx_task_series_reminder_due
+        self.task_series = {}
+        self._series_by_user = {}
+        self._series_exceptions = {}
+        self._series_due = []
+        # user_id -> (digest_next_at, digest_day) и (digest_next_at, user_id), как idx_users_digest_due
+        self._digests = {}
+        self._digest_due = []
+        # Поиск: токены каждой задачи, задачи по токену и отсортированный словарь для префиксов
+        self._task_tokens = {}
+        self._postings = {}
+        self._vocabulary = []
+        self._token_total = 0
+
+    async def init_db(self):
+        logger.info(f"Данные хранятся в памяти процесса ({self.db_path})")
+
+    async def start_writer(self):
+        return None
+
+    async def stop_writer(self):
+        pass
+
+    def _next_id(self, table):
+        self._last_ids[table] += 1
+        return self._last_ids[table]
+
+    def _touch(self, user_id, year, month):
+        key = (user_id, year, month)
+        self._versions[key] = self._versions.get(key, 0) + 1
+
+    def _summary_entry(self, user_id, year, month, day):
+        return self._summary.setdefault((user_id, year, month), {}).setdefault(day, [None, 0])
+
+    def _drop_empty_summary(self, user_id, year, month, day):
+        days = self._summary[(user_id, year, month)]
+        status, task_count = days[day]
+        if status is None and task_count <= 0:
+            del days[day]
+            if not days:
+                del self._summary[(user_id, year, month)]
+
+    # Пользователи
+
+    async def get_user_profile(self, user_id):
+        return self.users.get(user_id)
+
+    async def user_exists(self, user_id):
+        return user_id in self.users
+
+    async def add_user(self, user_id, username, full_name):
+        if user_id in self.users:
+            return
+        self.users[user_id] = UserProfile(user_id, username or '', full_name or '')
+        insort(self._user_ids_by_username.setdefault((username or '').lower(), []), user_id)
+
+    def _update_user(self, user_id, **changes):
+        profile = self.users.get(user_id)
+        if profile is not None:
+            self.users[user_id] = replace(profile, **changes)
+
+    async def set_user_mode(self, user_id, mode):
+        self._update_user(user_id, mode=mode)
+
+    async def get_user_mode(self, user_id):
+        profile = self.users.get(user_id)
+        return profile.mode if profile else 'meeting'
+
+    async def set_user_reminder(self, user_id, reminder):
+        self._update_user(user_id, reminder=reminder)
+
+    async def get_user_reminder(self, user_id):
+        profile = self.users.get(user_id)
+        return profile.reminder if profile else 60
+
+    async def set_user_timezone(self, user_id, timezone):
+        self._update_user(user_id, timezone=timezone)
+        profile = self.users.get(user_id)
+        if profile and profile.digest_time:
+            await self.set_user_digest(user_id, profile.digest_time)
+
+    async def get_user_timezone(self, user_id):
+        profile = self.users.get(user_id)
+        return profile.timezone if profile else 'Europe/Moscow'
+
+    async def set_user_theme(self, user_id, theme):
+        self._update_user(user_id, theme=theme)
+
+    async def get_user_theme(self, user_id):
+        profile = self.users.get(user_id)
+        return profile.theme if profile else 'default'
+
+    def _schedule_digest(self, user_id, digest_time, after):
+        scheduled = self._digests.pop(user_id, None)
+        if scheduled:
+            self._digest_due.pop(bisect_left(self._digest_due, (scheduled[0], user_id)))
+        if digest_time:
+            next_at, day = next_digest(digest_time, self.users[user_id].timezone, after)
+            self._digests[user_id] = (next_at, (day - EPOCH_DATE).days)
+            insort(self._digest_due, (next_at, user_id))
+
+    async def set_user_digest(self, user_id, digest_time):
+        if user_id not in self.users:
+            return
+        self._update_user(user_id, digest_time=digest_time)
+        self._schedule_digest(user_id, digest_time, int(datetime.now(timezone.utc).timestamp()))
+
+    async def get_due_digests(self):
+        now_ts = int(datetime.now(timezone.utc).timestamp())
+        digests = {}
+        for _, user_id in self._digest_due[:bisect_right(self._digest_due, (now_ts, float('inf')))]:
+            ordinal = self._digests[user_id][1]
+            profile = self.users[user_id]
+            digests[user_id] = {
+                'user_id': user_id, 'timezone': profile.timezone, 'digest_time': profile.digest_time,
+                'day': EPOCH_DATE + timedelta(days=ordinal),
+                'tasks': [
+                    {'time': self.tasks[task_id]['time'], 'task': self.tasks[task_id]['task']}
+                    for *_, task_id in _day_range(self._tasks_by_user.get(user_id, []), ordinal, ordinal)
+                ],
+            }
+        if digests:
+            days = [digest['day'] for digest in digests.values()]
+            add_series_to_digests(digests, self._load_series(sorted(digests), min(days), max(days)))
+        return [digests[user_id] for user_id in sorted(digests)]
+
+    async def mark_digests_sent(self, digests):
+        now_ts = int(datetime.now(timezone.utc).timestamp())
+        for digest in digests:
+            profile = self.users.get(digest['user_id'])
+            if profile and profile.digest_time:
+                self._schedule_digest(digest['user_id'], profile.digest_time, now_ts)
+
+    async def get_user_ids_by_usernames(self, usernames):
+        return [
+            user_id
+            for username in dict.fromkeys(usernames)
+            for user_id in self._user_ids_by_username.get(username.lower(), ())
+        ]
+
+    async def list_users(self):
+        return [
+            (profile.user_id, profile.username, profile.full_name)
+            for profile in self.users.values() if profile.username
+        ]
+
+    # Дни календаря
+
+    def _insert_calendar(self, user_id, year, month, day, status):
+        row_id = self._next_id('user_calendar')
+        ordinal = day_ordinal(year, month, day)
+        self.calendar[row_id] = {
+            'id': row_id, 'user_id': user_id, 'year': year, 'month': month, 'day': day,
+            'status': status, 'day_ordinal': ordinal
+        }
+        insort(self._calendar_by_user.setdefault(user_id, []), (ordinal, row_id))
+        self._summary_entry(user_id, year, month, day)[0] = status
+        self._touch(user_id, year, month)
+
+    def _delete_calendar(self, row_id):
+        row = self.calendar.pop(row_id)
+        user_id, ordinal = row['user_id'], row['day_ordinal']
+        marks = self._calendar_by_user[user_id]
+        marks.pop(bisect_left(marks, (ordinal, row_id)))
+
+        # Статус дня - статус последней оставшейся пометки
+        remaining = _day_range(marks, ordinal, ordinal)
+        status = self.calendar[remaining[-1][1]]['status'] if remaining else None
+        self._summary_entry(user_id, row['year'], row['month'], row['day'])[0] = status
+        self._drop_empty_summary(user_id, row['year'], row['month'], row['day'])
+        self._touch(user_id, row['year'], row['month'])
+
+    def _delete_calendar_between(self, user_id, first, last):
+        for _, row_id in _day_range(self._calendar_by_user.get(user_id, []), first, last):
+            self._delete_calendar(row_id)
+
+    async def mark_day_busy(self, user_id, year, month, day):
+        self._insert_calendar(user_id, year, month, day, 'busy')
+
+    async def mark_day_free(self, user_id, year, month, day):
+        ordinal = day_ordinal(year, month, day)
+        self._delete_calendar_between(user_id, ordinal, ordinal)
+        self._delete_tasks_between(user_id, ordinal, ordinal)
+
+    async def reset_user_calendar(self, user_id, year, month):
+        _, days_in_month = calendar.monthrange(year, month)
+        first, last = day_ordinal(year, month, 1), day_ordinal(year, month, days_in_month)
+        self._delete_calendar_between(user_id, first, last)
+        self._delete_tasks_between(user_id, first, last)
+
+    async def get_user_calendar(self, user_id, month, year):
+        days = self._summary.get((user_id, year, month), {})
+        # День, у которого есть только задачи, считается занятым
+        calendar_days = {
+            day: {'status': status or 'busy', 'task_count': task_count}
+            for day, (status, task_count) in sorted(days.items())
+        }
+        for day, count in self._series_days([user_id], year, month).get(user_id, {}).items():
+            entry = calendar_days.setdefault(day, {'status': 'busy', 'task_count': 0})
+            entry['task_count'] += count
+        return calendar_days
+
+    async def get_month_version(self, user_id, year, month):
+        return self._versions.get((user_id, year, month), 0) + self._versions.get((user_id, *SERIES_MONTH), 0)
+
+    async def get_month_versions(self, user_ids, year, month):
+        return {user_id: await self.get_month_version(user_id, year, month) for user_id in user_ids}
+
+    async def get_user_month_versions(self, user_id, first, last):
+        versions = {}
+        year, month = first
+        while (year, month) <= tuple(last):
+            version = self._versions.get((user_id, year, month))
+            if version:
+                versions[(year, month)] = version
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        if (user_id, *SERIES_MONTH) in self._versions:
+            versions[SERIES_MONTH] = self._versions[(user_id, *SERIES_MONTH)]
+        return spread_series_version(versions, first, last)
+
+    async def find_common_free_days(self, user_ids, year, month):
+        if not user_ids or len(user_ids) > 20:
+            return []
+
+        _, days_in_month = calendar.monthrange(year, month)
+        busy_days = set()
+        for user_id in user_ids:
+            for day, (status, task_count) in self._summary.get((user_id, year, month), {}).items():
+                if status == 'busy' or task_count > 0:
+                    busy_days.add(day)
+        for days in self._series_days(user_ids, year, month).values():
+            busy_days.update(days)
+        return sorted(set(range(1, days_in_month + 1)) - busy_days)
+
+    async def get_month_busy_days(self, user_ids, year, month):
+        busy = {}
+        for user_id in user_ids:
+            days = self._summary.get((user_id, year, month), {})
+            busy[user_id] = [day for day, (status, task_count) in days.items() if status == 'busy' or task_count > 0]
+        for user_id, days in self._series_days(user_ids, year, month).items():
+            busy[user_id] = sorted(set(busy[user_id]).union(days))
+        return busy
+
+    async def get_busy_days_between(self, user_id, start, end):
+        marks = _day_range(
+            self._calendar_by_user.get(user_id, []), (start - EPOCH_DATE).days, (end - EPOCH_DATE).days
+        )
+        busy = {}
+        for ordinal, row_id in marks:
+            if self.calendar[row_id]['status'] == 'busy':
+                busy.setdefault(ordinal)
+        return [EPOCH_DATE + timedelta(days=ordinal) for ordinal in busy]
+
+    # Задачи
+
+    def _insert_task(self, user_id, year, month, day, task_text, task_time, reminder, reminder_time,
+                     reminder_sent=0, source_uid=None):
+        task_id = self._next_id('tasks')
+        ordinal = day_ordinal(year, month, day)
+        reminder_at = int(reminder_time.timestamp())
+        self.tasks[task_id] = {
+            'id': task_id, 'user_id': user_id, 'year': year, 'month': month, 'day': day,
+            'task': task_text, 'time': task_time, 'reminder': reminder,
+            # Строка в том же виде, в каком ее сохраняет адаптер sqlite3
+            'reminder_time': reminder_time.isoformat(' '),
+            'reminder_at': reminder_at, 'reminder_sent': reminder_sent, 'day_ordinal': ordinal,
+            'source_uid': source_uid
+        }
+        insort(self._tasks_by_user.setdefault(user_id, []), (ordinal, task_time or '', task_id))
+        self._summary_entry(user_id, year, month, day)[1] += 1
+        if not reminder_sent:
+            insort(self._due, (reminder_at, task_id))
+        if source_uid is not None:
+            self._task_by_source[(user_id, source_uid)] = task_id
+        self._index_task(task_id, task_text)
+        self._touch(user_id, year, month)
+        return task_id
+
+    def _delete_task(self, task_id):
+        row = self.tasks.pop(task_id)
+        user_id = row['user_id']
+        tasks = self._tasks_by_user[user_id]
+        tasks.pop(bisect_left(tasks, (row['day_ordinal'], row['time'] or '', task_id)))
+        self._summary_entry(user_id, row['year'], row['month'], row['day'])[1] -= 1
+        self._drop_empty_summary(user_id, row['year'], row['month'], row['day'])
+        if not row['reminder_sent']:
+            self._due.pop(bisect_left(self._due, (row['reminder_at'], task_id)))
+        self._unindex_task(task_id)
+        if row['source_uid'] is not None:
+            del self._task_by_source[(user_id, row['source_uid'])]
+        self._touch(user_id, row['year'], row['month'])
+        return row
+
+    def _delete_tasks_between(self, user_id, first, last):
+        for *_, task_id in _day_range(self._tasks_by_user.get(user_id, []), first, last):
+            self._delete_task(task_id)
+
+    def _day_tasks(self, user_id, year, month, day):
+        ordinal = day_ordinal(year, month, day)
+        return _day_range(self._tasks_by_user.get(user_id, []), ordinal, ordinal)
+
+    def _short_task(self, task_id):
+        row = self.tasks[task_id]
+        return {'id': task_id, 'task': row['task'], 'time': row['time']}
+
+    async def add_task(self, user_id, year, month, day, task_text, task_time, reminder):
+        user_timezone = await self.get_user_timezone(user_id)
+        reminder_time = compute_reminder_time(user_timezone, year, month, day, task_time, reminder)
+        self._insert_task(user_id, year, month, day, task_text, task_time, reminder, reminder_time)
+
+    async def import_batch(self, user_id, tasks, busy_days):
+        user_timezone = await self.get_user_timezone(user_id)
+        now = datetime.now(timezone.utc)
+        added_tasks = 0
+        for year, month, day, task_text, task_time, reminder, source_uid in tasks:
+            if source_uid is not None and (user_id, source_uid) in self._task_by_source:
+                continue
+            reminder_time = compute_reminder_time(user_timezone, year, month, day, task_time, reminder)
+            self._insert_task(
+                user_id, year, month, day, task_text, task_time, reminder, reminder_time,
+                reminder_sent=int(reminder_time <= now), source_uid=source_uid
+            )
+            added_tasks += 1
+
+        added_days = 0
+        for year, month, day in dict.fromkeys(busy_days):
+            ordinal = day_ordinal(year, month, day)
+            marks = _day_range(self._calendar_by_user.get(user_id, []), ordinal, ordinal)
+            if any(self.calendar[row_id]['status'] == 'busy' for _, row_id in marks):
+                continue
+            self._insert_calendar(user_id, year, month, day, 'busy')
+            added_days += 1
+        return added_tasks, added_days
+
+    async def get_tasks_for_day(self, user_id, year, month, day):
+        return [self._short_task(task_id) for *_, task_id in self._day_tasks(user_id, year, month, day)]
+
+    async def get_tasks_page(self, user_id, year, month, day, after=None, limit=10):
+        """Одна страница задач дня по (time, id) после курсора after = (time, id).
+        Возвращает (задачи, есть ли еще)."""
+        items = self._day_tasks(user_id, year, month, day)
+        if after:
+            items = items[bisect_right(items, (items[0][0], *after)):] if items else items
+        tasks = [self._short_task(task_id) for *_, task_id in items[:limit]]
+        return tasks, len(items) > limit
+
+    async def get_task_by_id(self, task_id):
+        row = self.tasks.get(task_id)
+        if row is None:
+            return None
+        return {
+            key: row[key]
+            for key in ('id', 'user_id', 'year', 'month', 'day', 'task', 'time', 'reminder', 'reminder_time')
+        }
+
+    async def delete_task(self, task_id):
+        if task_id not in self.tasks:
+            return False
+        row = self._delete_task(task_id)
+
+        # Если это была последняя задача дня, снимаем и пометку дня
+        if not self._day_tasks(row['user_id'], row['year'], row['month'], row['day']):
+            ordinal = row['day_ordinal']
+            self._delete_calendar_between(row['user_id'], ordinal, ordinal)
+        return True
+
+    async def get_tasks_between(self, user_id, start, end):
+        items = _day_range(
+            self._tasks_by_user.get(user_id, []), (start - EPOCH_DATE).days, (end - EPOCH_DATE).days
+        )
+        return [
+            {key: self.tasks[task_id][key]
+             for key in ('id', 'year', 'month', 'day', 'task', 'time', 'reminder')}
+            for *_, task_id in items
+        ]
+
+    async def get_tasks_for_reminders(self, horizon=0):
+        now_ts = int(datetime.now(timezone.utc).timestamp())
+        due = self._due[:bisect_right(self._due, (now_ts + horizon, float('inf')))]
+        return [
+            {key: self.tasks[task_id][key] for key in ('id', 'user_id', 'task', 'time', 'reminder_at')}
+            for _, task_id in due
+        ]
+
+    async def mark_reminder_sent(self, task_id):
+        row = self.tasks.get(task_id)
+        if row is None:
+            return
+        if not row['reminder_sent']:
+            self._due.pop(bisect_left(self._due, (row['reminder_at'], task_id)))
+            row['reminder_sent'] = 1
+
+    # Повторяющиеся задачи
+
+    def _series(self, series_id, first=None, last=None):
+        row = self.task_series[series_id]
+        exceptions = self._series_exceptions.get(series_id, set())
+        if first is not None:
+            exceptions = [ordinal for ordinal in exceptions if first <= ordinal <= last]
+        return make_series(
+            series_id, row['user_id'], row['task'], row['time'], row['reminder'], row['freq'],
+            row['interval'], row['start_ordinal'], row['until_ordinal'], exceptions
+        )
+
+    def _load_series(self, user_ids, start, end):
+        first, last = (start - EPOCH_DATE).days, (end - EPOCH_DATE).days
+        found = []
+        for user_id in user_ids:
+            for series_id in sorted(self._series_by_user.get(user_id, ())):
+                row = self.task_series[series_id]
+                if row['start_ordinal'] <= last and (row['until_ordinal'] is None or row['until_ordinal'] >= first):
+                    found.append(self._series(series_id, first, last))
+        return found
+
+    def _series_days(self, user_ids, year, month):
+        _, days_in_month = calendar.monthrange(year, month)
+        series = self._load_series(user_ids, date(year, month, 1), date(year, month, days_in_month))
+        return month_occurrences(series, year, month)
+
+    async def _refresh_series_reminder(self, series_id, after=None):
+        row = self.task_series.get(series_id)
+        if row is None:
+            return
+        if row['next_reminder_at'] is not None:
+            self._series_due.pop(bisect_left(self._series_due, (row['next_reminder_at'], series_id)))
+        after = after or int(datetime.now(timezone.utc).timestamp())
+        found = next_reminder(self._series(series_id), await self.get_user_timezone(row['user_id']), after)
+        row['next_reminder_at'] = found[1] if found else None
+        if found:
+            insort(self._series_due, (found[1], series_id))
+
+    async def add_task_series(self, user_id, year, month, day, task_text, task_time, reminder,
+                              freq, interval=1, until=None):
+        series_id = self._next_id('task_series')
+        self.task_series[series_id] = {
+            'id': series_id, 'user_id': user_id, 'task': task_text, 'time': task_time, 'reminder': reminder,
+            'freq': freq, 'interval': interval, 'start_ordinal': day_ordinal(year, month, day),
+            'until_ordinal': (until - EPOCH_DATE).days if until else None, 'next_reminder_at': None,
+        }
+        self._series_by_user.setdefault(user_id, set()).add(series_id)
+        await self._refresh_series_reminder(series_id)
+        self._touch(user_id, *SERIES_MONTH)
+        return series_id
+
+    async def get_series_between(self, user_id, start, end):
+        return self._load_series([user_id], start, end)
+
+    async def skip_occurrences(self, series_id, days):
+        row = self.task_series.get(series_id)
+        if row is None:
+            return
+        exceptions = self._series_exceptions.setdefault(series_id, set())
+        for day in days:
+            ordinal = (day - EPOCH_DATE).days
+            if ordinal not in exceptions:
+                exceptions.add(ordinal)
+                self._touch(row['user_id'], *SERIES_MONTH)
+        await self._refresh_series_reminder(series_id)
+
+    def _delete_series(self, series_id):
+        row = self.task_series.pop(series_id)
+        self._series_by_user[row['user_id']].discard(series_id)
+        self._series_exceptions.pop(series_id, None)
+        if row['next_reminder_at'] is not None:
+            self._series_due.pop(bisect_left(self._series_due, (row['next_reminder_at'], series_id)))
+        self._touch(row['user_id'], *SERIES_MONTH)
+
+    def _delete_series_exception(self, key):
+        series_id, ordinal = key
+        self._series_exceptions[series_id].discard(ordinal)
+
+    async def delete_series(self, series_id):
+        if series_id not in self.task_series:
+            return False
+        self._delete_series(series_id)
+        return True
+
+    async def get_series_for_reminders(self, horizon=0):
+        now_ts = int(datetime.now(timezone.utc).timestamp())
+        due = self._series_due[:bisect_right(self._series_due, (now_ts + horizon, float('inf')))]
+        return [
+            {'id': series_id, 'user_id': self.task_series[series_id]['user_id'],
+             'task': self.task_series[series_id]['task'], 'time': self.task_series[series_id]['time'],
+             'reminder_at': reminder_at}
+            for reminder_at, series_id in due
+        ]
+
+    async def mark_series_reminder_sent(self, series_id, reminder_at):
+        now_ts = int(datetime.now(timezone.utc).timestamp())
+        await self._refresh_series_reminder(series_id, max(reminder_at, now_ts))
+
+    # Поиск
+
+    def _index_task(self, task_id, text):
+        tokens = tokenize(text or '')
+        self._task_tokens[task_id] = tokens
+        self._token_total += len(tokens)
+        for token in set(tokens):
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = set()
+                insort(self._vocabulary, token)
+            postings.add(task_id)
+
+    def _unindex_task(self, task_id):
+        tokens = self._task_tokens.pop(task_id)
+        self._token_total -= len(tokens)
+        for token in set(tokens):
+            postings = self._postings[token]
+            postings.discard(task_id)
+            if not postings:
+                del self._postings[token]
+                self._vocabulary.pop(bisect_left(self._vocabulary, token))
+
+    def _phrase_rows(self, phrase):
+        """Задачи всех пользователей, где встречается фраза (для idf, как в FTS5)"""
+        *exact, prefix = phrase
+        rows = set()
+        for token in islice(self._vocabulary, bisect_left(self._vocabulary, prefix), None):
+            if not token.startswith(prefix):
+                break
+            rows |= self._postings[token]
+        for token in exact:
+            rows &= self._postings.get(token, set())
+        if exact:
+            rows = {task_id for task_id in rows if _phrase_hits(self._task_tokens[task_id], phrase)}
+        return rows
+
+    async def search_tasks(self, user_id, text, limit=20):
+        """Задачи пользователя, подходящие под text: сначала самые релевантные, затем самые поздние.
+        Совпадения и ранжирование повторяют FTS5 MATCH и bm25 из SQLiteBackend."""
+        phrases = [tokenize(word) for word in text.split()]
+        if not phrases or not all(phrases):
+            return []
+
+        matches = [self._phrase_rows(phrase) for phrase in phrases]
+        found = set.intersection(*matches)
+        found = [task_id for task_id in found if self.tasks[task_id]['user_id'] == user_id]
+        if not found:
+            return []
+
+        # bm25 с весом 0 у колонки owner: в длину документа она добавляет один токен
+        row_count = len(self._task_tokens)
+        avgdl = (row_count + self._token_total) / row_count
+        idf = [max(log((row_count - len(rows) + 0.5) / (len(rows) + 0.5)), 1e-6) for rows in matches]
+
+        def rank(task_id):
+            tokens = self._task_tokens[task_id]
+            length = 1 + len(tokens)
+            score = 0.0
+            for phrase, weight in zip(phrases, idf):
+                freq = float(_phrase_hits(tokens, phrase))
+                num = freq * (BM25_K1 + 1.0)
+                denom = freq + BM25_K1 * (1 - BM25_B + BM25_B * length / avgdl)
+                score += weight * num / denom
+            return -score
+
+        def latest(task_id):
+            row = self.tasks[task_id]
+            return row['year'], row['month'], row['day'], row['time'] or ''
+
+        found.sort(key=latest, reverse=True)
+        found.sort(key=rank)
+        return [
+            {key: self.tasks[task_id][key] for key in ('id', 'year', 'month', 'day', 'task', 'time')}
+            for task_id in found[:limit]
+        ]
+
+    # Сохраненные группы
+
+    @staticmethod
+    def _group_row(row):
+        return {'id': row['id'], 'user_id': row['user_id'], 'name': row['name'],
+                'user_ids': unpack_member_ids(row['user_ids'])}
+
+    async def save_group(self, user_id, name, member_ids):
+        now = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        group_id = self._group_by_name.get((user_id, name))
+        if group_id is None:
+            group_id = self._next_id('group_requests')
+            self._group_by_name[(user_id, name)] = group_id
+        self.group_requests[group_id] = {
+            'id': group_id, 'user_id': user_id, 'name': name,
+            'user_ids': pack_member_ids(member_ids), 'created_at': now
+        }
+        return group_id
+
+    async def get_user_groups(self, user_id):
+        rows = (row for row in self.group_requests.values() if row['user_id'] == user_id and row['name'] is not None)
+        return [self._group_row(row) for row in sorted(rows, key=lambda row: row['name'])]
+
+    async def get_group(self, group_id):
+        row = self.group_requests.get(group_id)
+        return self._group_row(row) if row and row['name'] is not None else None
+
+    async def delete_group(self, group_id):
+        row = self.group_requests.get(group_id)
+        if not row or row['name'] is None:
+            return False
+        del self.group_requests[group_id]
+        del self._group_by_name[(row['user_id'], row['name'])]
+        return True
+
+    # Чистка
+
+    async def cleanup_old_data(self, calendar_days=60, task_days=60, group_days=30,
+                               batch_size=500, pause=0.05, vacuum_pages=256):
+        """Удаляет то же, что SQLiteBackend.cleanup_old_data. Файла нет, поэтому
+        пауз и vacuum нет, а bytes_reclaimed всегда 0."""
+        today = datetime.now().date()
+
+        def day_key(days):
+            return (today - timedelta(days=days) - EPOCH_DATE).days
+
+        def older(index, cutoff):
+            return sorted(
+                item[-1]
+                for items in index.values()
+                for item in items[:bisect_left(items, (cutoff,))]
+            )
+
+        group_cutoff = (datetime.now(timezone.utc) - timedelta(days=group_days)).strftime('%Y-%m-%d %H:%M:%S')
+        # Строки каждого правила ищутся перед его удалением: исключения
+        # удаленных серий уходят вместе с сериями и отдельно не считаются
+        rules = [
+            ('user_calendar', lambda: older(self._calendar_by_user, day_key(calendar_days)), self._delete_calendar),
+            ('tasks', lambda: older(self._tasks_by_user, day_key(task_days)), self._delete_task),
+            ('task_series',
+             lambda: sorted(
+                 series_id for series_id, row in self.task_series.items()
+                 if row['until_ordinal'] is not None and row['until_ordinal'] < day_key(task_days)
+             ),
+             self._delete_series),
+            ('task_series_exceptions',
+             lambda: sorted(
+                 (series_id, ordinal) for series_id, ordinals in self._series_exceptions.items()
+                 for ordinal in ordinals if ordinal < day_key(task_days)
+             ),
+             self._delete_series_exception),
+            ('group_requests',
+             lambda: sorted(
+                 row_id for row_id, row in self.group_requests.items()
+                 if row['created_at'] < group_cutoff and row['name'] is None
+             ),
+             self.group_requests.pop),
+        ]
+
+        report = {'rows': {}, 'bytes_reclaimed': 0}
+        for table, find, delete in rules:
+            ids = find()
+            for start in range(0, len(ids), batch_size):
+                for row_id in ids[start:start + batch_size]:
+                    delete(row_id)
+                await asyncio.sleep(0)
+            report['rows'][table] = len(ids)
+        return report
@@ -0,0 +1,175 @@
+from collections import Counter, deque
+import asyncio
+import gc
+import logging
+import os
+import time
+import tracemalloc
+
+import config
+import metrics
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+# Аллокации самого tracemalloc и импорта модулей в снимках только мешают
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+def current_rss():
+    """Резидентная память процесса в байтах; None, если узнать нельзя (не Linux)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss():
+    if resource is None:
+        return None
+    # В Linux ru_maxrss в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryMonitor:
+    """Наблюдение за памятью долгоживущего процесса.
+
+    Постоянный режим дешевый: раз в interval секунд снимаются RSS и размеры
+    зарегистрированных структур процесса (словари чатов, кэши, очереди) в
+    кольцевую историю, по которой видно, что растет. tracemalloc включается
+    по запросу: каждый следующий снимок сравнивается с предыдущим, и
+    отдаются строки кода с наибольшим приростом аллокаций.
+    """
+
+    def __init__(self, history_size=1440):
+        self.sizes = {}
+        self.history = deque(maxlen=history_size)
+        self.baseline = None
+        self.baseline_at = None
+
+    def register(self, name, function):
+        """Структура процесса, размер которой (число записей) стоит отслеживать"""
+        self.sizes[name] = function
+        metrics.registry_entries.set_function(function, name)
+
+    def registry_sizes(self):
+        sizes = {}
+        for name, function in self.sizes.items():
+            try:
+                sizes[name] = function()
+            except Exception as e:
+                logger.warning(f"Не удалось узнать размер {name}: {e}")
+        return sizes
+
+    def sample(self):
+        entry = {'at': int(time.time()), 'rss': current_rss(), 'sizes': self.registry_sizes()}
+        self.history.append(entry)
+        return entry
+
+    async def run(self, interval):
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Ошибка при замере памяти: {e}")
+            await asyncio.sleep(interval)
+
+    def growth(self):
+        """Изменение RSS и размеров структур с первого замера в истории до последнего"""
+        if len(self.history) < 2:
+            return None
+        first, last = self.history[0], self.history[-1]
+        return {
+            'seconds': last['at'] - first['at'],
+            'rss': last['rss'] - first['rss'] if first['rss'] is not None and last['rss'] is not None else None,
+            'sizes': {
+                name: size - first['sizes'][name]
+                for name, size in last['sizes'].items() if name in first['sizes']
+            },
+        }
+
+    def report(self, types=0):
+        """Сводка: текущая и пиковая память, структуры, рост по истории.
+        types > 0 добавляет самые многочисленные типы объектов (обходит всю кучу, дорого)"""
+        report = {
+            'rss': current_rss(),
+            'peak_rss': peak_rss(),
+            'sizes': self.registry_sizes(),
+            'growth': self.growth(),
+            'samples': len(self.history),
+            'gc_counts': gc.get_count(),
+            'tracemalloc': self.tracing_status(),
+        }
+        if types:
+            objects = gc.get_objects()
+            report['objects'] = len(objects)
+            report['types'] = Counter(type(obj).__name__ for obj in objects).most_common(types)
+        return report
+
+    def tracing_status(self):
+        if not tracemalloc.is_tracing():
+            return {'tracing': False}
+        traced, peak = tracemalloc.get_traced_memory()
+        return {
+            'tracing': True, 'frames': tracemalloc.get_traceback_limit(),
+            'traced': traced, 'peak': peak, 'overhead': tracemalloc.get_tracemalloc_memory(),
+            'baseline_at': self.baseline_at,
+        }
+
+    def start_tracing(self, frames=1):
+        """Включает tracemalloc и запоминает исходный снимок. Замедляет аллокации
+        в разы, поэтому в работе включается ненадолго"""
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        tracemalloc.start(frames)
+        self._take_baseline()
+        logger.info(f"tracemalloc включен, кадров стека: {frames}")
+
+    def stop_tracing(self):
+        tracemalloc.stop()
+        self.baseline = self.baseline_at = None
+        logger.info("tracemalloc выключен")
+
+    def _take_baseline(self):
+        self.baseline = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+        self.baseline_at = int(time.time())
+        return self.baseline
+
+    def snapshot_diff(self, limit=20, group_by='lineno'):
+        """Места с наибольшим приростом памяти с прошлого снимка; новый снимок
+        становится точкой отсчета для следующего вызова"""
+        if not tracemalloc.is_tracing():
+            return None
+        previous, since = self.baseline, self.baseline_at
+        current = self._take_baseline()
+        stats = current.compare_to(previous, group_by) if previous else current.statistics(group_by)
+        return {
+            'since': since,
+            'total': sum(stat.size for stat in current.statistics('filename')),
+            'top': [
+                {
+                    'where': [str(frame) for frame in stat.traceback.format()] if group_by == 'traceback'
+                    else str(stat.traceback[0]),
+                    'size': stat.size,
+                    'size_diff': getattr(stat, 'size_diff', stat.size),
+                    'count': stat.count,
+                    'count_diff': getattr(stat, 'count_diff', stat.count),
+                }
+                for stat in stats[:limit]
+            ],
+        }
+
+
+memory_monitor = MemoryMonitor(config.MEMORY_HISTORY_SIZE)
+metrics.process_rss.set_function(lambda: current_rss() or 0)
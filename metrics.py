@@ -0,0 +1,194 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+import time
+
+from config import METRICS_ENABLED
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (8_000, 16_000, 32_000, 64_000, 128_000, 256_000, 512_000, 1_000_000)
+LAG_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 900, 3600)
+
+
+class Registry:
+    """Хранит метрики процесса и отдает их в текстовом формате Prometheus.
+
+    Пока enabled выключен, observe/inc ничего не делают, а Histogram.time
+    не вызывает даже perf_counter.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry(METRICS_ENABLED)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        registry.register(self)
+
+    def inc(self, *labels, amount=1):
+        if not registry.enabled:
+            return
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Gauge:
+    """Значение снимается в момент выгрузки функцией, заданной через set_function"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._functions = {}
+        registry.register(self)
+
+    def set(self, value, *labels):
+        if not registry.enabled:
+            return
+        self._values[labels] = value
+
+    def set_function(self, function, *labels):
+        self._functions[labels] = function
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        values = dict(self._values)
+        for labels, function in self._functions.items():
+            values[labels] = function()
+        for labels, value in values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [счетчики по корзинам (+Inf последней), сумма]
+        self._series = {}
+        registry.register(self)
+
+    def observe(self, value, *labels):
+        if not registry.enabled:
+            return
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        if not registry.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else _format_value(bound)
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, ('le', le))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+handler_latency = Histogram(
+    'bot_handler_latency_seconds', 'Время работы обработчика апдейта',
+    ('handler', 'state')
+)
+db_query_latency = Histogram(
+    'bot_db_query_seconds', 'Время выполнения запроса к БД', ('query',)
+)
+render_latency = Histogram(
+    'bot_render_seconds', 'Время рендера картинки календаря'
+)
+render_bytes = Histogram(
+    'bot_render_bytes', 'Размер картинки календаря', buckets=SIZE_BUCKETS
+)
+reminder_lag = Histogram(
+    'bot_reminder_lag_seconds', 'Задержка отправки напоминания относительно reminder_time',
+    buckets=LAG_BUCKETS
+)
+reminders_sent = Counter(
+    'bot_reminders_total', 'Отправленные напоминания по результату', ('result',)
+)
+send_retries = Counter(
+    'bot_reminder_send_retries_total', 'Повторные попытки отправки напоминаний'
+)
+queue_depth = Gauge(
+    'bot_queue_depth', 'Глубина внутренних очередей', ('queue',)
+)
+retention_rows = Counter(
+    'bot_retention_deleted_rows_total', 'Строки, удаленные чисткой старых данных', ('table',)
+)
+retention_bytes = Counter(
+    'bot_retention_reclaimed_bytes_total', 'Байты, возвращенные инкрементальным vacuum'
+)
+outbound_wait = Histogram(
+    'bot_outbound_wait_seconds', 'Ожидание исходящего запроса в очереди лимитов', ('lane',)
+)
+outbound_throttled = Counter(
+    'bot_outbound_retry_after_total', 'Ответы 429 от Bot API по полосе', ('lane',)
+)
+feed_requests = Counter(
+    'bot_feed_requests_total', 'Запросы ICS-ленты по коду ответа', ('status',)
+)
+process_rss = Gauge(
+    'bot_process_resident_memory_bytes', 'Резидентная память процесса'
+)
+registry_entries = Gauge(
+    'bot_registry_entries', 'Число записей в структурах процесса', ('registry',)
+)
@@ -0,0 +1,69 @@
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery
+import logging
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class CallbackAck:
+    """Ответ на callback-запрос, отправляется не более одного раза"""
+
+    def __init__(self, bot, callback_query: CallbackQuery):
+        self.bot = bot
+        self.callback_query = callback_query
+        self.answered = False
+
+    async def __call__(self, text=None, show_alert=False):
+        if self.answered:
+            return
+        self.answered = True
+        try:
+            await self.bot.answer_callback_query(self.callback_query.id, text, show_alert=show_alert)
+        except Exception as e:
+            logger.error(f"Ошибка ответа на callback {self.callback_query.id}: {e}")
+
+
+class CallbackAckMiddleware(BaseMiddleware):
+    """Гарантирует ответ на каждый callback-запрос, даже если обработчик не нашелся или упал.
+
+    Подключается внешним middleware; сам ответ обычно уходит раньше, см. EarlyCallbackAckMiddleware.
+    """
+
+    async def __call__(self, handler, event: CallbackQuery, data):
+        ack = CallbackAck(data['bot'], event)
+        data['ack'] = ack
+        try:
+            return await handler(event, data)
+        finally:
+            if not ack.answered:
+                await ack()
+
+
+class EarlyCallbackAckMiddleware(BaseMiddleware):
+    """Отвечает на callback до запуска обработчика, чтобы часики в клиенте пропали сразу.
+
+    Внутренний middleware: обработчик уже выбран. Обработчик, который принимает
+    `ack`, отвечает сам (например, с текстом по результату) и должен сделать это
+    до обращений к БД; остальным ответ уходит здесь, до их работы.
+    """
+
+    async def __call__(self, handler, event: CallbackQuery, data):
+        handler_object = data.get('handler')
+        if handler_object is None or 'ack' not in handler_object.params:
+            await data['ack']()
+        return await handler(event, data)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Замеряет время обработчика с разбивкой по имени обработчика и состоянию FSM"""
+
+    async def __call__(self, handler, event, data):
+        if not metrics.registry.enabled:
+            return await handler(event, data)
+
+        handler_object = data.get('handler')
+        name = handler_object.callback.__name__ if handler_object else 'unknown'
+        state = data.get('raw_state') or 'none'
+        with metrics.handler_latency.time(name, state):
+            return await handler(event, data)
@@ -0,0 +1,95 @@
+import calendar
+from datetime import date, datetime, timedelta
+
+import pytz
+
+FREQUENCIES = ('daily', 'weekly', 'monthly')
+
+
+def _add_months(start, months):
+    """Тот же день через months месяцев; в коротком месяце - его последний день"""
+    index = start.year * 12 + start.month - 1 + months
+    year, month = index // 12, index % 12 + 1
+    return date(year, month, min(start.day, calendar.monthrange(year, month)[1]))
+
+
+def occurrence(freq, interval, start, index):
+    """Дата повторения серии с номером index (с нуля)"""
+    if freq == 'daily':
+        return start + timedelta(days=index * interval)
+    if freq == 'weekly':
+        return start + timedelta(weeks=index * interval)
+    return _add_months(start, index * interval)
+
+
+def _first_index(freq, interval, start, since):
+    """Номер первого повторения не раньше since"""
+    if since <= start:
+        return 0
+    if freq in ('daily', 'weekly'):
+        step = interval * (7 if freq == 'weekly' else 1)
+        return -(-(since - start).days // step)
+    index = ((since.year - start.year) * 12 + since.month - start.month) // interval
+    while occurrence(freq, interval, start, index) < since:
+        index += 1
+    return index
+
+
+def iter_occurrences(series, since):
+    """Даты повторений серии начиная с since по порядку, без исключенных.
+    Генератор: повторения считаются, только пока их берут"""
+    index = _first_index(series['freq'], series['interval'], series['start'], since)
+    while True:
+        day = occurrence(series['freq'], series['interval'], series['start'], index)
+        if series['until'] and day > series['until']:
+            return
+        if day not in series['exceptions']:
+            yield day
+        index += 1
+
+
+def occurrences_between(series, first, last):
+    """Повторения серии с first по last включительно"""
+    days = []
+    for day in iter_occurrences(series, first):
+        if day > last:
+            break
+        days.append(day)
+    return days
+
+
+def month_occurrences(series_list, year, month):
+    """{user_id: {day: число повторений}} серий в месяце"""
+    first = date(year, month, 1)
+    last = date(year, month, calendar.monthrange(year, month)[1])
+    counts = {}
+    for series in series_list:
+        days = counts.setdefault(series['user_id'], {})
+        for day in occurrences_between(series, first, last):
+            days[day.day] = days.get(day.day, 0) + 1
+    return counts
+
+
+def last_occurrence(freq, interval, start, count):
+    """Дата count-го повторения: конец серии, заданной числом повторов"""
+    return occurrence(freq, interval, start, count - 1)
+
+
+def next_reminder(series, user_timezone, after):
+    """(дата, reminder_at) ближайшего повторения, напоминание которого позже
+    момента after (секунды Unix); None, если повторений больше нет"""
+    from database import compute_reminder_time
+    try:
+        tz = pytz.timezone(user_timezone)
+    except pytz.UnknownTimeZoneError:
+        tz = pytz.timezone('Europe/Moscow')
+    # Напоминание приходит раньше задачи, поэтому первое подходящее
+    # повторение не раньше дня момента after плюс reminder минут
+    since = (datetime.fromtimestamp(after, tz) + timedelta(minutes=series['reminder'])).date() - timedelta(days=1)
+    for day in iter_occurrences(series, since):
+        reminder_at = int(compute_reminder_time(
+            user_timezone, day.year, day.month, day.day, series['time'], series['reminder']
+        ).timestamp())
+        if reminder_at > after:
+            return day, reminder_at
+    return None
@@ -0,0 +1,125 @@
+"""Перекладывает данные бота в другое число шардов.
+
+    python reshard.py calendar_bot.db --shards 4
+    python reshard.py calendar_bot.shard0of2.db calendar_bot.shard1of2.db --shards 4 --target calendar_bot.db
+
+Исходные файлы не меняются: их копии доводятся до текущей схемы во
+временном каталоге рядом с целевым файлом, поэтому там нужно место под
+копию. Файлы шардов не должны существовать. Бот на время переноса должен
+быть остановлен. Строки копируются в порядке id, а
+сводки, версии месяцев и поисковый индекс в шардах строят их триггеры.
+id задач в шардах выдаются заново.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import tempfile
+
+import aiosqlite
+
+from database import SQLiteBackend
+from sharding import shard_index, shard_paths
+
+logger = logging.getLogger(__name__)
+
+# Копируемые колонки; сгенерированные и вычисляемые триггерами таблицы не переносятся
+TABLES = {
+    'users': ('user_id', 'username', 'full_name', 'mode', 'reminder', 'timezone', 'theme', 'created_at',
+              'digest_time', 'digest_next_at', 'digest_day'),
+    'user_calendar': ('user_id', 'year', 'month', 'day', 'status', 'updated_at'),
+    'tasks': ('user_id', 'year', 'month', 'day', 'task', 'time', 'reminder', 'reminder_time',
+              'reminder_sent', 'created_at', 'reminder_at', 'source_uid'),
+    'group_requests': ('user_id', 'name', 'user_ids', 'created_at'),
+}
+SERIES_COLUMNS = ('user_id', 'task', 'time', 'reminder', 'freq', 'interval', 'start_ordinal',
+                  'until_ordinal', 'next_reminder_at', 'created_at')
+
+
+async def copy_shard(sources, target, index, count):
+    async with aiosqlite.connect(target) as conn:
+        await conn.create_function('shard_index', 1, lambda user_id: shard_index(user_id, count))
+        copied = dict.fromkeys((*TABLES, 'task_series'), 0)
+        for source in sources:
+            await conn.execute("ATTACH DATABASE ? AS src", (source,))
+            await conn.execute("BEGIN")
+            for table, columns in TABLES.items():
+                names = ', '.join(columns)
+                order = 'user_id' if table == 'users' else 'id'
+                cursor = await conn.execute(
+                    f"INSERT INTO main.{table} ({names}) SELECT {names} FROM src.{table} "
+                    f"WHERE shard_index(user_id) = ? ORDER BY {order}",
+                    (index,)
+                )
+                copied[table] += cursor.rowcount
+            copied['task_series'] += await copy_series(conn, index)
+            await conn.commit()
+            await conn.execute("DETACH DATABASE src")
+    return copied
+
+
+async def copy_series(conn, index):
+    """Серии получают новые id, поэтому их исключения переносятся вслед за каждой серией"""
+    names = ', '.join(SERIES_COLUMNS)
+    cursor = await conn.execute(
+        f"SELECT id, {names} FROM src.task_series WHERE shard_index(user_id) = ? ORDER BY id", (index,)
+    )
+    copied = 0
+    for source_id, *values in await cursor.fetchall():
+        cursor = await conn.execute(
+            f"INSERT INTO main.task_series ({names}) VALUES ({', '.join('?' * len(values))})", values
+        )
+        await conn.execute(
+            "INSERT INTO main.task_series_exceptions (series_id, day_ordinal) "
+            "SELECT ?, day_ordinal FROM src.task_series_exceptions WHERE series_id = ? ORDER BY day_ordinal",
+            (cursor.lastrowid, source_id)
+        )
+        copied += 1
+    return copied
+
+
+async def reshard(sources, target, count):
+    missing = [source for source in sources if not os.path.exists(source)]
+    if missing:
+        raise SystemExit(f"Нет исходных файлов: {', '.join(missing)}")
+    paths = shard_paths(target, count)
+    existing = [path for path in paths if os.path.exists(path)]
+    if existing:
+        raise SystemExit(f"Файлы шардов уже существуют: {', '.join(existing)}")
+
+    with tempfile.TemporaryDirectory(prefix='reshard-', dir=os.path.dirname(os.path.abspath(target))) as workdir:
+        copies = []
+        for number, source in enumerate(sources):
+            # Копия доводится до текущей схемы, чтобы колонки совпали; сам источник
+            # не мигрируется (миграции меняют схему и делают VACUUM)
+            copy = os.path.join(workdir, f"source{number}.db")
+            src, dst = sqlite3.connect(source), sqlite3.connect(copy)
+            try:
+                src.backup(dst)
+            finally:
+                src.close()
+                dst.close()
+            await SQLiteBackend(copy).init_db()
+            copies.append(copy)
+
+        for index, path in enumerate(paths):
+            await SQLiteBackend(path).init_db()
+            copied = await copy_shard(copies, path, index, count)
+            rows = ', '.join(f"{table}: {rows}" for table, rows in copied.items())
+            logger.info(f"Шард {path}: {rows}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос данных бота в N шардов по user_id")
+    parser.add_argument('sources', nargs='+', help="исходные файлы БД (один файл или все старые шарды)")
+    parser.add_argument('--shards', type=int, required=True, help="новое число шардов (DB_SHARDS)")
+    parser.add_argument('--target', help="DB_PATH, от которого строятся имена шардов (по умолчанию первый источник)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(reshard(args.sources, args.target or args.sources[0], args.shards))
+
+
+if __name__ == '__main__':
+    main()
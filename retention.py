@@ -0,0 +1,34 @@
+import asyncio
+import logging
+import config
+import metrics
+from database import open_database
+
+logger = logging.getLogger(__name__)
+
+async def run_retention_once(db):
+    report = await db.cleanup_old_data(
+        calendar_days=config.RETENTION_CALENDAR_DAYS,
+        task_days=config.RETENTION_TASK_DAYS,
+        group_days=config.RETENTION_GROUP_DAYS,
+        batch_size=config.RETENTION_BATCH_SIZE,
+        pause=config.RETENTION_PAUSE_MS / 1000
+    )
+    for table, rows in report['rows'].items():
+        metrics.retention_rows.inc(table, amount=rows)
+    metrics.retention_bytes.inc(amount=max(report['bytes_reclaimed'], 0))
+
+    rows = ', '.join(f"{table}: {count}" for table, count in report['rows'].items())
+    logger.info(f"Чистка старых данных: удалено строк ({rows}), освобождено {report['bytes_reclaimed']} байт")
+    return report
+
+
+async def run_retention():
+    db = open_database()
+    while True:
+        try:
+            await run_retention_once(db)
+        except Exception as e:
+            logger.error(f"Ошибка чистки старых данных: {e}")
+
+        await asyncio.sleep(config.RETENTION_INTERVAL_HOURS * 3600)
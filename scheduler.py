@@ -1,8 +1,13 @@
 import asyncio
 from datetime import datetime, timezone
-from database import Database
+from database import open_database
 from bot import bot
+import config
+from digest import format_digest
+from gateway import BACKGROUND, set_lane
 import logging
+import metrics
+from retention import run_retention
 
 logger = logging.getLogger(__name__)
 
@@ -10,35 +15,99 @@ async def send_with_retry(chat_id, text, max_retries=3, delay=2):
     for attempt in range(max_retries):
         try:
             await bot.send_message(chat_id, text)
+            metrics.reminders_sent.inc('ok')
             return True
         except Exception as e:
             logger.error(f"Ошибка отправки напоминания (попытка {attempt+1}): {e}")
             if attempt < max_retries - 1:
+                metrics.send_retries.inc()
                 await asyncio.sleep(delay)
+    metrics.reminders_sent.inc('failed')
     return False
 
+def observe_reminder_lag(task):
+    """Сколько секунд прошло между моментом напоминания задачи и фактической отправкой"""
+    if not metrics.registry.enabled or task.get('reminder_at') is None:
+        return
+    metrics.reminder_lag.observe(datetime.now(timezone.utc).timestamp() - task['reminder_at'])
+
+def coalesce_reminders(tasks, series, now_ts):
+    """Напоминания по пользователям: {user_id: [(вид, напоминание)]} по времени.
+    Пользователь попадает в рассылку, если хотя бы одно его напоминание уже
+    наступило; остальные из окна уходят тем же сообщением, а не отдельными"""
+    batches = {}
+    for kind, items in (('task', tasks), ('series', series)):
+        for item in items:
+            batches.setdefault(item['user_id'], []).append((kind, item))
+    return {
+        user_id: sorted(items, key=lambda entry: entry[1]['reminder_at'])
+        for user_id, items in batches.items()
+        if any(item['reminder_at'] <= now_ts for _, item in items)
+    }
+
+def format_reminders(items):
+    if len(items) == 1:
+        return f"⏰ Напоминание!\nЗадача: {items[0][1]['task']}"
+    lines = ["⏰ Напоминания:"]
+    lines += [f"• {item.get('time') or ''} — {item['task']}" for _, item in items]
+    return '\n'.join(lines)
+
+async def send_reminders(db):
+    now_ts = int(datetime.now(timezone.utc).timestamp())
+    window = config.REMINDER_COALESCE_SECONDS
+    tasks = await db.get_tasks_for_reminders(window)
+    series = await db.get_series_for_reminders(window)
+    batches = coalesce_reminders(tasks, series, now_ts)
+    
+    logger.info(f"Найдено задач для напоминания: {len(tasks)}, повторяющихся: {len(series)}, "
+                f"сообщений: {len(batches)}")
+    metrics.queue_depth.set(len(tasks) + len(series), 'reminders_due')
+    
+    for user_id, items in batches.items():
+        if not await send_with_retry(user_id, format_reminders(items)):
+            logger.error(f"Не удалось отправить напоминания пользователю {user_id}")
+            continue
+        for kind, item in items:
+            if item['reminder_at'] <= now_ts:
+                observe_reminder_lag(item)
+            # У серии в очереди только ближайшее повторение; после отправки
+            # вычисляется следующее
+            if kind == 'series':
+                await db.mark_series_reminder_sent(item['id'], item['reminder_at'])
+            else:
+                await db.mark_reminder_sent(item['id'])
+        logger.info(f"Напоминания пользователю {user_id} отправлены: {len(items)}")
+
+async def send_digests(db):
+    """Сводки дня всех пользователей, у которых подошло время, за один запрос к БД"""
+    digests = await db.get_due_digests()
+    if not digests:
+        return
+    handled = []
+    for digest in digests:
+        # День без задач сводку не присылает, но время следующей все равно сдвигается.
+        # Неотправленная остается к отправке и повторяется на следующем проходе
+        if digest['tasks'] and not await send_with_retry(digest['user_id'], format_digest(digest['day'], digest['tasks'])):
+            logger.error(f"Не удалось отправить сводку дня пользователю {digest['user_id']}")
+            continue
+        handled.append(digest)
+    if handled:
+        await db.mark_digests_sent(handled)
+    logger.info(f"Сводок дня обработано: {len(handled)} из {len(digests)}")
+
 async def check_reminders():
-    db = Database()
+    # Рассылка уступает очередь к Bot API запросам пользователей
+    set_lane(BACKGROUND)
+    db = open_database()
     while True:
         try:
-            tasks = await db.get_tasks_for_reminders()
-            
-            logger.info(f"Найдено задач для напоминания: {len(tasks)}")
-            
-            for task in tasks:
-                text = f"⏰ Напоминание!\nЗадача: {task['task']}"
-                success = await send_with_retry(task['user_id'], text)
-                
-                if success:
-                    await db.mark_reminder_sent(task['id'])
-                    logger.info(f"Напоминание для задачи {task['id']} отправлено")
-                else:
-                    logger.error(f"Не удалось отправить напоминание для задачи {task['id']}")
-        
+            await send_reminders(db)
+            await send_digests(db)
         except Exception as e:
             logger.error(f"Ошибка в планировщике: {e}")
         
         await asyncio.sleep(60)
 
 async def start_scheduler():
-    asyncio.create_task(check_reminders())
\ No newline at end of file
+    asyncio.create_task(check_reminders())
+    asyncio.create_task(run_retention())
\ No newline at end of file
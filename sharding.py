@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import os
+import zlib
+
+from database import SQLiteBackend
+
+logger = logging.getLogger(__name__)
+
+
+def shard_index(user_id, count):
+    """Номер шарда пользователя; crc32 не зависит от процесса и версии Python"""
+    return zlib.crc32(str(user_id).encode()) % count
+
+
+def shard_paths(db_path, count):
+    """Файлы шардов рядом с db_path: calendar_bot.db -> calendar_bot.shard0of4.db, ..."""
+    if count == 1:
+        return [db_path]
+    root, ext = os.path.splitext(db_path)
+    return [f"{root}.shard{index}of{count}{ext}" for index in range(count)]
+
+
+class ShardedBackend:
+    """Пользователи, разложенные по нескольким файлам SQLite по хэшу user_id.
+
+    Каждый шард - обычный SQLiteBackend со своим писателем и кэшем профилей,
+    поэтому записи разных шардов не ждут одну блокировку. Все данные
+    пользователя лежат в его шарде; операции над несколькими пользователями
+    опрашивают нужные шарды параллельно и сливают ответы.
+
+    id задач в шардах независимы, поэтому наружу отдается id * count + номер
+    шарда: по нему задача однозначно находится обратно.
+    """
+
+    def __init__(self, db_path, count):
+        self.db_path = db_path
+        self.count = count
+        self.shards = [SQLiteBackend(path) for path in shard_paths(db_path, count)]
+
+    def _shard(self, user_id):
+        return self.shards[shard_index(user_id, self.count)]
+
+    def _locate(self, task_id):
+        local_id, index = divmod(task_id, self.count)
+        return self.shards[index], local_id
+
+    def _group(self, user_ids):
+        groups = {}
+        for user_id in user_ids:
+            groups.setdefault(shard_index(user_id, self.count), []).append(user_id)
+        return {self.shards[index]: members for index, members in groups.items()}
+
+    def _with_global_ids(self, rows, shard):
+        index = self.shards.index(shard)
+        return [{**row, 'id': row['id'] * self.count + index} for row in rows]
+
+    async def _each(self, method, *args, **kwargs):
+        return await asyncio.gather(*(getattr(shard, method)(*args, **kwargs) for shard in self.shards))
+
+    async def init_db(self):
+        paths = [shard.db_path for shard in self.shards]
+        if os.path.exists(self.db_path) and not all(os.path.exists(path) for path in paths):
+            raise RuntimeError(
+                f"{self.db_path} не разложен на {self.count} шардов, "
+                f"сначала выполните: python reshard.py {self.db_path} --shards {self.count}"
+            )
+        await self._each('init_db')
+        logger.info(f"Пользователи разложены по {self.count} шардам: {', '.join(paths)}")
+
+    async def start_writer(self):
+        return await self._each('start_writer')
+
+    async def stop_writer(self):
+        await self._each('stop_writer')
+
+    # Пользователи
+
+    async def get_user_profile(self, user_id):
+        return await self._shard(user_id).get_user_profile(user_id)
+
+    async def user_exists(self, user_id):
+        return await self._shard(user_id).user_exists(user_id)
+
+    async def add_user(self, user_id, username, full_name):
+        await self._shard(user_id).add_user(user_id, username, full_name)
+
+    async def set_user_mode(self, user_id, mode):
+        await self._shard(user_id).set_user_mode(user_id, mode)
+
+    async def get_user_mode(self, user_id):
+        return await self._shard(user_id).get_user_mode(user_id)
+
+    async def set_user_reminder(self, user_id, reminder):
+        await self._shard(user_id).set_user_reminder(user_id, reminder)
+
+    async def get_user_reminder(self, user_id):
+        return await self._shard(user_id).get_user_reminder(user_id)
+
+    async def set_user_timezone(self, user_id, timezone):
+        await self._shard(user_id).set_user_timezone(user_id, timezone)
+
+    async def get_user_timezone(self, user_id):
+        return await self._shard(user_id).get_user_timezone(user_id)
+
+    async def set_user_theme(self, user_id, theme):
+        await self._shard(user_id).set_user_theme(user_id, theme)
+
+    async def get_user_theme(self, user_id):
+        return await self._shard(user_id).get_user_theme(user_id)
+
+    async def set_user_digest(self, user_id, digest_time):
+        await self._shard(user_id).set_user_digest(user_id, digest_time)
+
+    async def get_due_digests(self):
+        results = await self._each('get_due_digests')
+        return sorted((digest for digests in results for digest in digests), key=lambda digest: digest['user_id'])
+
+    async def mark_digests_sent(self, digests):
+        groups = {}
+        for digest in digests:
+            groups.setdefault(self._shard(digest['user_id']), []).append(digest)
+        await asyncio.gather(*(shard.mark_digests_sent(items) for shard, items in groups.items()))
+
+    async def get_user_ids_by_usernames(self, usernames):
+        found = await self.user_ids_by_username(usernames)
+        return [user_id for user_ids in found.values() for user_id in user_ids]
+
+    async def user_ids_by_username(self, usernames):
+        if not usernames:
+            return {}
+        # Юзернейм не говорит, в каком шарде пользователь, поэтому спрашиваем все
+        results = await self._each('user_ids_by_username', usernames)
+        merged = {}
+        for username in dict.fromkeys(usernames):
+            user_ids = sorted(user_id for found in results for user_id in found.get(username, ()))
+            if user_ids:
+                merged[username] = user_ids
+        return merged
+
+    async def list_users(self):
+        results = await self._each('list_users')
+        return [user for users in results for user in users]
+
+    # Дни календаря
+
+    async def mark_day_busy(self, user_id, year, month, day):
+        await self._shard(user_id).mark_day_busy(user_id, year, month, day)
+
+    async def mark_day_free(self, user_id, year, month, day):
+        await self._shard(user_id).mark_day_free(user_id, year, month, day)
+
+    async def reset_user_calendar(self, user_id, year, month):
+        await self._shard(user_id).reset_user_calendar(user_id, year, month)
+
+    async def get_user_calendar(self, user_id, month, year):
+        return await self._shard(user_id).get_user_calendar(user_id, month, year)
+
+    async def get_month_version(self, user_id, year, month):
+        return await self._shard(user_id).get_month_version(user_id, year, month)
+
+    async def get_month_versions(self, user_ids, year, month):
+        groups = self._group(user_ids)
+        results = await asyncio.gather(*(
+            shard.get_month_versions(members, year, month) for shard, members in groups.items()
+        ))
+        versions = {}
+        for result in results:
+            versions.update(result)
+        return {user_id: versions[user_id] for user_id in user_ids}
+
+    async def get_user_month_versions(self, user_id, first, last):
+        return await self._shard(user_id).get_user_month_versions(user_id, first, last)
+
+    async def find_common_free_days(self, user_ids, year, month):
+        if not user_ids or len(user_ids) > 20:
+            return []
+
+        groups = self._group(user_ids)
+        results = await asyncio.gather(*(
+            shard.find_common_free_days(members, year, month) for shard, members in groups.items()
+        ))
+        return sorted(set.intersection(*(set(days) for days in results)))
+
+    async def get_month_busy_days(self, user_ids, year, month):
+        groups = self._group(user_ids)
+        results = await asyncio.gather(*(
+            shard.get_month_busy_days(members, year, month) for shard, members in groups.items()
+        ))
+        busy = {}
+        for result in results:
+            busy.update(result)
+        return {user_id: busy[user_id] for user_id in user_ids}
+
+    async def get_busy_days_between(self, user_id, start, end):
+        return await self._shard(user_id).get_busy_days_between(user_id, start, end)
+
+    # Повторяющиеся задачи лежат в шарде пользователя, id серий - как у задач
+
+    async def add_task_series(self, user_id, year, month, day, task_text, task_time, reminder,
+                              freq, interval=1, until=None):
+        shard = self._shard(user_id)
+        series_id = await shard.add_task_series(
+            user_id, year, month, day, task_text, task_time, reminder, freq, interval, until
+        )
+        return series_id * self.count + self.shards.index(shard)
+
+    async def get_series_between(self, user_id, start, end):
+        shard = self._shard(user_id)
+        return self._with_global_ids(await shard.get_series_between(user_id, start, end), shard)
+
+    async def skip_occurrences(self, series_id, days):
+        shard, local_id = self._locate(series_id)
+        await shard.skip_occurrences(local_id, days)
+
+    async def delete_series(self, series_id):
+        shard, local_id = self._locate(series_id)
+        return await shard.delete_series(local_id)
+
+    async def get_series_for_reminders(self, horizon=0):
+        results = await self._each('get_series_for_reminders', horizon)
+        series = [
+            item
+            for shard, rows in zip(self.shards, results)
+            for item in self._with_global_ids(rows, shard)
+        ]
+        return sorted(series, key=lambda item: item['reminder_at'])
+
+    async def mark_series_reminder_sent(self, series_id, reminder_at):
+        shard, local_id = self._locate(series_id)
+        await shard.mark_series_reminder_sent(local_id, reminder_at)
+
+    # Сохраненные группы лежат в шарде владельца, id - как у задач
+
+    async def save_group(self, user_id, name, member_ids):
+        shard = self._shard(user_id)
+        return await shard.save_group(user_id, name, member_ids) * self.count + self.shards.index(shard)
+
+    async def get_user_groups(self, user_id):
+        shard = self._shard(user_id)
+        return self._with_global_ids(await shard.get_user_groups(user_id), shard)
+
+    async def get_group(self, group_id):
+        shard, local_id = self._locate(group_id)
+        group = await shard.get_group(local_id)
+        return group and {**group, 'id': group_id}
+
+    async def delete_group(self, group_id):
+        shard, local_id = self._locate(group_id)
+        return await shard.delete_group(local_id)
+
+    # Задачи
+
+    async def add_task(self, user_id, year, month, day, task_text, task_time, reminder):
+        await self._shard(user_id).add_task(user_id, year, month, day, task_text, task_time, reminder)
+
+    async def import_batch(self, user_id, tasks, busy_days):
+        return await self._shard(user_id).import_batch(user_id, tasks, busy_days)
+
+    async def get_tasks_for_day(self, user_id, year, month, day):
+        shard = self._shard(user_id)
+        return self._with_global_ids(await shard.get_tasks_for_day(user_id, year, month, day), shard)
+
+    async def get_tasks_page(self, user_id, year, month, day, after=None, limit=10):
+        shard = self._shard(user_id)
+        if after:
+            # Внутри шарда порядок локальных id тот же, что у глобальных
+            after = (after[0], self._locate(after[1])[1])
+        tasks, has_more = await shard.get_tasks_page(user_id, year, month, day, after, limit)
+        return self._with_global_ids(tasks, shard), has_more
+
+    async def get_task_by_id(self, task_id):
+        shard, local_id = self._locate(task_id)
+        task = await shard.get_task_by_id(local_id)
+        return task and {**task, 'id': task_id}
+
+    async def delete_task(self, task_id):
+        shard, local_id = self._locate(task_id)
+        return await shard.delete_task(local_id)
+
+    async def search_tasks(self, user_id, text, limit=20):
+        shard = self._shard(user_id)
+        return self._with_global_ids(await shard.search_tasks(user_id, text, limit), shard)
+
+    async def get_tasks_between(self, user_id, start, end):
+        shard = self._shard(user_id)
+        return self._with_global_ids(await shard.get_tasks_between(user_id, start, end), shard)
+
+    async def get_tasks_for_reminders(self, horizon=0):
+        results = await self._each('get_tasks_for_reminders', horizon)
+        tasks = [
+            task
+            for shard, rows in zip(self.shards, results)
+            for task in self._with_global_ids(rows, shard)
+        ]
+        return sorted(tasks, key=lambda task: task['reminder_at'])
+
+    async def mark_reminder_sent(self, task_id):
+        shard, local_id = self._locate(task_id)
+        await shard.mark_reminder_sent(local_id)
+
+    # Чистка
+
+    async def cleanup_old_data(self, calendar_days=60, task_days=60, group_days=30,
+                               batch_size=500, pause=0.05, vacuum_pages=256):
+        reports = await self._each(
+            'cleanup_old_data', calendar_days, task_days, group_days, batch_size, pause, vacuum_pages
+        )
+        report = {'rows': {}, 'bytes_reclaimed': 0}
+        for shard_report in reports:
+            for table, rows in shard_report['rows'].items():
+                report['rows'][table] = report['rows'].get(table, 0) + rows
+            report['bytes_reclaimed'] += shard_report['bytes_reclaimed']
+        return report
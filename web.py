@@ -0,0 +1,145 @@
+from aiohttp import web
+from email.utils import format_datetime, parsedate_to_datetime
+import hmac
+import logging
+import config
+import metrics
+from feed import FEED_FOOTER, FEED_HEADER, check_feed_token, feed_builder
+from memstats import memory_monitor
+
+logger = logging.getLogger(__name__)
+
+routes = web.RouteTableDef()
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+@routes.get('/')
+async def health(request):
+    return web.Response(text='ok')
+
+
+@routes.get('/metrics')
+async def metrics_endpoint(request):
+    if not metrics.registry.enabled:
+        raise web.HTTPNotFound(text='metrics disabled')
+    return web.Response(
+        body=metrics.registry.render().encode('utf-8'),
+        headers={'Content-Type': PROMETHEUS_CONTENT_TYPE}
+    )
+
+
+def check_debug_token(request):
+    """Отладочные ручки памяти доступны только с MEMORY_DEBUG_TOKEN в заголовке или параметре token"""
+    if not config.MEMORY_DEBUG_TOKEN:
+        raise web.HTTPNotFound()
+    header = request.headers.get('Authorization', '')
+    token = header[len('Bearer '):] if header.startswith('Bearer ') else request.query.get('token', '')
+    if not hmac.compare_digest(token.encode(), config.MEMORY_DEBUG_TOKEN.encode()):
+        raise web.HTTPNotFound()
+
+
+def int_param(request, name, default, limit):
+    try:
+        return max(0, min(limit, int(request.query.get(name, default))))
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"{name} должен быть числом")
+
+
+@routes.get('/debug/memory')
+async def memory_report(request):
+    """RSS, размеры структур процесса и их рост по истории; ?types=N - N самых частых типов объектов"""
+    check_debug_token(request)
+    return web.json_response(memory_monitor.report(int_param(request, 'types', 0, 200)))
+
+
+@routes.get('/debug/memory/history')
+async def memory_history(request):
+    check_debug_token(request)
+    return web.json_response(list(memory_monitor.history))
+
+
+@routes.post('/debug/memory/tracemalloc')
+async def memory_tracing_start(request):
+    check_debug_token(request)
+    memory_monitor.start_tracing(int_param(request, 'frames', 1, 64) or 1)
+    return web.json_response(memory_monitor.tracing_status())
+
+
+@routes.delete('/debug/memory/tracemalloc')
+async def memory_tracing_stop(request):
+    check_debug_token(request)
+    memory_monitor.stop_tracing()
+    return web.json_response(memory_monitor.tracing_status())
+
+
+@routes.get('/debug/memory/snapshot')
+async def memory_snapshot(request):
+    """Прирост аллокаций с прошлого снимка: ?limit=N, ?group=lineno|filename|traceback"""
+    check_debug_token(request)
+    group_by = request.query.get('group', 'lineno')
+    if group_by not in ('lineno', 'filename', 'traceback'):
+        raise web.HTTPBadRequest(text="group: lineno, filename или traceback")
+    diff = memory_monitor.snapshot_diff(int_param(request, 'limit', 20, 500), group_by)
+    if diff is None:
+        raise web.HTTPConflict(text="tracemalloc выключен: POST /debug/memory/tracemalloc")
+    return web.json_response(diff)
+
+
+@routes.get('/calendar/{user_id}/{token}.ics')
+async def calendar_feed(request):
+    try:
+        user_id = int(request.match_info['user_id'])
+    except ValueError:
+        user_id = None
+    if user_id is None or not check_feed_token(user_id, request.match_info['token']):
+        metrics.feed_requests.inc('404')
+        raise web.HTTPNotFound()
+
+    state = await feed_builder.state(user_id)
+    if state is None:
+        metrics.feed_requests.inc('404')
+        raise web.HTTPNotFound()
+    profile, months, versions, seen = state
+    headers = {
+        'ETag': seen['etag'],
+        'Last-Modified': format_datetime(seen['last_modified'], usegmt=True),
+        'Cache-Control': 'private, max-age=300',
+    }
+
+    # Календарные клиенты опрашивают ленту часто: без изменений - 304 без тела
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        not_modified = seen['etag'] in (tag.strip() for tag in if_none_match.split(',')) or if_none_match.strip() == '*'
+    else:
+        try:
+            since = parsedate_to_datetime(request.headers.get('If-Modified-Since', ''))
+            not_modified = since.tzinfo is not None and since >= seen['last_modified']
+        except (TypeError, ValueError):
+            not_modified = False
+    if not_modified:
+        metrics.feed_requests.inc('304')
+        return web.Response(status=304, headers=headers)
+
+    response = web.StreamResponse(headers={**headers, 'Content-Type': 'text/calendar; charset=utf-8'})
+    await response.prepare(request)
+    await response.write(FEED_HEADER)
+    for year, month in months:
+        # Месяцы отдаются по мере готовности, лента целиком в памяти не собирается
+        chunk = await feed_builder.month_chunk(profile, year, month, versions.get((year, month), 0))
+        if chunk:
+            await response.write(chunk)
+    await response.write(FEED_FOOTER)
+    await response.write_eof()
+    metrics.feed_requests.inc('200')
+    return response
+
+
+async def start_web_server(port):
+    app = web.Application()
+    app.add_routes(routes)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', int(port)).start()
+    logger.info(f"HTTP-сервер запущен на порту {port}")
+    return runner
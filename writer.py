@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WriteQueue:
+    """Единственный писатель в БД: принимает операции из всех обработчиков
+    и коммитит их группами.
+
+    Каждая операция - это async-функция work(uow), как для Database.atomic.
+    Внутри группы операция выполняется в своем SAVEPOINT, поэтому ошибка
+    одной операции не откатывает соседние. Future вызывающего разрешается
+    только после commit всей группы.
+    """
+
+    def __init__(self, db_path, uow_factory, batch_size=100, batch_delay=0.005):
+        self.db_path = db_path
+        self.uow_factory = uow_factory
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.queue = asyncio.Queue()
+        self._conn = None
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        self._conn = await aiosqlite.connect(self.db_path)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self.running:
+            return
+        self.queue.put_nowait((_STOP, None))
+        await self._task
+        await self._conn.close()
+        # Операции, поставленные после _STOP, уже не выполнятся: вызывающие не должны ждать вечно
+        while not self.queue.empty():
+            _, future = self.queue.get_nowait()
+            if future is not None and not future.done():
+                future.set_exception(RuntimeError("Писатель БД остановлен"))
+
+    async def submit(self, work):
+        if not self.running:
+            raise RuntimeError("Писатель БД остановлен")
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((work, future))
+        # Отмена ожидающего не отменяет уже поставленную в очередь запись
+        return await asyncio.shield(future)
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def _drain(self, batch):
+        while len(batch) < self.batch_size and batch[-1][0] is not _STOP and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        self._drain(batch)
+        if len(batch) < self.batch_size and batch[-1][0] is not _STOP and self.batch_delay > 0:
+            # Даем соседним обработчикам несколько миллисекунд, чтобы попасть в тот же commit
+            await asyncio.sleep(self.batch_delay)
+            self._drain(batch)
+        return batch
+
+    async def _run(self):
+        uow = self.uow_factory(self._conn)
+        while True:
+            batch = await self._collect()
+            stop = batch[-1][0] is _STOP
+            if stop:
+                batch.pop()
+            if batch:
+                await self._commit(batch, uow)
+            if stop:
+                return
+
+    async def _commit(self, batch, uow):
+        outcomes = []
+        try:
+            await self._conn.execute("BEGIN IMMEDIATE")
+            for work, future in batch:
+                await self._conn.execute("SAVEPOINT write_op")
+                try:
+                    result = await work(uow)
+                except Exception as e:
+                    await self._conn.execute("ROLLBACK TO write_op")
+                    outcomes.append((future, None, e))
+                else:
+                    outcomes.append((future, result, None))
+                await self._conn.execute("RELEASE write_op")
+            await self._conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка группового commit ({len(batch)} операций): {e}")
+            try:
+                await self._conn.rollback()
+            except Exception:
+                pass
+            outcomes = [(future, None, e) for _, future in batch]
+
+        for future, result, error in outcomes:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)